@@ -0,0 +1,68 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+import voxcell.label_index as test_module
+from voxcell import VoxelData
+from voxcell.exceptions import VoxcellError
+from voxcell.math_utils import isin
+
+
+def _label_index():
+    raw = np.array([
+        [[1, 0, 2], [2, 2, 0]],
+        [[7, 1, 1], [0, 2, 7]],
+    ], dtype=np.int32)
+    return raw, test_module.LabelIndex.from_voxel_data(VoxelData(raw, (1., 1., 1.)))
+
+
+def test_label_index():
+    raw, label_index = _label_index()
+    npt.assert_equal(label_index.labels, [0, 1, 2, 7])
+    npt.assert_equal(label_index.offsets, [0, 3, 6, 10, 12])
+    assert label_index.shape == (2, 2, 3)
+    assert label_index.order.dtype == np.uint32
+
+    for values in [2, [1, 7], {0, 2, 42}, [], [42]]:
+        expected = isin(raw, np.atleast_1d(list(values) if isinstance(values, set) else values))
+        npt.assert_equal(label_index.mask(values), expected)
+        npt.assert_equal(label_index.indices(values), np.argwhere(expected))
+        npt.assert_equal(label_index.flat_indices(values), np.flatnonzero(expected))
+        assert label_index.count(values) == np.count_nonzero(expected)
+
+
+def test_label_index_sample():
+    raw, label_index = _label_index()
+    indices = label_index.sample([1, 7], 1000, rng=np.random.default_rng(0))
+    assert indices.shape == (1000, 3)
+    values = raw[tuple(indices.T)]
+    assert set(values) == {1, 7}
+    assert len(np.unique(indices, axis=0)) == 5
+
+    np.random.seed(0)
+    assert set(raw[tuple(label_index.sample(2, 10).T)]) == {2}
+
+    with pytest.raises(VoxcellError, match='No voxels'):
+        label_index.sample([42], 1)
+
+
+def test_label_index_save_load(tmp_path):
+    _, label_index = _label_index()
+    label_index.save(tmp_path / 'index.npz')
+    actual = test_module.LabelIndex.load(tmp_path / 'index.npz')
+    npt.assert_equal(actual.labels, label_index.labels)
+    npt.assert_equal(actual.offsets, label_index.offsets)
+    npt.assert_equal(actual.order, label_index.order)
+    assert actual.shape == label_index.shape
+    assert actual.fingerprint is None
+
+    label_index.fingerprint = '123:456'
+    label_index.save(tmp_path / 'index.npz')
+    assert test_module.LabelIndex.load(tmp_path / 'index.npz').fingerprint == '123:456'
+
+
+def test_label_index_raises():
+    with pytest.raises(VoxcellError, match='scalar'):
+        test_module.LabelIndex.from_voxel_data(VoxelData(np.zeros((2, 2, 3)), (1., 1.)))
+    with pytest.raises(VoxcellError, match='Inconsistent'):
+        test_module.LabelIndex([1, 2], [0, 3], [0, 1, 2], (3,))
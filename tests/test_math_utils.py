@@ -1,9 +1,12 @@
+from unittest.mock import patch
+
 import numpy as np
 import numpy.testing as npt
 import pytest
 
 import voxcell.math_utils as test_module
 from voxcell import VoxelData
+from voxcell.exceptions import VoxcellError
 
 
 def test_clip():
@@ -87,6 +90,61 @@ def test_normalize_3():
     npt.assert_equal(test_module.normalize([[1, 0, 0], [0, 0, 0]]), [[1, 0, 0], [0, 0, 0]])
 
 
+def test_minimum_aabb():
+    mask = np.zeros((5, 6, 7), dtype=bool)
+    mask[1, 2, 5] = mask[3, 4, 1] = True
+    expected = ([1, 2, 1], [3, 4, 5])
+    npt.assert_equal(test_module.minimum_aabb(mask), expected)
+    with patch.object(test_module, '_CHUNK_SIZE', 1):
+        npt.assert_equal(test_module.minimum_aabb(mask), expected)
+    npt.assert_equal(test_module.minimum_aabb(mask.astype(int)), expected)
+    npt.assert_equal(test_module.minimum_aabb([0, 1, 1, 0]), ([1], [2]))
+    with pytest.raises(ValueError):
+        test_module.minimum_aabb(np.zeros((2, 3), dtype=bool))
+
+
+def test_projections_minimum_aabb():
+    mask = np.zeros((5, 6), dtype=bool)
+    mask[4, 0] = mask[2, 3] = True
+    projections = [test_module.mask_projections(slab) for slab in (mask[:2], mask[2:3], mask[3:])]
+    npt.assert_equal(test_module.projections_minimum_aabb(projections), ([2, 0], [4, 3]))
+    with pytest.raises(ValueError):
+        test_module.projections_minimum_aabb([])
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_minimum_aabb_n_jobs(n_jobs):
+    mask = np.zeros((7, 5, 3), dtype=bool)
+    mask[2, 1, 0] = mask[5, 3, 2] = True
+    with patch.object(test_module, '_CHUNK_SIZE', 15):
+        npt.assert_equal(test_module.minimum_aabb(mask, n_jobs=n_jobs), ([2, 1, 0], [5, 3, 2]))
+
+
+def test_block_reduce():
+    values = np.array([[1, 2, 2, 7, 7], [1, 1, 3, 3, 7], [4, 4, 5, 6, 6]], dtype=np.uint8)
+    starts = [np.array([0, 2]), np.array([0, 2, 4])]
+    npt.assert_equal(test_module.block_reduce(values, starts, 'mode'), [[1, 3, 7], [4, 5, 6]])
+    actual = test_module.block_reduce(values, starts, 'sum')
+    assert actual.dtype == np.int64
+    npt.assert_equal(actual, [[5, 15, 14], [8, 11, 6]])
+    actual = test_module.block_reduce(values, starts, 'mean')
+    assert actual.dtype == np.float64
+    npt.assert_almost_equal(actual, [[1.25, 3.75, 7], [4, 5.5, 6]])
+    actual = test_module.block_reduce(values.astype(np.float32), starts[:1], 'mean')
+    assert actual.dtype == np.float32
+    npt.assert_almost_equal(actual, [[1, 1.5, 2.5, 5, 7], [4, 4, 5, 6, 6]])
+
+    vectors = np.array([[[1., 0.], [0., 2.]], [[0., 0.], [0., 0.]]])
+    npt.assert_almost_equal(
+        test_module.block_reduce(vectors, [np.array([0]), np.array([0, 1])], 'normalized_mean'),
+        [[[1, 0], [0, 1]]]
+    )
+    with pytest.raises(VoxcellError, match='scalar'):
+        test_module.block_reduce(vectors, [np.array([0]), np.array([0, 1])], 'mode')
+    with pytest.raises(VoxcellError, match='Unsupported'):
+        test_module.block_reduce(values, starts, 'median')
+
+
 def test_isin_empty():
     npt.assert_equal(test_module.isin([], [1, 2]), [])
 
@@ -121,6 +179,30 @@ def test_isin_2():
     )
 
 
+def test_isin_lut():
+    a = np.arange(-6, 18, dtype=np.int8).reshape((2, 3, 4))
+    values = [-5, 0, 3, 17, 200, -1000]
+    expected = np.isin(a, [-5, 0, 3, 17])
+    npt.assert_equal(test_module.isin(a, values), expected)
+    with patch.object(test_module, '_CHUNK_SIZE', 5):
+        npt.assert_equal(test_module.isin(a, values), expected)
+        npt.assert_equal(test_module.isin(a[::-1, :, ::2].T, values), expected[::-1, :, ::2].T)
+        npt.assert_equal(test_module.isin(np.asfortranarray(a), values), expected)
+    npt.assert_equal(test_module.isin(a, [200]), np.zeros_like(a, dtype=bool))
+    npt.assert_equal(test_module.isin(a.astype(np.uint64), [3, 2 ** 64 - 1]), (a == 3) | (a == -1))
+    npt.assert_equal(test_module.isin(a, [3.0, 4.5]), a == 3)
+    with patch.object(test_module, '_ISIN_LUT_MAX_SIZE', 4):
+        npt.assert_equal(test_module.isin(a, values), expected)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_isin_n_jobs(n_jobs):
+    a = np.arange(-6, 18).reshape((6, 4))
+    with patch.object(test_module, '_CHUNK_SIZE', 5):
+        npt.assert_equal(test_module.isin(a, [-5, 3, 17], n_jobs=n_jobs), np.isin(a, [-5, 3, 17]))
+        npt.assert_equal(test_module.isin(a, [-5, 3.0], n_jobs=n_jobs), np.isin(a, [-5, 3]))
+
+
 def test_euler2mat():
     pi2 = np.pi / 2
     pi3 = np.pi / 3
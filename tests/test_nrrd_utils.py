@@ -0,0 +1,130 @@
+import gzip
+import io
+import zlib
+from unittest.mock import patch
+
+import nrrd
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+import voxcell.nrrd_utils as test_module
+from voxcell.exceptions import VoxcellError
+
+
+def test_data_dtype():
+    assert test_module.data_dtype({'type': 'uchar'}) == np.uint8
+    assert test_module.data_dtype({'type': 'short', 'endian': 'little'}) == np.dtype('<i2')
+    assert test_module.data_dtype({'type': 'float', 'endian': 'big'}) == np.dtype('>f4')
+    with pytest.raises(VoxcellError, match="Unsupported NRRD type: 'block'"):
+        test_module.data_dtype({'type': 'block'})
+
+
+def test_memmap_data_skip(tmp_path):
+    data = np.arange(6, dtype='<u2')
+    filepath = tmp_path / 'skip.nhdr'
+    filepath.write_text(
+        'NRRD0004\n'
+        'type: ushort\n'
+        'dimension: 2\n'
+        'sizes: 3 2\n'
+        'endian: little\n'
+        'encoding: raw\n'
+        'line skip: 1\n'
+        'byte skip: 2\n'
+        'data file: skip.raw\n'
+        '\n'
+    )
+    (tmp_path / 'skip.raw').write_bytes(b'comment\n' + b'\0\0' + data.tobytes())
+    actual = test_module.memmap_data(filepath)
+    assert_array_equal(actual, data.reshape((2, 3)).T)
+
+    filepath.write_text(filepath.read_text().replace('byte skip: 2', 'byte skip: -1'))
+    assert_array_equal(test_module.memmap_data(filepath), data.reshape((2, 3)).T)
+
+
+@pytest.mark.parametrize('encoding', ['raw', 'gzip', 'bzip2'])
+def test_read_data_slices(tmp_path, encoding):
+    data = np.arange(60, dtype=np.float32).reshape((3, 4, 5))
+    filepath = str(tmp_path / 'data.nrrd')
+    nrrd.write(filepath, data, header={'encoding': encoding})
+    assert_array_equal(test_module.read_data(filepath), data)
+    actual = test_module.read_data(filepath, slices=(slice(None), slice(1, 3), slice(2, None)))
+    assert_array_equal(actual, data[:, 1:3, 2:])
+    with pytest.raises(VoxcellError, match="Invalid slices"):
+        test_module.read_data(filepath, slices=(slice(None), slice(None, None, 2), slice(None)))
+
+
+def test_data_reader_multiple_members():
+    data = np.arange(1000, dtype=np.int16)
+    stream = io.BytesIO(gzip.compress(data[:300].tobytes()) + gzip.compress(data[300:].tobytes()))
+    reader = test_module.DataReader(stream, 'gzip', chunk_size=64)
+    reader.skip(100)
+    actual = np.empty(950, dtype=np.int16)
+    reader.readinto(actual)
+    assert_array_equal(actual, data[50:])
+    with pytest.raises(VoxcellError, match="Unexpected end of NRRD data"):
+        reader.readinto(actual)
+
+
+@pytest.mark.parametrize('encoding', ['raw', 'gzip', 'bzip2', 'ascii'])
+@pytest.mark.parametrize('suffix', ['.nrrd', '.nhdr'])
+def test_read_data_same_as_pynrrd(tmp_path, encoding, suffix):
+    data = np.random.default_rng(0).integers(0, 1000, size=(2, 3, 4, 5)).astype('>u2')
+    filepath = str(tmp_path / f'data{suffix}')
+    nrrd.write(filepath, data, header={'encoding': encoding})
+    expected, _ = nrrd.read(filepath)
+    actual = test_module.read_data(filepath)
+    assert actual.dtype == expected.dtype
+    assert actual.flags.f_contiguous
+    assert_array_equal(actual, expected)
+    assert_array_equal(test_module.read_data(filepath, slices=(slice(1, 2),) * 4), data[1:2, 1:2, 1:2, 1:2])
+
+
+@pytest.mark.parametrize('n_jobs', [1, 4])
+@pytest.mark.parametrize('size', [0, 1, 2 ** 12, 2 ** 16 + 7])
+def test_write_data_gzip(n_jobs, size):
+    data = np.random.default_rng(0).integers(0, 4, size=size).astype(np.uint8).tobytes()
+    chunks = [data[i:i + 1000] for i in range(0, len(data), 1000)]
+    fh = io.BytesIO()
+    with patch.object(test_module, 'CHUNK_SIZE', 2 ** 12):
+        test_module.write_data(fh, chunks, 'gzip', compression_level=6, n_jobs=n_jobs)
+    assert gzip.decompress(fh.getvalue()) == data
+    # single gzip member
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    assert decompressor.decompress(fh.getvalue()) == data
+    assert decompressor.eof and not decompressor.unused_data
+
+
+def test_write_data_unsupported():
+    with pytest.raises(VoxcellError, match="Unsupported NRRD encoding: 'ascii'"):
+        test_module.write_data(io.BytesIO(), [], 'ascii')
+
+
+def test_data_header():
+    assert test_module.data_header('>f8', (2, 3)) == {
+        'type': 'double', 'dimension': 2, 'sizes': [2, 3], 'endian': 'big'
+    }
+    assert test_module.data_header(np.uint8, (4,)) == {
+        'type': 'uint8', 'dimension': 1, 'sizes': [4]
+    }
+    assert test_module.data_header(bool, (4,))['type'] == 'uint8'
+    with pytest.raises(VoxcellError, match="Unsupported data type for NRRD: 'complex128'"):
+        test_module.data_header(complex, (4,))
+
+
+@pytest.mark.parametrize('encoding', ['raw', 'gzip', 'bzip2'])
+@pytest.mark.parametrize('suffix', ['.nrrd', '.nhdr'])
+def test_write(tmp_path, encoding, suffix):
+    data = np.arange(120, dtype=np.int16).reshape((2, 3, 4, 5))
+    # not contiguous
+    data = data.transpose((1, 0, 3, 2))
+    filepath = str(tmp_path / f'data{suffix}')
+    header = test_module.data_header(data.dtype, data.shape)
+    header['encoding'] = encoding
+    header['space origin'] = np.array([1.0, 2.0])
+    test_module.write(filepath, header, test_module.iter_chunks(data, chunk_size=20))
+    actual, actual_header = nrrd.read(filepath)
+    assert_array_equal(actual, data)
+    assert_array_equal(actual_header['space origin'], [1.0, 2.0])
+    assert_array_equal(test_module.read_data(filepath), data)
@@ -0,0 +1,41 @@
+import threading
+from unittest.mock import patch
+
+import numpy as np
+
+import voxcell.parallel as test_module
+
+
+def test_get_n_jobs():
+    with patch.object(test_module, '_N_JOBS', 1):
+        assert test_module.get_n_jobs() == 1
+        assert test_module.get_n_jobs(3) == 3
+        test_module.set_n_jobs(4)
+        assert test_module.get_n_jobs() == 4
+        with patch('os.cpu_count', return_value=8):
+            assert test_module.get_n_jobs(0) == 8
+            test_module.set_n_jobs(-1)
+            assert test_module.get_n_jobs() == 8
+    assert test_module.get_n_jobs() == 1
+
+
+def test_slab_slices():
+    assert test_module.slab_slices((5, 2, 3), max_size=12) == [slice(0, 2), slice(2, 4), slice(4, 5)]
+    assert test_module.slab_slices((2, 100), max_size=12) == [slice(0, 1), slice(1, 2)]
+    assert test_module.slab_slices((0, 3)) == []
+    assert test_module.slab_slices((7,), max_size=3) == [slice(0, 3), slice(3, 6), slice(6, 7)]
+    assert test_module.slab_slices((7, 2), max_size=6, align=2) == [slice(0, 2), slice(2, 4), slice(4, 6), slice(6, 7)]
+    assert test_module.slab_slices((7, 2), max_size=2, align=3) == [slice(0, 3), slice(3, 6), slice(6, 7)]
+
+
+def test_map_chunks():
+    thread_ids = set()
+
+    def _func(x):
+        thread_ids.add(threading.get_ident())
+        return x * 2
+
+    assert test_module.map_chunks(_func, range(10), n_jobs=1) == list(range(0, 20, 2))
+    assert thread_ids == {threading.get_ident()}
+    assert test_module.map_chunks(_func, range(10), n_jobs=3) == list(range(0, 20, 2))
+    assert test_module.map_chunks(_func, [], n_jobs=3) == []
@@ -0,0 +1,78 @@
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+import voxcell.position_sampler as test_module
+from voxcell import VoxelData
+from voxcell.exceptions import VoxcellError
+
+
+def _alias_distribution(prob, alias):
+    n = len(prob)
+    return (prob + np.bincount(alias, weights=1 - prob, minlength=n)) / n
+
+
+@pytest.mark.parametrize('weights', [
+    [1.0],
+    [0.0, 1.0, 3.0],
+    [1e6] + [1.0] * 1000,
+    0.5 ** np.arange(60),
+    np.random.default_rng(0).pareto(1.0, 10000),
+])
+def test_alias_table(weights):
+    weights = np.asarray(weights)
+    prob, alias = test_module.alias_table(weights)
+    assert np.all((prob >= 0) & (prob <= 1))
+    npt.assert_allclose(_alias_distribution(prob, alias), weights / weights.sum(), atol=1e-12)
+
+
+def _density():
+    raw = np.zeros((4, 5, 6), dtype=np.float32)
+    raw[1, 2, 3] = 1.0
+    raw[2, 1, 0] = 3.0
+    raw[3, 4, 5] = 4.0
+    return VoxelData(raw, (10.0, 20.0, 30.0), offset=(1.0, 2.0, 3.0))
+
+
+def test_position_sampler():
+    density = _density()
+    sampler = test_module.PositionSampler(density)
+    npt.assert_almost_equal(sampler.total, 8.0 * 6000)
+
+    positions = sampler.sample(80000, rng=np.random.default_rng(0), chunk_size=30000)
+    assert positions.shape == (80000, 3)
+    indices = density.positions_to_indices(positions)
+    counts = np.bincount(np.ravel_multi_index(indices.T, density.shape), minlength=120)
+    assert np.all(counts[density.raw.ravel() == 0] == 0)
+    npt.assert_allclose(counts[density.raw.ravel() > 0] / 80000, [1 / 8, 3 / 8, 4 / 8], atol=0.01)
+    # uniform within voxels
+    fractions = density.positions_to_indices(positions, keep_fraction=True) - indices
+    npt.assert_allclose(np.mean(fractions, axis=0), 0.5, atol=0.01)
+
+    npt.assert_equal(sampler.sample(100, rng=np.random.default_rng(1)), sampler.sample(100, rng=np.random.default_rng(1)))
+    chunks = list(sampler.iter_sample(100, rng=np.random.default_rng(1), chunk_size=30))
+    assert [len(chunk) for chunk in chunks] == [30, 30, 30, 10]
+    npt.assert_equal(
+        np.concatenate(chunks), sampler.sample(100, rng=np.random.default_rng(1), chunk_size=30)
+    )
+
+    np.random.seed(0)
+    assert sampler.sample(10).shape == (10, 3)
+    npt.assert_equal(
+        density.sample_positions(100, rng=np.random.default_rng(2)),
+        sampler.sample(100, rng=np.random.default_rng(2)),
+    )
+
+
+def test_position_sampler_raises():
+    density = _density()
+    with pytest.raises(VoxcellError):
+        test_module.PositionSampler(density.with_data(np.zeros(density.shape + (2,))))
+    with pytest.raises(VoxcellError):
+        test_module.PositionSampler(density.with_data(-density.raw))
+    with pytest.raises(VoxcellError):
+        test_module.PositionSampler(density.with_data(np.full(density.shape, np.nan)))
+    sampler = test_module.PositionSampler(density.with_data(np.zeros(density.shape)))
+    assert sampler.total == 0
+    with pytest.raises(VoxcellError):
+        sampler.sample(1)
@@ -3,15 +3,20 @@ import os
 import re
 import tempfile
 from pathlib import Path
-from unittest.mock import Mock, call
+from unittest.mock import Mock, call, patch
 
+import h5py
 import nrrd
 import numpy as np
 import numpy.testing as npt
+import pandas as pd
+import pandas.testing as pdt
 import pytest
 from numpy.testing import assert_almost_equal, assert_array_equal, assert_raises
+from scipy.ndimage import map_coordinates
 
 import voxcell.voxel_data as test_module
+from voxcell import LazyVoxelData
 from voxcell.exceptions import VoxcellError
 
 DATA_PATH = os.path.join(os.path.dirname(__file__), 'data')
@@ -138,9 +143,9 @@ def test_load_nrrd_fail():
         test_module.VoxelData.load_nrrd,
         os.path.join(DATA_PATH, 'no_spacings_fail.nrrd'),
     )
-    # space directions is non-diagonal
+    # space directions are degenerate
     assert_raises(
-        NotImplementedError,
+        VoxcellError,
         test_module.VoxelData.load_nrrd,
         os.path.join(DATA_PATH, 'space_directions_fail.nrrd'),
     )
@@ -288,6 +293,30 @@ def test_clip_out_of_bounds():
     assert_array_equal(clipped.raw, original.raw)
 
 
+def test_clip_3d():
+    raw = np.arange(4 * 5 * 6).reshape((4, 5, 6))
+    original = test_module.VoxelData(raw, voxel_dimensions=(1, 1, 1))
+    expected = np.full_like(raw, -1)
+    expected[1:3, 2:5, 1:4] = raw[1:3, 2:5, 1:4]
+    clipped = original.clip(bbox=((0.5, 1.5, 0.5), (3.5, 5.5, 4.5)), na_value=-1)
+    assert_array_equal(clipped.raw, expected)
+    with patch.object(test_module.parallel, 'SLAB_SIZE', 30):
+        assert_array_equal(original.clip(bbox=((0.5, 1.5, 0.5), (3.5, 5.5, 4.5)), na_value=-1, n_jobs=2).raw, expected)
+        original.clip(bbox=((0.5, 1.5, 0.5), (3.5, 5.5, 4.5)), na_value=-1, inplace=True, n_jobs=2)
+    assert_array_equal(original.raw, expected)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 3, 0])
+def test_parallel_n_jobs(n_jobs):
+    raw = np.random.default_rng(0).integers(0, 5, size=(9, 4, 3))
+    voxel_data = test_module.VoxelData(raw, voxel_dimensions=(2, 2, 2))
+    with patch.object(test_module.parallel, 'SLAB_SIZE', 12):
+        assert voxel_data.count([1, 3], n_jobs=n_jobs) == np.count_nonzero(np.isin(raw, [1, 3]))
+        assert voxel_data.volume({2}, n_jobs=n_jobs) == 8 * np.count_nonzero(raw == 2)
+        raw[[0, -1]] = 0
+        assert_array_equal(voxel_data.compact(na_values=(0, 4), n_jobs=n_jobs).raw.shape, (7, 4, 3))
+
+
 def test_filter():
     raw = np.array([[[11], [12]], [[21], [22]]])
     original = test_module.VoxelData(raw, voxel_dimensions=(2, 6, 10), offset=(10, 20, 30))
@@ -304,6 +333,25 @@ def test_filter_inplace():
     assert_array_equal(original.raw, [[[0], [0]], [[0], [22]]])
 
 
+@pytest.mark.parametrize('n_jobs', [1, 3])
+def test_filter_slabs(n_jobs):
+    raw = np.arange(5 * 4 * 3 * 2).reshape((5, 4, 3, 2))
+    original = test_module.VoxelData(raw, voxel_dimensions=(2, 3, 4), offset=(-1, 0, 1))
+    ijk = np.stack(np.mgrid[0:5, 0:4, 0:3], axis=-1)
+    xyz = original.indices_to_positions(0.5 + ijk)
+    expected = np.where((xyz[..., 0] + xyz[..., 2] > 6)[..., np.newaxis], raw, 0)
+
+    def predicate(p):
+        assert len(p) <= 24
+        return p[:, 0] + p[:, 2] > 6
+
+    with patch.object(test_module.parallel, 'SLAB_SIZE', 20):
+        filtered = original.filter(predicate, n_jobs=n_jobs)
+        assert_array_equal(filtered.raw, expected)
+        original.filter(predicate, inplace=True, n_jobs=n_jobs)
+        assert_array_equal(original.raw, expected)
+
+
 def test_compact():
     raw = np.array([0, 42, -1])
     original = test_module.VoxelData(raw, voxel_dimensions=(2,), offset=(10,))
@@ -323,6 +371,18 @@ def test_compact_inplace():
     assert original.offset == 12
 
 
+def test_compact_slabs():
+    raw = np.zeros((6, 5, 4), dtype=np.int16)
+    raw[2, 1, 3] = 7
+    raw[4, 3, 0] = -1
+    raw[3, 0, 2] = 5
+    original = test_module.VoxelData(raw, voxel_dimensions=(2, 3, 4), offset=(1, 2, 3))
+    with patch.object(test_module.parallel, 'SLAB_SIZE', 20):
+        compact = original.compact(na_values=(0, -1))
+    assert_array_equal(compact.raw, raw[2:4, 0:2, 2:4])
+    assert_array_equal(compact.offset, [5, 2, 11])
+
+
 def test_orientation_field():
     field = test_module.OrientationField(np.array([[1., 0., 0., 0.]]), voxel_dimensions=(2,))
     npt.assert_almost_equal(
@@ -369,6 +429,17 @@ def test_values_to_region_attribute():
     assert_array_equal(actual, ["SO", "CA1", "CA1", "SO"])
 
 
+def test_values_to_region_attribute_n_jobs():
+    region_map = Mock()
+    region_map.get.side_effect = lambda _id, attr: {0: "CA1", 1: "SO", 2: "SP"}[_id]
+    values = np.array([[1, 0, 2], [0, 1, 1]])
+    with patch.object(test_module.parallel, 'SLAB_SIZE', 2):
+        actual = test_module.values_to_region_attribute(values, region_map, n_jobs=2)
+    assert region_map.get.call_count == 3
+    assert_array_equal(actual, [["SO", "CA1", "SP"], ["CA1", "SO", "SO"]])
+    assert len(test_module.values_to_region_attribute(np.array([]), region_map)) == 0
+
+
 def test_values_to_hemisphere():
     values = np.array([2, 1, 1, 2])
     actual = test_module.values_to_hemisphere(values)
@@ -401,6 +472,144 @@ def test_reduce():
     assert_almost_equal(f.raw, [[13, 12], [21, 22]])
 
 
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_reduce_streaming(tmp_path, prefetch):
+    a = test_module.VoxelData(np.array([[11, 12], [21, 22]], dtype=np.int16), (2, 3))
+    b = test_module.VoxelData(np.array([[1, 0], [0, 0.5]]), (2, 3))
+    b.save_nrrd(str(tmp_path / 'b.nrrd'))
+    c = LazyVoxelData.load_nrrd(tmp_path / 'b.nrrd')
+
+    actual = test_module.VoxelData.reduce(
+        operator.add, [a, str(tmp_path / 'b.nrrd'), c], prefetch=prefetch
+    )
+    assert_almost_equal(actual.raw, [[13, 12], [21, 23]])
+    assert actual.raw.dtype == np.float64
+    assert_array_equal(a.raw, [[11, 12], [21, 22]])
+    assert not c.is_loaded
+
+    actual = test_module.VoxelData.reduce(np.maximum, (x for x in [c, a]), prefetch=prefetch)
+    assert_almost_equal(actual.raw, [[11, 12], [21, 22]])
+    assert actual.raw.dtype == np.float64
+
+    actual = test_module.VoxelData.reduce(lambda x, y: x - 2 * y, [a, b, b], prefetch=prefetch)
+    assert_almost_equal(actual.raw, [[7, 12], [21, 20]])
+
+    actual = test_module.VoxelData.reduce(operator.add, [tmp_path / 'b.nrrd'], prefetch=prefetch)
+    assert_almost_equal(actual.raw, b.raw)
+
+    with pytest.raises(TypeError, match='empty sequence'):
+        test_module.VoxelData.reduce(operator.add, [], prefetch=prefetch)
+    with pytest.raises(AssertionError):
+        test_module.VoxelData.reduce(
+            operator.add, [a, test_module.VoxelData(a.raw, (2, 3), offset=(1, 1))], prefetch=prefetch
+        )
+
+
+@pytest.mark.parametrize('function', [np.divide, np.true_divide, np.hypot, operator.truediv])
+def test_reduce_float_result(function):
+    a = test_module.VoxelData(np.array([[3, 4], [1, 2]], dtype=np.int32), (2, 3))
+    b = test_module.VoxelData(np.array([[4, 3], [2, 2]], dtype=np.int32), (2, 3))
+    actual = test_module.VoxelData.reduce(function, [a, b, b])
+    assert actual.raw.dtype == np.float64
+    assert_almost_equal(actual.raw, function(function(a.raw, b.raw), b.raw))
+
+
+@pytest.mark.parametrize('function', [np.greater, np.logical_and, np.equal])
+def test_reduce_bool_result(function):
+    a = test_module.VoxelData(np.array([[3, 0], [1, 2]], dtype=np.int32), (2, 3))
+    b = test_module.VoxelData(np.array([[2, 3], [0, 2]], dtype=np.int32), (2, 3))
+    actual = test_module.VoxelData.reduce(function, [a, b])
+    assert actual.raw.dtype == bool
+    assert_array_equal(actual.raw, function(a.raw, b.raw))
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_resample(n_jobs):
+    raw = np.random.default_rng(0).integers(0, 4, size=(7, 6, 5)).astype(np.int16)
+    voxel_data = test_module.VoxelData(raw, (1.0, 2.0, 3.0), offset=(-1.0, 0.0, 1.0))
+    padded = np.full((8, 6, 6), -1, dtype=np.int16)
+    padded[:7, :6, :5] = raw
+    blocks = padded.reshape(4, 2, 3, 2, 6, 1).transpose(0, 2, 4, 1, 3, 5).reshape(4, 3, 6, -1)
+
+    with patch.object(test_module.parallel, 'SLAB_SIZE', 40):
+        actual = voxel_data.resample((2, 2, 1), method='sum', n_jobs=n_jobs)
+        assert_array_equal(actual.voxel_dimensions, [2.0, 4.0, 3.0])
+        assert_array_equal(actual.offset, voxel_data.offset)
+        assert actual.shape == (4, 3, 5)
+        assert_array_equal(actual.raw, np.where(blocks < 0, 0, blocks).sum(axis=-1)[..., :5])
+
+        actual = voxel_data.resample((2, 2, 1), method='mean', n_jobs=n_jobs)
+        expected = np.ma.masked_less(blocks, 0).mean(axis=-1)[..., :5]
+        assert_almost_equal(actual.raw, expected)
+
+        actual = voxel_data.resample((2, 2, 1), method='mode', n_jobs=n_jobs)
+        assert actual.raw.dtype == np.int16
+        for idx in np.ndindex(actual.shape):
+            block = blocks[idx][blocks[idx] >= 0]
+            assert actual.raw[idx] == np.argmax(np.bincount(block))
+
+    assert voxel_data.resample(3).shape == (3, 2, 2)
+
+
+def test_resample_vectors():
+    raw = np.zeros((2, 2, 2, 3), dtype=np.float32)
+    raw[0, 0, 0] = [1, 0, 0]
+    raw[1, 1, 1] = [0, 1, 0]
+    actual = test_module.VoxelData(raw, (1.0, 1.0, 1.0)).resample(2, method='normalized_mean')
+    assert actual.raw.dtype == np.float32
+    assert_almost_equal(actual.raw, [[[[np.sqrt(0.5), np.sqrt(0.5), 0]]]])
+
+
+def test_resample_raises():
+    voxel_data = test_module.VoxelData(np.zeros((2, 2, 2)), (1.0, 1.0, 1.0))
+    for factor in [0, 1.5, (1, 2)]:
+        with pytest.raises((VoxcellError, ValueError)):
+            voxel_data.resample(factor)
+    with pytest.raises(VoxcellError, match='Unsupported'):
+        voxel_data.resample(2, method='median')
+
+
+@pytest.mark.parametrize('payload_shape', [(), (3,)])
+def test_save_load_h5(tmp_path, payload_shape):
+    raw = np.arange(5 * 6 * 7 * int(np.prod(payload_shape)), dtype=np.int16)
+    raw = raw.reshape((5, 6, 7) + payload_shape)
+    original = test_module.VoxelData(raw, (1.0, 2.0, 3.0), offset=(1.0, 1.0, 1.0))
+    filepath = tmp_path / 'volume.h5'
+    original.save_h5(filepath, chunks=(2, 4, 100))
+    with h5py.File(filepath, 'r') as h5f:
+        assert h5f['raw'].chunks == (2, 4, 7) + payload_shape
+        assert h5f['raw'].compression == 'gzip'
+
+    actual = test_module.VoxelData.load_h5(filepath)
+    assert_array_equal(actual.raw, raw)
+    assert_array_equal(actual.voxel_dimensions, original.voxel_dimensions)
+    assert_array_equal(actual.offset, original.offset)
+
+    actual = test_module.VoxelData.load_h5(filepath, bbox=[(2.0, 3.0, 4.0), (4.0, 7.0, 10.0)])
+    assert_array_equal(actual.raw, raw[1:3, 1:3, 1:3])
+    assert_array_equal(actual.offset, [2.0, 3.0, 4.0])
+
+    with pytest.raises(VoxcellError, match='Memory mapping'):
+        test_module.VoxelData.load_h5(filepath, mmap=True)
+
+
+def test_save_load_h5_mmap(tmp_path):
+    raw = np.random.default_rng(0).random((4, 5, 6)) > 0.5
+    original = test_module.VoxelData(raw, (1.0, 1.0, 1.0))
+    filepath = tmp_path / 'volume.h5'
+    original.save_h5(filepath, dataset='mask', chunks=None, compression=None)
+    original.with_data(raw.astype(np.float32)).save_h5(filepath, dataset='other')
+    original.with_data(raw.astype(np.uint8)).save_h5(filepath, dataset='other')
+
+    actual = test_module.VoxelData.load_h5(filepath, dataset='mask', mmap=True)
+    assert isinstance(actual.raw, np.memmap)
+    assert actual.raw.dtype == bool
+    assert_array_equal(actual.raw, raw)
+    actual = test_module.VoxelData.load_h5(filepath, dataset='mask', mmap=True, bbox=[(1, 1, 1), (2, 3, 4)])
+    assert_array_equal(actual.raw, raw[1:2, 1:3, 1:4])
+    assert test_module.VoxelData.load_h5(filepath, dataset='other').raw.dtype == np.uint8
+
+
 def test_offset_and_voxel_dimensions_type():
     voxel_data = test_module.VoxelData(
         np.ones((2, 2, 2)), offset=(1, 2, 3), voxel_dimensions=(1, 1, 1))
@@ -409,3 +618,394 @@ def test_offset_and_voxel_dimensions_type():
 
     voxel_data = test_module.VoxelData(np.ones((2, 2, 2)), voxel_dimensions=(3, 4, 5))
     assert voxel_data.offset.dtype == np.float32
+
+
+@pytest.mark.parametrize('suffix', ['.nrrd', '.nhdr'])
+def test_load_nrrd_mmap(tmp_path, suffix):
+    raw = np.arange(2 * 3 * 4 * 2, dtype=np.float32).reshape((2, 3, 4, 2))
+    vd = test_module.VoxelData(raw, (1.0, 2.0, 3.0), offset=(10.0, 20.0, 30.0))
+    filepath = str(tmp_path / f'vector{suffix}')
+    vd.save_nrrd(filepath, encoding='raw')
+    actual = test_module.VoxelData.load_nrrd(filepath, mmap=True)
+    assert isinstance(actual.raw, np.memmap)
+    assert not actual.raw.flags.writeable
+    assert_array_equal(actual.raw, raw)
+    assert_array_equal(actual.voxel_dimensions, vd.voxel_dimensions)
+    assert_array_equal(actual.offset, vd.offset)
+    assert_array_equal(actual.lookup([[11.5, 25.0, 40.5]]), [raw[1, 2, 3]])
+
+
+def test_load_nrrd_mmap_fail():
+    with pytest.raises(VoxcellError, match="Memory mapping is only supported for 'raw' encoding"):
+        test_module.VoxelData.load_nrrd(os.path.join(DATA_PATH, 'vector.nrrd'), mmap=True)
+
+
+def test_lazy_voxel_data():
+    filepath = os.path.join(DATA_PATH, 'vector.nrrd')
+    actual = LazyVoxelData.load_nrrd(filepath)
+    assert not actual.is_loaded
+    assert actual.shape == (1, 2)
+    assert actual.payload_shape == (3,)
+    assert actual.dtype == np.int64
+    assert_almost_equal(actual.voxel_dimensions, [10, 20])
+    assert_almost_equal(actual.bbox, np.array([[100, 200], [110, 240]]))
+    assert not actual.is_loaded
+
+    expected = test_module.VoxelData.load_nrrd(filepath)
+    assert_array_equal(actual.raw, expected.raw)
+    assert actual.is_loaded
+    assert_array_equal(actual.lookup([[105, 230]]), [[21, 22, 23]])
+
+
+def test_lazy_voxel_data_assign_raw():
+    loader = Mock()
+    actual = LazyVoxelData(loader, (2, 3), np.uint8, (1.0,))
+    assert actual.shape == (2,)
+    actual.raw = np.ones((4, 3))
+    assert actual.is_loaded
+    assert actual.shape == (4,)
+    assert_array_equal(actual.raw, np.ones((4, 3)))
+    loader.assert_not_called()
+
+
+@pytest.mark.parametrize('encoding', ['raw', 'gzip', 'bzip2'])
+@pytest.mark.parametrize('payload_shape', [(), (2,)])
+def test_load_nrrd_bbox(tmp_path, encoding, payload_shape):
+    shape = (4, 5, 6) + payload_shape
+    raw = np.arange(np.prod(shape), dtype=np.int32).reshape(shape)
+    vd = test_module.VoxelData(raw, (1.0, 2.0, -3.0), offset=(10.0, 20.0, 30.0))
+    filepath = str(tmp_path / 'volume.nrrd')
+    vd.save_nrrd(filepath, encoding=encoding)
+
+    actual = test_module.VoxelData.load_nrrd(filepath, bbox=[(11.5, 22.0, 21.0), (13.0, 25.0, 15.0)])
+    assert_array_equal(actual.raw, raw[1:3, 1:3, 3:5])
+    assert_array_equal(actual.offset, [11.0, 22.0, 21.0])
+    assert_array_equal(actual.voxel_dimensions, vd.voxel_dimensions)
+
+    # bbox larger than the volume
+    actual = test_module.VoxelData.load_nrrd(filepath, bbox=[(0, 0, -100), (100, 100, 100)])
+    assert_array_equal(actual.raw, raw)
+    assert_array_equal(actual.offset, vd.offset)
+
+
+def test_load_nrrd_bbox_mmap(tmp_path):
+    raw = np.arange(24, dtype=np.uint8).reshape((2, 3, 4))
+    filepath = str(tmp_path / 'volume.nrrd')
+    test_module.VoxelData(raw, (1.0, 1.0, 1.0)).save_nrrd(filepath, encoding='raw')
+    actual = test_module.VoxelData.load_nrrd(filepath, mmap=True, bbox=[(0, 1, 1), (1, 3, 3)])
+    assert isinstance(actual.raw, np.memmap)
+    assert_array_equal(actual.raw, raw[:1, 1:, 1:3])
+    assert_array_equal(actual.offset, [0, 1, 1])
+
+
+def test_load_nrrd_bbox_fail():
+    filepath = os.path.join(DATA_PATH, 'scalar.nrrd')
+    with pytest.raises(VoxcellError, match="Empty slice"):
+        test_module.VoxelData.load_nrrd(filepath, bbox=[(0, 0), (10, 10)])
+    with pytest.raises(VoxcellError, match="Invalid bbox shape"):
+        test_module.VoxelData.load_nrrd(filepath, bbox=[(0, 0, 0), (10, 10, 10)])
+
+
+def test_lazy_voxel_data_bbox():
+    filepath = os.path.join(DATA_PATH, 'vector.nrrd')
+    actual = LazyVoxelData.load_nrrd(filepath, bbox=[(100, 220), (110, 240)])
+    assert actual.shape == (1, 1)
+    assert_almost_equal(actual.offset, [100, 220])
+    assert not actual.is_loaded
+    assert_array_equal(actual.raw, [[[21, 22, 23]]])
+
+
+@pytest.mark.parametrize('payload_shape', [(), (4,)])
+def test_save_nrrd_parallel_gzip(tmp_path, payload_shape):
+    shape = (30, 40, 50) + payload_shape
+    raw = np.random.default_rng(0).integers(0, 10, size=shape).astype(np.float32)
+    vd = test_module.VoxelData(raw, (1.0, 2.0, 3.0), offset=(10.0, 20.0, 30.0))
+    filepath = str(tmp_path / 'volume.nrrd')
+    with patch.object(test_module.nrrd_utils, 'CHUNK_SIZE', 2 ** 14):
+        vd.save_nrrd(filepath, compression_level=1, n_jobs=3)
+
+    # readable by pynrrd as a single gzip stream
+    data, header = nrrd.read(filepath)
+    assert header['encoding'] == 'gzip'
+    assert_array_equal(data, test_module._pivot_axes(raw, 3))
+
+    actual = test_module.VoxelData.load_nrrd(filepath)
+    assert_array_equal(actual.raw, raw)
+    assert_array_equal(actual.voxel_dimensions, vd.voxel_dimensions)
+    assert_array_equal(actual.offset, vd.offset)
+
+
+def test_save_nrrd_roi_mask(tmp_path):
+    mask = test_module.ROIMask(np.array([[1, 0], [0, 1]], dtype=np.uint8), (1.0, 1.0))
+    filepath = str(tmp_path / 'mask.nrrd')
+    mask.save_nrrd(filepath)
+    data, header = nrrd.read(filepath)
+    assert header['type'] == 'uint8'
+    assert_array_equal(test_module.ROIMask.load_nrrd(filepath).raw, mask.raw)
+
+
+def test_save_nrrd_ascii(tmp_path):
+    vd = test_module.VoxelData(np.array([[1, 2], [3, 4]], dtype=np.int32), (1.0, 2.0))
+    filepath = str(tmp_path / 'ascii.nrrd')
+    vd.save_nrrd(filepath, encoding='ascii')
+    assert_array_equal(test_module.VoxelData.load_nrrd(filepath).raw, vd.raw)
+
+
+def _legacy_lookup(voxel_data, positions, outer_value):
+    voxel_idx = voxel_data.positions_to_indices(positions, strict=False)
+    outer_mask = np.any(voxel_idx == test_module.VoxelData.OUT_OF_BOUNDS, axis=-1)
+    result = np.full(voxel_idx.shape[:-1] + voxel_data.payload_shape, outer_value, voxel_data.raw.dtype)
+    result[~outer_mask] = voxel_data.raw[tuple(voxel_idx[~outer_mask].T)]
+    return result
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.int64])
+def test_lookup_same_as_positions_to_indices(dtype):
+    raw = np.arange(4 * 5 * 6).reshape((4, 5, 6))
+    voxel_data = test_module.VoxelData(raw, (1.125, 2.0, 0.5), offset=(-0.5, 1.0, 2.0))
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(voxel_data.bbox[0] - 2, voxel_data.bbox[1] + 2, size=(1000, 3))
+    # positions on voxel boundaries and volume edges
+    grid = voxel_data.indices_to_positions(rng.integers(-1, 8, size=(1000, 3)))
+    edges = np.array([voxel_data.bbox[0], voxel_data.bbox[1], np.nextafter(voxel_data.bbox[1], -1)])
+    positions = np.vstack([positions, grid, edges]).astype(dtype)
+
+    expected = _legacy_lookup(voxel_data, positions, -1)
+    with patch.object(test_module, '_LOOKUP_CHUNK_SIZE', 100):
+        actual = voxel_data.lookup(positions, outer_value=-1)
+    assert_array_equal(actual, expected)
+
+    out = np.zeros(len(positions), dtype=np.int32)
+    assert voxel_data.lookup(positions, outer_value=-1, out=out) is out
+    assert_array_equal(out, expected)
+
+    assert_array_equal(voxel_data.lookup([[np.nan, 2.0, 3.0], [0, 2, 3]], outer_value=-1), [-1, 2])
+
+
+def test_lookup_out_and_shape():
+    raw = np.arange(12).reshape((2, 2, 3))
+    voxel_data = test_module.VoxelData(raw, (1.0, 1.0))
+    positions = np.array([[[0.5, 0.5], [1.5, 0.5]], [[9.0, 9.0], [0.5, 1.5]]])
+    actual = voxel_data.lookup(positions, outer_value=(-1, -1, -1))
+    assert_array_equal(actual, [[[0, 1, 2], [6, 7, 8]], [[-1, -1, -1], [3, 4, 5]]])
+    assert_array_equal(voxel_data.lookup([0.5, 1.5]), [3, 4, 5])
+    with pytest.raises(VoxcellError, match="'out' shape should be"):
+        voxel_data.lookup(positions, out=np.empty((2, 2)))
+    with pytest.raises(VoxcellError, match="Invalid positions shape"):
+        voxel_data.lookup([[0.5, 0.5, 0.5]])
+
+
+def test_lookup_single_position():
+    raw = np.arange(6, dtype=np.int32).reshape((2, 3))
+    voxel_data = test_module.VoxelData(raw, (1.0, 1.0))
+    actual = voxel_data.lookup([1.5, 2.5])
+    assert isinstance(actual, np.int32)
+    assert {actual: 'ok'}[5] == 'ok'
+    assert isinstance(voxel_data.lookup([1.5, 2.5], interpolation='linear'), np.floating)
+    assert voxel_data.lookup([9.0, 9.0], outer_value=-1) == -1
+    out = np.empty((), dtype=np.int32)
+    assert voxel_data.lookup([0.5, 0.5], out=out) is out
+    assert out == 0
+
+
+def test_lookup_chunked(tmp_path):
+    raw = np.arange(4 * 5 * 6, dtype=np.int16).reshape((4, 5, 6))
+    voxel_data = test_module.VoxelData(raw, (1.0, 2.0, 3.0), offset=(-1.0, 0.0, 1.0))
+    positions = np.random.default_rng(0).uniform(
+        voxel_data.bbox[0] - 1, voxel_data.bbox[1] + 1, size=(1001, 3)
+    ).astype(np.float32)
+    expected = voxel_data.lookup(positions, outer_value=-1)
+
+    assert_array_equal(voxel_data.lookup(positions, outer_value=-1, chunk_size=7), expected)
+
+    mmap = np.lib.format.open_memmap(tmp_path / 'positions.npy', mode='w+', dtype=np.float32, shape=positions.shape)
+    mmap[:] = positions
+    out = np.empty(len(positions), dtype=np.int16)
+    voxel_data.lookup(mmap, outer_value=-1, out=out, chunk_size=100)
+    assert_array_equal(out, expected)
+
+    with h5py.File(tmp_path / 'positions.h5', 'w') as h5f:
+        h5f['positions'] = positions
+        actual = voxel_data.lookup(h5f['positions'], outer_value=-1, chunk_size=100)
+    assert_array_equal(actual, expected)
+
+
+def test_lookup_linear():
+    raw = np.random.default_rng(0).random((5, 6, 7)).astype(np.float32)
+    voxel_data = test_module.VoxelData(raw, (2.0, 3.0, 4.0), offset=(1.0, 2.0, 3.0))
+    positions = np.random.default_rng(1).uniform(
+        voxel_data.bbox[0], voxel_data.bbox[1], size=(1000, 3)
+    ).astype(np.float32)
+    actual = voxel_data.lookup(positions, interpolation='linear', chunk_size=100)
+    assert actual.dtype == np.float32
+
+    coords = (positions - voxel_data.offset) / voxel_data.voxel_dimensions - 0.5
+    coords = np.clip(coords, 0, np.array(raw.shape) - 1)
+    expected = map_coordinates(raw, coords.T, order=1)
+    npt.assert_allclose(actual, expected, atol=1e-6)
+
+
+def test_lookup_linear_values():
+    voxel_data = test_module.VoxelData(np.array([[0, 10], [20, 30]], dtype=np.uint8), (2.0, 2.0))
+    actual = voxel_data.lookup(
+        [[1., 1.], [2., 2.], [2., 1.], [0., 0.], [3.5, 3.9], [5., 5.], [np.nan, 1.]],
+        outer_value=-1,
+        interpolation='linear',
+    )
+    assert actual.dtype == np.float32
+    assert_array_equal(actual, [0, 15, 10, 0, 30, -1, -1])
+
+    with pytest.raises(VoxcellError, match='Out of bounds'):
+        voxel_data.lookup([[5., 5.]], interpolation='linear')
+    with pytest.raises(VoxcellError, match='Unsupported interpolation'):
+        voxel_data.lookup([[1., 1.]], interpolation='cubic')
+
+
+def test_lookup_linear_vector_payload():
+    raw = np.zeros((1, 2, 2, 3), dtype=np.float64)
+    raw[0, 1] = [[1, 2, 3], [4, 5, 6]]
+    voxel_data = test_module.VoxelData(raw, (1.0, 1.0, 1.0))
+    actual = voxel_data.lookup(np.array([[0.5, 1., 0.5], [0.2, 1.5, 1.5]]), interpolation='linear')
+    assert actual.dtype == np.float64
+    assert_almost_equal(actual, [[0.5, 1., 1.5], [4., 5., 6.]])
+
+
+def test_value_counts():
+    raw = np.array([[[1, 1], [2, 0]], [[1, 7], [7, 7]]], dtype=np.int16)
+    voxel_data = test_module.VoxelData(raw, (2.0, 2.0, 2.0))
+    actual = voxel_data.value_counts()
+    pdt.assert_series_equal(
+        actual, pd.Series([1, 3, 1, 3], index=np.array([0, 1, 2, 7], dtype=np.int16))
+    )
+    with patch.object(test_module.parallel, 'SLAB_SIZE', 1):
+        pdt.assert_series_equal(voxel_data.value_counts(), actual)
+
+    raw = np.array([[1e9, -1e9], [0.5, 0.5]])
+    actual = test_module.VoxelData(raw, (1.0, 1.0)).value_counts()
+    pdt.assert_series_equal(actual, pd.Series([1, 2, 1], index=[-1e9, 0.5, 1e9]))
+
+    actual = test_module.VoxelData(np.array([True, True, False]), (1.0,)).value_counts()
+    pdt.assert_series_equal(actual, pd.Series([1, 2], index=[False, True]))
+
+    raw = np.array([2 ** 64 - 2, 2 ** 64 - 1, 2 ** 64 - 2], dtype=np.uint64)
+    actual = test_module.VoxelData(raw, (1.0,)).value_counts()
+    assert actual.index.dtype == np.uint64
+    assert actual.to_dict() == {2 ** 64 - 2: 2, 2 ** 64 - 1: 1}
+
+
+def test_volumes():
+    raw = np.array([[[1, 1], [2, 0]], [[1, 7], [7, 7]]], dtype=np.uint32)
+    voxel_data = test_module.VoxelData(raw, (2.0, 2.0, 2.0))
+    value_sets = [1, [1, 2], {2, 7, 42}, [], [1, 1], np.array([0, 7])]
+    actual = voxel_data.volumes(value_sets)
+    assert_array_equal(actual, [24, 32, 32, 0, 24, 32])
+    assert_array_equal(actual, [voxel_data.volume(values) for values in value_sets])
+
+
+def _oblique_volume():
+    angle = np.deg2rad(30)
+    directions = [[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]]
+    raw = np.arange(20, dtype=np.int32).reshape(4, 5)
+    return test_module.VoxelData(raw, (2.0, 3.0), offset=(10.0, 20.0), directions=directions)
+
+
+def test_oblique_positions():
+    voxel_data = _oblique_volume()
+    indices = np.stack(np.meshgrid(range(4), range(5), indexing='ij'), axis=-1).reshape(-1, 2)
+    positions = voxel_data.indices_to_positions(indices + 0.5)
+    assert_almost_equal(positions[0], [10.0 + 0.866 - 0.75, 20.0 + 0.5 + 1.299], decimal=3)
+    assert_array_equal(voxel_data.positions_to_indices(positions), indices)
+    assert_array_equal(voxel_data.lookup(positions), voxel_data.raw.ravel())
+    assert_almost_equal(
+        voxel_data.lookup(positions, interpolation='linear'), voxel_data.raw.ravel(), decimal=4
+    )
+    assert_array_equal(voxel_data.lookup([[0.0, 0.0], [10.1, 20.1]], outer_value=-1), [-1, 0])
+    with pytest.raises(VoxcellError):
+        voxel_data.lookup([[0.0, 0.0]])
+
+    corners = voxel_data.indices_to_positions(np.array([[0, 0], [4, 0], [0, 5], [4, 5]]))
+    assert_almost_equal(voxel_data.bbox, [corners.min(axis=0), corners.max(axis=0)])
+    assert_almost_equal(voxel_data.voxel_volume, 6.0)
+
+
+def test_oblique_save_load(tmp_path):
+    voxel_data = _oblique_volume()
+    position = voxel_data.indices_to_positions([[1.5, 2.5]])
+    bbox = [position[0] - 0.1, position[0] + 0.1]
+
+    voxel_data.save_nrrd(tmp_path / 'oblique.nrrd')
+    actual = test_module.VoxelData.load_nrrd(tmp_path / 'oblique.nrrd')
+    assert_almost_equal(actual.directions, voxel_data.directions)
+    assert_almost_equal(actual.voxel_dimensions, voxel_data.voxel_dimensions)
+    assert_array_equal(actual.raw, voxel_data.raw)
+    actual = test_module.VoxelData.load_nrrd(tmp_path / 'oblique.nrrd', bbox=bbox)
+    assert actual.shape == (1, 1)
+    assert_array_equal(actual.lookup(position), [7])
+
+    voxel_data.save_h5(tmp_path / 'oblique.h5')
+    actual = test_module.VoxelData.load_h5(tmp_path / 'oblique.h5')
+    assert_almost_equal(actual.directions, voxel_data.directions)
+    actual = test_module.VoxelData.load_h5(tmp_path / 'oblique.h5', bbox=bbox)
+    assert_array_equal(actual.lookup(position), [7])
+
+
+def test_bbox_to_aabb():
+    assert_array_equal(
+        test_module._box_corners([[0, 1], [2, 3]]).tolist(), [[0, 1], [0, 3], [2, 1], [2, 3]]
+    )
+    start, stop = test_module._bbox_to_aabb([[1.5, 2], [4, 7]], [1, 2], [0, 0], (10, 3))
+    assert_array_equal(start.tolist(), [1, 1])
+    assert_array_equal(stop.tolist(), [4, 3])
+    # grid rotated by 90 degrees: voxel axes point along y and -x
+    start, stop = test_module._bbox_to_aabb(
+        [[-2, 1], [-1, 3]], [1, 1], [0, 0], (10, 10), np.array([[0., 1.], [-1., 0.]])
+    )
+    assert_array_equal(start.tolist(), [1, 1])
+    assert_array_equal(stop.tolist(), [3, 2])
+    with pytest.raises(VoxcellError):
+        test_module._bbox_to_aabb([[20, 20], [30, 30]], [1, 1], [0, 0], (10, 10))
+
+
+def test_oblique_derived():
+    voxel_data = _oblique_volume()
+    position = voxel_data.indices_to_positions([[0.5, 0.5]])
+    assert_array_equal(voxel_data.with_data(voxel_data.raw * 2).lookup(position), [0])
+    assert_array_equal(voxel_data.resample(2).lookup(position), [3])
+    compacted = voxel_data.compact()
+    assert_array_equal(compacted.lookup(voxel_data.indices_to_positions([[3.5, 4.5]])), [19])
+    with pytest.raises(VoxcellError):
+        voxel_data.clip(voxel_data.bbox)
+    with pytest.raises(VoxcellError):
+        test_module.VoxelData(np.zeros((2, 2)), (1.0, 1.0), directions=[[1, 1], [1, 1]])
+
+
+def test_lookup_layers():
+    rng = np.random.default_rng(0)
+    regions = test_module.VoxelData(np.arange(24).reshape(2, 3, 4), (1.0, 2.0, 3.0), offset=(1.0, 1.0, 1.0))
+    layers = {
+        'regions': regions,
+        'orientation': regions.with_data(rng.random((2, 3, 4, 4))),
+        'density': regions.with_data(rng.random((2, 3, 4), dtype=np.float32)),
+    }
+    positions = rng.uniform(0.0, 14.0, size=(50, 3))
+    outer_value = {'regions': -1, 'orientation': np.nan, 'density': 0.0}
+    with patch.object(test_module.VoxelData, 'positions_to_indices', side_effect=AssertionError):
+        actual = test_module.lookup_layers(layers, positions, outer_value=outer_value, chunk_size=7)
+    assert list(actual) == list(layers)
+    for name, layer in layers.items():
+        assert actual[name].dtype == layer.dtype
+        assert_array_equal(actual[name], layer.lookup(positions, outer_value=outer_value[name]))
+
+    inner = positions[np.all((positions > 1.0) & (positions < [3.0, 7.0, 13.0]), axis=1)]
+    actual = test_module.lookup_layers(layers, inner.reshape(-1, 1, 3))
+    assert actual['orientation'].shape == (len(inner), 1, 4)
+    actual = test_module.lookup_layers(layers, inner[0])
+    assert isinstance(actual['regions'], np.generic)
+    assert actual['regions'] == regions.lookup(inner[0])
+    assert actual['orientation'].shape == (4,)
+    with pytest.raises(VoxcellError):
+        test_module.lookup_layers(layers, positions)
+    with pytest.raises(VoxcellError):
+        test_module.lookup_layers({'a': regions, 'b': regions.resample(2)}, inner)
+    with pytest.raises(VoxcellError):
+        test_module.lookup_layers({}, inner)
@@ -0,0 +1,367 @@
+import operator
+import tracemalloc
+from unittest.mock import patch
+
+import numpy as np
+import pandas.testing as pdt
+import pytest
+from numpy.testing import assert_almost_equal, assert_array_equal
+
+import voxcell.voxel_data_storage as test_module
+from voxcell.exceptions import VoxcellError
+from voxcell.voxel_data import VoxelData
+
+
+def _sparse_volume():
+    raw = np.zeros((3, 4, 5), dtype=np.int16)
+    raw[1, 2, 3] = 7
+    raw[2, 1, 1] = 5
+    raw[1, 1, 4] = -1
+    return VoxelData(raw, (1.0, 2.0, 3.0), offset=(10.0, 20.0, 30.0))
+
+
+def test_sparse_voxel_data():
+    dense = _sparse_volume()
+    sparse = test_module.SparseVoxelData.from_dense(dense)
+    assert sparse.shape == dense.shape
+    assert sparse.payload_shape == ()
+    assert sparse.dtype == np.int16
+    assert_array_equal(sparse.bbox, dense.bbox)
+    assert len(sparse.values) == 3
+    assert_array_equal(sparse.raw, dense.raw)
+    assert not sparse.raw.flags.writeable
+    assert_array_equal(sparse.to_dense().raw, dense.raw)
+
+    positions = dense.indices_to_positions(np.array([[1.5, 2.5, 3.5], [0.5, 0.5, 0.5], [2.5, 1.5, 1.5]]))
+    assert_array_equal(sparse.lookup(positions), [7, 0, 5])
+    assert_array_equal(sparse.lookup(np.vstack([positions, [[0, 0, 0]]]), outer_value=-2), [7, 0, 5, -2])
+    assert_array_equal(sparse.positions_to_indices(positions), dense.positions_to_indices(positions))
+
+    assert sparse.count(7) == 1
+    assert sparse.count([0, 5]) == dense.count([0, 5]) == 58
+    assert sparse.count({5, 7}) == 2
+    assert sparse.volume([5, 7]) == dense.volume([5, 7])
+
+
+def test_sparse_voxel_data_empty():
+    sparse = test_module.SparseVoxelData(np.zeros((0, 2)), np.zeros(0), (2, 2), (1.0, 1.0))
+    assert_array_equal(sparse.lookup([[0.5, 0.5]]), [0])
+    assert sparse.count(0) == 4
+
+
+def test_sparse_voxel_data_payload(tmp_path):
+    raw = np.zeros((3, 4, 5, 2, 3), dtype=np.float32)
+    raw[1, 2, 3] = np.arange(6).reshape((2, 3))
+    raw[0, 3, 4, 1, 2] = 1
+    dense = VoxelData(raw, (1.0, 2.0, 3.0))
+    sparse = test_module.SparseVoxelData.from_dense(dense)
+    assert sparse.payload_shape == (2, 3)
+    assert_array_equal(sparse.raw, raw)
+    assert_array_equal(sparse.lookup([[1.5, 5.0, 10.5], [0, 0, 0]]), raw[[1, 0], [2, 0], [3, 0]])
+
+    filepath = str(tmp_path / 'sparse.nrrd')
+    with patch.object(test_module.nrrd_utils, 'CHUNK_SIZE', 100):
+        sparse.save_nrrd(filepath)
+    assert_array_equal(VoxelData.load_nrrd(filepath).raw, raw)
+
+
+def test_sparse_voxel_data_save_nrrd(tmp_path):
+    dense = _sparse_volume()
+    sparse = test_module.SparseVoxelData.from_dense(dense)
+    filepath = str(tmp_path / 'sparse.nrrd')
+    with patch.object(test_module.nrrd_utils, 'CHUNK_SIZE', 16):
+        sparse.save_nrrd(filepath)
+    actual = VoxelData.load_nrrd(filepath)
+    assert_array_equal(actual.raw, dense.raw)
+    assert_array_equal(actual.offset, dense.offset)
+
+
+def test_sparse_voxel_data_compact():
+    dense = _sparse_volume()
+    sparse = test_module.SparseVoxelData.from_dense(dense)
+    for na_values in [(0,), (0, -1), (-1,)]:
+        expected = dense.compact(na_values=na_values)
+        actual = sparse.compact(na_values=na_values)
+        assert isinstance(actual, test_module.SparseVoxelData)
+        assert_array_equal(actual.raw, expected.raw)
+        assert_array_equal(actual.offset, expected.offset)
+
+    sparse.compact(na_values=(0, -1), inplace=True)
+    assert sparse.shape == (2, 2, 3)
+    assert_array_equal(sparse.offset, [11, 22, 33])
+
+    with pytest.raises(VoxcellError, match="No voxels to keep"):
+        sparse.compact(na_values=(0, 5, 7))
+
+
+def test_sparse_voxel_data_raises():
+    with pytest.raises(VoxcellError, match="lengths differ"):
+        test_module.SparseVoxelData([[0, 0]], [1, 2], (2, 2), (1.0, 1.0))
+    with pytest.raises(VoxcellError, match="Duplicate voxel indices"):
+        test_module.SparseVoxelData([[0, 1], [0, 1]], [1, 2], (2, 2), (1.0, 1.0))
+
+
+@pytest.mark.parametrize('payload_shape', [(), (3,)])
+def test_compressed_voxel_data(tmp_path, payload_shape):
+    shape = (10, 7, 9) + payload_shape
+    raw = np.random.default_rng(0).integers(0, 5, size=shape).astype(np.int32)
+    dense = VoxelData(raw, (1.0, 2.0, 3.0), offset=(10.0, 20.0, 30.0))
+    compressed = test_module.CompressedVoxelData(
+        raw, (1.0, 2.0, 3.0), offset=(10.0, 20.0, 30.0), tile_shape=(4, 3, 5), cache_size=2
+    )
+    assert compressed.tile_shape == (4, 3, 5)
+    assert compressed.shape == dense.shape
+    assert compressed.payload_shape == payload_shape
+    assert compressed.dtype == np.int32
+    assert compressed.compressed_nbytes > 0
+    assert_array_equal(compressed.raw, raw)
+    assert not compressed.raw.flags.writeable
+
+    positions = np.random.default_rng(1).uniform(dense.bbox[0] - 1, dense.bbox[1] + 1, size=(100, 3))
+    assert_array_equal(
+        compressed.lookup(positions, outer_value=np.full(payload_shape, -1)),
+        dense.lookup(positions, outer_value=np.full(payload_shape, -1)),
+    )
+    assert len(compressed._cache) == 2
+    assert compressed.count([1, 2]) == dense.count([1, 2])
+
+    filepath = str(tmp_path / 'compressed.nrrd')
+    compressed.save_nrrd(filepath)
+    assert_array_equal(VoxelData.load_nrrd(filepath).raw, raw)
+
+
+def test_compressed_voxel_data_assign_raw():
+    raw = np.zeros((5, 6), dtype=np.uint8)
+    raw[2:4, 1:3] = 1
+    compressed = test_module.CompressedVoxelData(raw, (1.0, 1.0), tile_shape=2)
+    assert compressed.tile_shape == (2, 2)
+    compressed.compact(inplace=True)
+    assert compressed.shape == (2, 2)
+    assert_array_equal(compressed.raw, [[1, 1], [1, 1]])
+    assert_array_equal(compressed.offset, [2, 1])
+    assert_array_equal(compressed.lookup([[2.5, 1.5]]), [1])
+
+
+def test_compressed_voxel_data_slabs():
+    raw = np.zeros((16, 9, 10), dtype=np.uint8)
+    raw[2:13, 1:8, 3:9] = 1
+    compressed = test_module.CompressedVoxelData(raw, (1.0, 1.0, 1.0), tile_shape=4, cache_size=1)
+    with patch.object(test_module.parallel, 'SLAB_SIZE', 100), \
+            patch.object(compressed, '_decompress_tile', wraps=compressed._decompress_tile) as mock:
+        assert all((s.stop - s.start) % 4 == 0 for s in compressed._slab_slices()[:-1])
+        actual = compressed.compact(n_jobs=2)
+    assert_array_equal(actual.raw, raw[2:13, 1:8, 3:9])
+    # each tile is decompressed once to find the bounding box, and once to read the values
+    assert mock.call_count <= 2 * compressed._tiles.size
+
+
+def test_value_counts():
+    dense = _sparse_volume()
+    expected = dense.value_counts()
+    pdt.assert_series_equal(test_module.SparseVoxelData.from_dense(dense).value_counts(), expected)
+    pdt.assert_series_equal(
+        test_module.CompressedVoxelData(dense.raw, dense.voxel_dimensions, tile_shape=2).value_counts(),
+        expected,
+    )
+    sparse = test_module.SparseVoxelData.from_dense(dense, fill_value=5)
+    pdt.assert_series_equal(sparse.value_counts(), expected)
+    assert_array_equal(sparse.volumes([0, [5, 7]]), dense.volumes([0, [5, 7]]))
+
+
+def test_read_region():
+    dense = _sparse_volume()
+    region = (slice(1, 3), slice(1, 4))
+    expected = dense.raw[region]
+    assert_array_equal(test_module.SparseVoxelData.from_dense(dense)._read_region(region), expected)
+    compressed = test_module.CompressedVoxelData(
+        dense.raw, dense.voxel_dimensions, dense.offset, tile_shape=2
+    )
+    assert_array_equal(compressed._read_region(region), expected)
+    bbox = [(10.5, 20.5, 33.0), (13.0, 28.0, 45.0)]
+    with patch.object(test_module.parallel, 'SLAB_SIZE', 7):
+        assert_array_equal(compressed.clip(bbox).raw, dense.clip(bbox).raw)
+        assert_array_equal(compressed.compact().raw, dense.compact().raw)
+
+
+def test_sparse_voxel_data_read_region():
+    rng = np.random.default_rng(0)
+    raw = np.where(rng.random((9, 8, 7)) < 0.2, rng.integers(1, 5, size=(9, 8, 7)), 0)
+    sparse = test_module.SparseVoxelData.from_dense(VoxelData(raw, (1.0, 1.0, 1.0)))
+    for region in [
+        (slice(2, 4),),
+        (slice(None), slice(None), slice(3, 5)),
+        (slice(1, 8), slice(2, 3), slice(0, 6)),
+        (slice(5, 5),),
+    ]:
+        assert_array_equal(sparse._read_region(region), raw[region])
+
+    # only the stored voxels in the range along the first or last axis are scanned
+    assert len(sparse.values[sparse._stored_range([2, 0, 0], [4, 8, 7])]) == np.count_nonzero(raw[2:4])
+    assert len(sparse.values[sparse._stored_range([0, 0, 3], [9, 8, 7])]) == np.count_nonzero(raw[..., 3:])
+
+    raw[:, :, 0] = 0
+    sparse = test_module.SparseVoxelData.from_dense(VoxelData(raw, (1.0, 1.0, 1.0)))
+    assert_array_equal(sparse._read_region((slice(1, 3),)), raw[1:3])
+    sparse.compact(inplace=True)
+    assert_array_equal(sparse._read_region((slice(1, 3),)), raw[1:3, :, 1:])
+
+
+def test_delayed_voxel_data(tmp_path):
+    rng = np.random.default_rng(0)
+    regions = VoxelData(rng.integers(0, 5, size=(7, 6, 5)), (1.0, 2.0, 3.0), offset=(10.0, 20.0, 30.0))
+    density = regions.with_data(rng.uniform(size=regions.shape))
+    expected = np.where(np.isin(regions.raw, [1, 2]) & (density.raw > 0.5), density.raw * 2, 0)
+
+    lazy_regions = test_module.DelayedVoxelData.from_voxel_data(regions)
+    lazy_density = test_module.DelayedVoxelData.from_voxel_data(density)
+    actual = (lazy_regions.isin([1, 2]) & (lazy_density > 0.5)).where(lazy_density * 2)
+    assert actual.shape == (7, 6, 5)
+    assert actual.dtype == np.float64
+    assert_array_equal(actual.offset, regions.offset)
+
+    with patch.object(test_module.parallel, 'SLAB_SIZE', 30):
+        assert_array_equal(actual.compute().raw, expected)
+        assert_array_equal(actual.compute(n_jobs=2).raw, expected)
+        assert actual.count(0) == np.count_nonzero(expected == 0)
+        filepath = str(tmp_path / 'delayed.nrrd')
+        actual.save_nrrd(filepath)
+    assert_array_equal(VoxelData.load_nrrd(filepath).raw, expected)
+
+    positions = regions.indices_to_positions(np.array([[1, 2, 3], [6, 5, 4]]) + 0.5)
+    assert_array_equal(actual.lookup(positions), expected[[1, 6], [2, 5], [3, 4]])
+
+    assert_array_equal((2 - lazy_regions).raw, 2 - regions.raw)
+    assert_array_equal((density + lazy_regions).raw, density.raw + regions.raw)
+    assert_array_equal((-lazy_regions).astype(np.int8).raw, -regions.raw.astype(np.int8))
+    assert (~lazy_regions.isin([0])).dtype == bool
+
+    for op in [operator.eq, operator.ne]:
+        assert isinstance(op(lazy_regions, 3), test_module.DelayedVoxelData)
+        assert_array_equal(op(lazy_regions, 3).raw, op(regions.raw, 3))
+        assert_array_equal(op(3, lazy_regions).raw, op(regions.raw, 3))
+        assert_array_equal(op(lazy_regions, regions).raw, op(regions.raw, regions.raw))
+    with pytest.raises(TypeError, match='unhashable'):
+        hash(lazy_regions)
+
+
+@pytest.mark.parametrize('interpolation', ['nearest', 'linear'])
+def test_delayed_voxel_data_lookup_by_tile(interpolation):
+    rng = np.random.default_rng(0)
+    density = VoxelData(rng.uniform(size=(20, 17, 13)), (1.0, 2.0, 3.0), offset=(5.0, 6.0, 7.0))
+    delayed = test_module.DelayedVoxelData.from_voxel_data(density) * 2
+    positions = rng.uniform(density.bbox[0], density.bbox[1], size=(1000, 3))
+    with patch.object(test_module, '_CONTIGUOUS_TILE_SIZE', 4), patch.object(
+        test_module.DelayedVoxelData, '_read_region', autospec=True,
+        side_effect=test_module.DelayedVoxelData._read_region,
+    ) as read_region:
+        actual = delayed.lookup(positions, interpolation=interpolation)
+    # one tile of the expression is evaluated at a time
+    sizes = [np.prod([s.stop - s.start for s in c.args[1]]) for c in read_region.call_args_list]
+    assert max(sizes) <= 4 ** 3
+    assert_almost_equal(actual, 2 * density.lookup(positions, interpolation=interpolation))
+
+
+def test_delayed_voxel_data_payload():
+    regions = VoxelData(np.arange(6).reshape(2, 3), (1.0, 1.0))
+    vectors = regions.with_data(np.arange(18.0).reshape(2, 3, 3))
+    actual = test_module.DelayedVoxelData.from_voxel_data(regions).isin([1, 4]).where(vectors, -1.0)
+    assert actual.payload_shape == (3,)
+    expected = np.full((2, 3, 3), -1.0)
+    expected[0, 1] = vectors.raw[0, 1]
+    expected[1, 1] = vectors.raw[1, 1]
+    assert_array_equal(actual.raw, expected)
+
+
+def test_delayed_voxel_data_reduce(tmp_path):
+    a = VoxelData(np.arange(12, dtype=np.int32).reshape(3, 4), (1.0, 1.0))
+    b = a.with_data(np.ones((3, 4), dtype=np.float32))
+    filepath = str(tmp_path / 'a.nrrd')
+    a.save_nrrd(filepath, encoding='raw')
+    actual = test_module.DelayedVoxelData.reduce(operator.add, [a, b, filepath])
+    assert isinstance(actual, test_module.DelayedVoxelData)
+    assert_array_equal(actual.raw, 2 * a.raw + 1)
+
+    with pytest.raises(TypeError):
+        test_module.DelayedVoxelData.reduce(operator.add, [])
+
+    filepath = str(tmp_path / 'gzip.nrrd')
+    a.save_nrrd(filepath, encoding='gzip')
+    with pytest.raises(VoxcellError, match="raw-encoded"):
+        test_module.DelayedVoxelData.reduce(operator.add, [a, filepath])
+
+
+def test_delayed_voxel_data_reduce_paths_not_retained(tmp_path):
+    a = VoxelData(np.ones((64, 64, 64)), (1.0, 1.0, 1.0))
+    filepaths = [str(tmp_path / f'{i}.nrrd') for i in range(4)]
+    for filepath in filepaths:
+        a.save_nrrd(filepath, encoding='raw')
+    reduced = test_module.DelayedVoxelData.reduce(np.add, filepaths)
+    tracemalloc.start()
+    try:
+        with patch.object(test_module.parallel, 'SLAB_SIZE', 2 ** 14):
+            actual = reduced.compute()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert_array_equal(actual.raw, 4 * a.raw)
+    # the inputs are not kept: only the output remains, plus a few slabs at the peak
+    assert current < 1.1 * a.raw.nbytes
+    assert peak < 1.5 * a.raw.nbytes
+
+
+def test_delayed_voxel_data_raises():
+    a = test_module.DelayedVoxelData.from_voxel_data(VoxelData(np.zeros((3, 4)), (1.0, 1.0)))
+    with pytest.raises(VoxcellError):
+        a + VoxelData(np.zeros((3, 5)), (1.0, 1.0))
+    with pytest.raises(VoxcellError):
+        a + VoxelData(np.zeros((3, 4)), (2.0, 1.0))
+
+
+@pytest.mark.parametrize('payload_shape', [(), (2,)])
+def test_h5_voxel_data(tmp_path, payload_shape):
+    rng = np.random.default_rng(0)
+    raw = np.zeros((20, 17, 13) + payload_shape, dtype=np.int16)
+    raw[3:15, 2:11, 4:9] = rng.integers(0, 5, size=(12, 9, 5) + payload_shape)
+    dense = VoxelData(raw, (1.0, 2.0, 3.0), offset=(5.0, 6.0, 7.0))
+    filepath = str(tmp_path / 'volume.h5')
+    dense.save_h5(filepath, chunks=4)
+
+    with test_module.H5VoxelData(filepath, cache_nbytes=2 ** 12) as actual, \
+            patch.object(test_module.parallel, 'SLAB_SIZE', 500):
+        assert actual.shape == dense.shape
+        assert actual.payload_shape == payload_shape
+        assert actual.chunk_shape == (4, 4, 4)
+        assert_array_equal(actual.offset, dense.offset)
+        assert all((s.stop - s.start) % 4 == 0 for s in actual._slab_slices()[:-1])
+
+        assert actual.count([1, 2]) == dense.count([1, 2])
+        pdt.assert_series_equal(actual.value_counts(), dense.value_counts())
+
+        positions = rng.uniform(dense.bbox[0] - 1, dense.bbox[1] + 1, size=(300, 3))
+        outer_value = np.full(payload_shape, -1)
+        assert_array_equal(
+            actual.lookup(positions, outer_value=outer_value),
+            dense.lookup(positions, outer_value=outer_value),
+        )
+
+        bbox = [(8.0, 10.0, 15.0), (20.0, 30.0, 40.0)]
+        clipped = actual.clip(bbox)
+        assert isinstance(clipped, test_module.DelayedVoxelData)
+        assert_array_equal(clipped.raw, dense.clip(bbox).raw)
+
+        compacted = actual.compact()
+        expected = dense.compact()
+        assert_array_equal(compacted.raw, expected.raw)
+        assert_array_equal(compacted.offset, expected.offset)
+
+        nrrd_path = str(tmp_path / 'volume.nrrd')
+        actual.save_nrrd(nrrd_path)
+        assert_array_equal(VoxelData.load_nrrd(nrrd_path).raw, raw)
+
+        assert_array_equal(actual.with_data(actual.raw).raw, raw)
+        assert not actual.raw.flags.writeable
+
+        with pytest.raises(VoxcellError):
+            actual.clip(bbox, inplace=True)
+        with pytest.raises(VoxcellError):
+            actual.compact(inplace=True)
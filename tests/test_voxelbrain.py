@@ -1,3 +1,5 @@
+import json
+import os
 from pathlib import Path
 from unittest.mock import patch
 
@@ -101,6 +103,51 @@ def test_get_region_mask(mock_rmap, mock_data, _):
         DUMMY_ATLAS.get_region_mask('aa')
 
 
+def test_get_region_mask_label_index(tmp_path):
+    (tmp_path / 'hierarchy.json').write_text(json.dumps({
+        'id': 1, 'acronym': 'A', 'name': 'aA', 'children': [{'id': 2, 'acronym': 'B', 'name': 'Bb'}]
+    }))
+    raw = np.array([[[1, 0], [2, 3]]], dtype=np.uint16)
+    VoxelData(raw, (2., 2., 2.), offset=(1., 2., 3.)).save_nrrd(str(tmp_path / 'brain_regions.nrrd'))
+    atlas = test_module.Atlas.open(str(tmp_path))
+
+    expected = atlas.get_region_mask('A')
+    actual = atlas.get_region_mask('A', use_label_index=True)
+    npt.assert_equal(actual.raw, [[[True, False], [True, False]]])
+    npt.assert_equal(actual.raw, expected.raw)
+    npt.assert_equal(actual.offset, expected.offset)
+    npt.assert_equal(actual.voxel_dimensions, expected.voxel_dimensions)
+    assert not (tmp_path / 'brain_regions.index.npz').exists()
+
+    label_index = atlas.save_label_index()
+    assert (tmp_path / 'brain_regions.index.npz').exists()
+    npt.assert_equal(atlas.load_label_index().order, label_index.order)
+    npt.assert_equal(atlas.get_region_mask('B', use_label_index=True).raw, [[[False, False], [True, False]]])
+
+    # annotation replaced with one of the same shape: the saved index is stale, and rebuilt
+    VoxelData(raw[:, ::-1], (2., 2., 2.), offset=(1., 2., 3.)).save_nrrd(
+        str(tmp_path / 'brain_regions.nrrd')
+    )
+    os.utime(tmp_path / 'brain_regions.nrrd', ns=(0, 10 ** 9))
+    npt.assert_equal(atlas.get_region_mask('B', use_label_index=True).raw, [[[True, False], [False, False]]])
+    assert atlas.load_label_index().fingerprint.endswith(':1000000000')
+
+
+def test_lookup(tmp_path):
+    raw = np.array([[[1, 0], [2, 3]]], dtype=np.uint16)
+    brain_regions = VoxelData(raw, (2., 2., 2.), offset=(1., 2., 3.))
+    brain_regions.save_nrrd(str(tmp_path / 'brain_regions.nrrd'))
+    brain_regions.with_data(raw * 0.5).save_nrrd(str(tmp_path / 'density.nrrd'))
+    atlas = test_module.Atlas.open(str(tmp_path))
+
+    actual = atlas.lookup(['brain_regions', 'density'], [[2., 5., 6.], [0., 0., 0.]], outer_value=0)
+    assert list(actual) == ['brain_regions', 'density']
+    npt.assert_equal(actual['brain_regions'], [3, 0])
+    npt.assert_equal(actual['density'], [1.5, 0.])
+    with pytest.raises(VoxcellError):
+        atlas.lookup(['brain_regions'], [[0., 0., 0.]])
+
+
 expected_data = (('layer 1', {1140, 1125}),
                  ('layer 2', {1141, 1126}),
                  ('layer 3', {517, 1142, 1127}),
@@ -2,11 +2,21 @@
 
 from voxcell.cell_collection import CellCollection
 from voxcell.exceptions import VoxcellError
+from voxcell.label_index import LabelIndex
+from voxcell.position_sampler import PositionSampler
 from voxcell.region_map import RegionMap
 from voxcell.voxel_data import (
+    LazyVoxelData,
     OrientationField,
     ROIMask,
     VoxelData,
+    lookup_layers,
     values_to_hemisphere,
     values_to_region_attribute,
 )
+from voxcell.voxel_data_storage import (
+    CompressedVoxelData,
+    DelayedVoxelData,
+    H5VoxelData,
+    SparseVoxelData,
+)
@@ -0,0 +1,136 @@
+"""Per-label voxel index for label volumes."""
+
+import numpy as np
+
+from voxcell.exceptions import VoxcellError
+
+
+class LabelIndex:
+    """Flat indices of the voxels carrying each label, in compressed sparse row layout.
+
+    Voxel indices (in C order) sorted by label are stored in a single array `order`;
+    the voxels with label `labels[i]` are `order[offsets[i]:offsets[i + 1]]`, in increasing order.
+    Querying the voxels with a given set of labels is thus proportional to the number of
+    these voxels instead of the size of the volume.
+    """
+
+    def __init__(self, labels, offsets, order, shape, *, fingerprint=None):
+        """Init LabelIndex.
+
+        Args:
+            labels: sorted unique labels (K array)
+            offsets: offsets of each label voxels in `order` (K + 1 array)
+            order: flat voxel indices (in C order) sorted by label
+            shape: shape of the indexed volume
+            fingerprint(str): identifier of the indexed data version (e.g. size and
+                modification time of its file), to detect stale saved indices
+        """
+        self.labels = np.asarray(labels)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.order = np.asarray(order)
+        self.shape = tuple(int(s) for s in shape)
+        self.fingerprint = fingerprint
+        if len(self.offsets) != len(self.labels) + 1 or self.offsets[-1] != len(self.order):
+            raise VoxcellError("Inconsistent label index offsets")
+
+    @classmethod
+    def from_voxel_data(cls, voxel_data):
+        """Build LabelIndex from VoxelData with scalar labels.
+
+        The volume is sorted once with a stable sort; labels and offsets come from
+        `VoxelData.value_counts`.
+        """
+        if voxel_data.payload_shape:
+            raise VoxcellError("Label index requires scalar voxel data")
+        counts = voxel_data.value_counts()
+        order = np.argsort(voxel_data.raw, axis=None, kind='stable')
+        if order.size < 2 ** 32:
+            order = order.astype(np.uint32)
+        offsets = np.concatenate([[0], np.cumsum(counts.values)])
+        return cls(counts.index.values, offsets, order, voxel_data.shape)
+
+    @classmethod
+    def load(cls, path):
+        """Load LabelIndex from NPZ file."""
+        with np.load(path, allow_pickle=False) as data:
+            fingerprint = str(data['fingerprint']) if 'fingerprint' in data else None
+            return cls(
+                data['labels'], data['offsets'], data['order'], data['shape'],
+                fingerprint=fingerprint,
+            )
+
+    def save(self, path):
+        """Save LabelIndex to NPZ file."""
+        extra = {} if self.fingerprint is None else {'fingerprint': self.fingerprint}
+        np.savez(
+            path, labels=self.labels, offsets=self.offsets, order=self.order, shape=self.shape,
+            **extra
+        )
+
+    def _ranges(self, values):
+        """`order` ranges of the given labels (missing labels are ignored)."""
+        values = np.unique(np.asarray(list(values) if isinstance(values, set) else values))
+        pos = np.searchsorted(self.labels, values)
+        found = pos < len(self.labels)
+        found[found] = self.labels[pos[found]] == values[found]
+        pos = pos[found]
+        return self.offsets[pos], self.offsets[pos + 1]
+
+    def count(self, values):
+        """Number of voxels with label from the given list.
+
+        `values` could be a single value or an iterable.
+        """
+        starts, stops = self._ranges(values)
+        return int(np.sum(stops - starts))
+
+    def flat_indices(self, values):
+        """Flat indices (in C order) of the voxels with label from the given list, sorted."""
+        starts, stops = self._ranges(values)
+        if len(starts) == 1:
+            return self.order[starts[0]:stops[0]].astype(np.intp)
+        result = np.concatenate(
+            [self.order[start:stop] for start, stop in zip(starts, stops)] + [[]]
+        ).astype(np.intp)
+        result.sort()
+        return result
+
+    def indices(self, values):
+        """Indices of the voxels with label from the given list (N x ndim array).
+
+        Same order as `np.argwhere(isin(raw, values))`.
+        """
+        return np.stack(np.unravel_index(self.flat_indices(values), self.shape), axis=-1)
+
+    def mask(self, values):
+        """Boolean mask of the voxels with label from the given list."""
+        result = np.zeros(self.shape, dtype=bool)
+        result.reshape(-1)[self.flat_indices(values)] = True
+        return result
+
+    def sample(self, values, size, rng=np.random):
+        """Indices of `size` voxels with label from the given list, sampled uniformly.
+
+        Voxels are sampled with replacement.
+
+        Args:
+            values: label or iterable of labels
+            size(int): number of voxels to sample
+            rng: random number generator (numpy.random module or Generator)
+
+        Returns:
+            `size` x ndim array of voxel indices
+        """
+        starts, stops = self._ranges(values)
+        counts = stops - starts
+        total = np.sum(counts)
+        if total == 0:
+            raise VoxcellError(f"No voxels with labels: {values}")
+        if hasattr(rng, 'integers'):
+            picks = rng.integers(0, total, size=size)
+        else:
+            picks = rng.randint(0, total, size=size)
+        cum_counts = np.cumsum(counts)
+        which = np.searchsorted(cum_counts, picks, side='right')
+        picks += starts[which] - (cum_counts[which] - counts[which])
+        return np.stack(np.unravel_index(self.order[picks], self.shape), axis=-1)
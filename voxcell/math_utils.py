@@ -6,6 +6,9 @@ import math
 import numpy as np
 from scipy.spatial.transform import Rotation
 
+from voxcell import parallel
+from voxcell.exceptions import VoxcellError
+
 
 def gcd(a, b):
     """Return greatest common divisor."""
@@ -23,14 +26,57 @@ def lcmm(args):
     return functools.reduce(lcm, args)
 
 
-def minimum_aabb(mask):
+_CHUNK_SIZE = 2 ** 20
+
+
+def minimum_aabb(mask, n_jobs=None):
     """Calculate the minimum axis-aligned bounding box for a volume mask.
 
+    The mask is reduced slab by slab to its `any` projections along each axis,
+    without computing the coordinates of its non-zero elements.
+    `n_jobs` is the number of threads (see `voxcell.parallel`).
+
     Returns:
         A tuple containing the minimum x,y,z and maximum x,y,z
     """
-    idx = np.nonzero(mask)
-    return np.min(idx, axis=1), np.max(idx, axis=1)
+    mask = np.asarray(mask)
+    return projections_minimum_aabb(parallel.map_chunks(
+        lambda slab: mask_projections(mask[slab]),
+        parallel.slab_slices(mask.shape, _CHUNK_SIZE),
+        n_jobs=n_jobs,
+    ))
+
+
+def mask_projections(mask):
+    """Projections of a mask along its first axis, and over its first axis.
+
+    Returns:
+        A tuple (1D mask of rows with any non-zero element, `any` reduction over the rows)
+    """
+    return np.any(mask.reshape(len(mask), -1), axis=1), np.any(mask, axis=0)
+
+
+def projections_minimum_aabb(projections):
+    """Calculate the minimum axis-aligned bounding box from mask slabs projections.
+
+    Args:
+        projections: `mask_projections` for consecutive slabs of a mask along the first axis
+
+    Returns:
+        A tuple containing the minimum x,y,z and maximum x,y,z
+    """
+    other_axes = functools.reduce(np.logical_or, (p[1] for p in projections), False)
+    if not np.any(other_axes):
+        raise ValueError("Empty mask")
+    other_axes = np.asarray(other_axes)
+    projections = [np.concatenate([p[0] for p in projections])] + [
+        np.any(other_axes, axis=tuple(np.delete(np.arange(other_axes.ndim), axis)))
+        for axis in range(other_axes.ndim)
+    ]
+    return (
+        np.array([np.argmax(p) for p in projections]),
+        np.array([len(p) - 1 - np.argmax(p[::-1]) for p in projections]),
+    )
 
 
 def positions_minimum_aabb(positions):
@@ -82,16 +128,126 @@ def normalize(vs):
     return vs / norm[..., np.newaxis]
 
 
-def isin(a, values):
+def _block_mode(values, starts):
+    """Most frequent value in each block (the smallest one on ties)."""
+    shape = tuple(len(s) for s in starts)
+    axis_ids = [
+        np.repeat(np.arange(len(s)), np.diff(np.append(s, n)))
+        for s, n in zip(starts, values.shape)
+    ]
+    ids = np.ravel(np.ravel_multi_index(np.ix_(*axis_ids), shape))
+    values = values.ravel()
+    order = np.lexsort((values, ids))
+    ids, values = ids[order], values[order]
+
+    run_starts = np.flatnonzero(
+        np.concatenate([[True], (ids[1:] != ids[:-1]) | (values[1:] != values[:-1])])
+    )
+    run_lengths = np.diff(np.append(run_starts, len(ids)))
+    run_ids = ids[run_starts]
+    # longest run first within each block; lexsort is stable, so smaller values win ties
+    best = np.lexsort((-run_lengths, run_ids))
+    best = best[np.concatenate([[True], run_ids[best][1:] != run_ids[best][:-1]])]
+    return values[run_starts[best]].reshape(shape)
+
+
+def block_reduce(values, starts, method):
+    """Reduce blocks of an array to a single value per block.
+
+    Args:
+        values: array to reduce
+        starts: for each of the first k axes of `values`, the (increasing) start indices
+            of the blocks along that axis, starting with 0; remaining axes are kept as is
+        method: 'sum', 'mean', 'normalized_mean' (mean normalized along the last axis)
+            or 'mode' (most frequent value, the smallest one on ties; requires k == values.ndim)
+
+    Returns:
+        Array of shape `tuple(len(s) for s in starts) + values.shape[k:]`; 'sum' of integers
+        is done with 64 bits integers, 'mean' of integers yields float64.
+    """
+    if method not in ('sum', 'mean', 'normalized_mean', 'mode'):
+        raise VoxcellError(f"Unsupported block reduction method: '{method}'")
+    if method == 'mode':
+        if len(starts) != values.ndim:
+            raise VoxcellError("'mode' block reduction requires scalar values")
+        return _block_mode(values, starts)
+    if values.dtype.kind in 'biu':
+        dtype = np.uint64 if values.dtype == np.uint64 else np.int64
+    else:
+        dtype = np.float64
+    result = values
+    for axis, axis_starts in enumerate(starts):
+        result = np.add.reduceat(result, axis_starts, axis=axis, dtype=dtype)
+    if method == 'sum':
+        return result if values.dtype.kind in 'biu' else result.astype(values.dtype)
+    counts = functools.reduce(np.multiply.outer, [
+        np.diff(np.append(s, n)) for s, n in zip(starts, values.shape)
+    ])
+    result = result / counts.reshape(counts.shape + (1,) * (values.ndim - len(starts)))
+    if method == 'normalized_mean':
+        result = normalize(result)
+    return result.astype(values.dtype) if values.dtype.kind == 'f' else result
+
+
+_ISIN_LUT_MAX_SIZE = 2 ** 24
+
+
+def _isin_lut(a, values, n_jobs):
+    """`isin` for integer `a` and `values`, with a lookup table over the range of `values`.
+
+    Returns None if the lookup table would be too large.
+    """
+    info = np.iinfo(a.dtype)
+    values = values[(values >= info.min) & (values <= info.max)]
+    result = np.zeros_like(a, dtype=bool)
+    if len(values) == 0:
+        return result
+    lo, hi = int(values.min()), int(values.max())
+    if hi - lo >= _ISIN_LUT_MAX_SIZE or hi >= 2 ** 63:
+        return None
+
+    # False sentinels at both ends catch (clipped) elements outside of [lo, hi] range
+    lut = np.zeros(hi - lo + 3, dtype=bool)
+    lut[values.astype(np.int64) - (lo - 1)] = True
+    flat_a, flat_result = np.ravel(a, order='K'), np.ravel(result, order='K')
+
+    def _gather(chunk):
+        idx = flat_a[chunk].astype(np.int64)
+        idx -= lo - 1
+        lut.take(idx, mode='clip', out=flat_result[chunk])
+
+    parallel.map_chunks(_gather, parallel.slab_slices(flat_a.shape, _CHUNK_SIZE), n_jobs=n_jobs)
+    return result
+
+
+def isin(a, values, n_jobs=None):
     """Naive NumPy.isin analogue.
 
     For our usecases (>10^9 non-unique elements in `a`, <10^2 unique elements in tested `values`),
     NumPy.isin() takes same amount of time, but is 3x more memory-hungry.
+
+    For integer `a` and `values`, a single pass over `a` is made with a lookup table over
+    the range of `values`, so that the cost does not depend on the number of values.
+    `n_jobs` is the number of threads (see `voxcell.parallel`).
     """
     a = np.asarray(a)
+    values = set(values)
+    if a.dtype.kind in 'iu' and values:
+        int_values = np.array(list(values))
+        if int_values.dtype.kind in 'iu':
+            result = _isin_lut(a, int_values, n_jobs)
+            if result is not None:
+                return result
     result = np.full_like(a, False, dtype=bool)
-    for v in set(values):
-        result |= (a == v)
+
+    def _compare(slab):
+        for v in values:
+            result[slab] |= (a[slab] == v)
+
+    if a.ndim == 0:
+        _compare(Ellipsis)
+    else:
+        parallel.map_chunks(_compare, parallel.slab_slices(a.shape, _CHUNK_SIZE), n_jobs=n_jobs)
     return result
 
 
@@ -11,8 +11,9 @@ import urllib
 import numpy as np
 import requests
 
-from voxcell import RegionMap, VoxelData, math_utils
+from voxcell import LazyVoxelData, RegionMap, VoxelData, lookup_layers, math_utils
 from voxcell.exceptions import VoxcellError
+from voxcell.label_index import LabelIndex
 
 
 def _download_file(url, filepath, overwrite, allow_empty=False):
@@ -91,6 +92,27 @@ class Atlas:
             memcache=memcache
         )
 
+    def lookup(self, data_types, positions, outer_value=None, memcache=False):
+        """Find the values corresponding to the given positions in several atlas data layers.
+
+        Positions are converted to voxel indices once for all the layers,
+        which should share the same voxel grid (see `voxcell.lookup_layers`).
+
+        Args:
+            data_types(list of str): names of the data layers
+            positions: list of positions (x, y, z).
+            outer_value: value to be returned for positions outside the atlas space
+                (or dict with a value per data type).
+            memcache(bool): keep the loaded data layers in memory
+
+        Returns:
+            dict with the values corresponding to each position, by data type.
+        """
+        layers = {
+            data_type: self.load_data(data_type, memcache=memcache) for data_type in data_types
+        }
+        return lookup_layers(layers, positions, outer_value=outer_value)
+
     def load_region_map(self, memcache=False):
         """Load brain region hierarchy as RegionMap."""
         def _callback():
@@ -102,20 +124,76 @@ class Atlas:
             memcache=memcache
         )
 
+    def _label_index_path(self, data_type):
+        return os.path.splitext(self.fetch_data(data_type))[0] + '.index.npz'
+
+    def _data_fingerprint(self, data_type):
+        """Size and modification time of the `data_type` file, identifying its version."""
+        stat = os.stat(self.fetch_data(data_type))
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+    def _build_label_index(self, data_type):
+        result = LabelIndex.from_voxel_data(self.load_data(data_type))
+        result.fingerprint = self._data_fingerprint(data_type)
+        return result
+
+    def save_label_index(self, data_type='brain_regions'):
+        """Build LabelIndex for `data_type` labels, and save it alongside the data.
+
+        The index records the size and modification time of the data file.
+
+        Returns:
+            LabelIndex
+        """
+        result = self._build_label_index(data_type)
+        result.save(self._label_index_path(data_type))
+        return result
+
+    def load_label_index(self, data_type='brain_regions', memcache=False):
+        """Load LabelIndex for `data_type` labels.
+
+        The index saved with `save_label_index` is used if available and built from the current
+        data file (same size and modification time); otherwise it is built.
+        """
+        def _callback():
+            path = self._label_index_path(data_type)
+            if os.path.exists(path):
+                result = LabelIndex.load(path)
+                if result.fingerprint == self._data_fingerprint(data_type):
+                    return result
+            return self._build_label_index(data_type)
+
+        return self._check_cache(
+            ('label_index', data_type),
+            callback=_callback,
+            memcache=memcache
+        )
+
     def get_region_mask(self, value, attr='acronym', with_descendants=True,
-                        ignore_case=False, memcache=False):
-        """Get VoxelData with 0/1 mask indicating regions matching `value`."""
+                        ignore_case=False, memcache=False, *, use_label_index=False):
+        """Get VoxelData with 0/1 mask indicating regions matching `value`.
+
+        If `use_label_index` is True, the mask is built from the `brain_regions` LabelIndex
+        (see `load_label_index`) instead of scanning the whole volume.
+        """
 
         def _callback():
             rmap = self.load_region_map()
-            brain_regions = self.load_data('brain_regions')
             region_ids = rmap.find(
                 value, attr=attr, with_descendants=with_descendants,
                 ignore_case=ignore_case
             )
             if not region_ids:
                 raise VoxcellError(f"Region not found: '{value}'")
-            result = math_utils.isin(brain_regions.raw, region_ids)
+            if use_label_index:
+                brain_regions = self.load_data('brain_regions', cls=LazyVoxelData)
+                label_index = self.load_label_index('brain_regions', memcache=memcache)
+                if label_index.shape != brain_regions.shape:
+                    raise VoxcellError("Label index does not match 'brain_regions' shape")
+                result = label_index.mask(region_ids)
+            else:
+                brain_regions = self.load_data('brain_regions')
+                result = math_utils.isin(brain_regions.raw, region_ids)
             return brain_regions.with_data(result)
 
         return self._check_cache(
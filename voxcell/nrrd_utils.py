@@ -0,0 +1,462 @@
+"""Low-level helpers for NRRD files.
+
+See Also:
+    http://teem.sourceforge.net/nrrd/format.html
+"""
+
+import bz2
+import os
+import struct
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import nrrd
+import numpy as np
+
+from voxcell.exceptions import VoxcellError
+
+# http://teem.sourceforge.net/nrrd/format.html#type
+# (the first name is the one used for writing)
+_NRRD_TYPES = {
+    'i1': ('int8', 'signed char', 'int8_t'),
+    'u1': ('uint8', 'uchar', 'unsigned char', 'uint8_t'),
+    'i2': ('int16', 'short', 'short int', 'signed short', 'signed short int', 'int16_t'),
+    'u2': ('uint16', 'ushort', 'unsigned short', 'unsigned short int', 'uint16_t'),
+    'i4': ('int32', 'int', 'signed int', 'int32_t'),
+    'u4': ('uint32', 'uint', 'unsigned int', 'uint32_t'),
+    'i8': (
+        'int64', 'longlong', 'long long', 'long long int', 'signed long long',
+        'signed long long int', 'int64_t',
+    ),
+    'u8': ('uint64', 'ulonglong', 'unsigned long long', 'unsigned long long int', 'uint64_t'),
+    'f4': ('float',),
+    'f8': ('double',),
+}
+_NRRD_TYPE_MAP = {name: code for code, names in _NRRD_TYPES.items() for name in names}
+
+# size of compressed input fed to the decompressor at once
+_READ_CHUNK_SIZE = 2 ** 20
+
+# size of data chunks written at once
+CHUNK_SIZE = 2 ** 22
+
+STREAMED_ENCODINGS = ('raw', 'gzip', 'gz', 'bzip2', 'bz2')
+
+# http://teem.sourceforge.net/nrrd/format.html#basic
+_HEADER_FORMATTERS = {
+    'type': str,
+    'dimension': nrrd.format_number,
+    'space dimension': nrrd.format_number,
+    'sizes': nrrd.format_number_list,
+    'space directions': lambda value: ' '.join(map(nrrd.format_optional_vector, value)),
+    'kinds': ' '.join,
+    'endian': str,
+    'encoding': str,
+    'space origin': nrrd.format_vector,
+    'data file': str,
+}
+
+# http://teem.sourceforge.net/nrrd/format.html#detached
+_DETACHED_EXTENSIONS = {
+    'raw': '.raw', 'gzip': '.raw.gz', 'gz': '.raw.gz', 'bzip2': '.raw.bz2', 'bz2': '.raw.bz2',
+}
+
+
+def read_header(nrrd_path):
+    """Read the header of a NRRD file.
+
+    Args:
+        nrrd_path (str|pathlib.Path): path to the NRRD file
+
+    Returns:
+        tuple (header, header_size), where `header` is the dict with parsed header fields,
+        and `header_size` is the size of the header in bytes.
+    """
+    with open(nrrd_path, 'rb') as fh:
+        header = nrrd.read_header(fh)
+        header_size = fh.tell()
+    return header, header_size
+
+
+def data_dtype(header):
+    """Data type of the data described by NRRD `header`."""
+    try:
+        dtype = np.dtype(_NRRD_TYPE_MAP[header['type']])
+    except KeyError as e:
+        raise VoxcellError(f"Unsupported NRRD type: '{header['type']}'") from e
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder('>' if header.get('endian') == 'big' else '<')
+    return dtype
+
+
+def data_shape(header):
+    """Shape of the data described by NRRD `header` (in NRRD axis order)."""
+    return tuple(int(s) for s in header['sizes'])
+
+
+def open_data(nrrd_path, header, header_size):
+    """Open the file storing NRRD data and position it at the start of data.
+
+    Handles detached data files and 'line skip'; 'byte skip' is left to the caller,
+    since for compressed encodings it applies to the decompressed stream.
+
+    Args:
+        nrrd_path (str|pathlib.Path): path to the NRRD file (or detached header)
+        header (dict): parsed NRRD header
+        header_size (int): size of the header in bytes
+
+    Returns:
+        Binary file object; the caller is responsible for closing it.
+    """
+    data_file = header.get('data file', header.get('datafile'))
+    if data_file is None:
+        data_path, start = nrrd_path, header_size
+    else:
+        if data_file.startswith('LIST') or ' ' in data_file:
+            raise VoxcellError(f"Multiple NRRD data files are not supported: '{data_file}'")
+        data_path = os.path.join(os.path.dirname(str(nrrd_path)), data_file)
+        start = 0
+
+    fh = open(data_path, 'rb')  # pylint: disable=consider-using-with
+    fh.seek(start)
+    for _ in range(header.get('line skip', header.get('lineskip', 0))):
+        fh.readline()
+    return fh
+
+
+def memmap_data(nrrd_path, header=None, header_size=None):
+    """Memory-map data of a raw-encoded NRRD file.
+
+    Args:
+        nrrd_path (str|pathlib.Path): path to the NRRD file (or detached header)
+        header (dict): parsed NRRD header; read from `nrrd_path` if not provided
+        header_size (int): size of the header in bytes; required if `header` is provided
+
+    Returns:
+        Read-only numpy.memmap in NRRD axis order (same layout as returned by `nrrd.read`).
+    """
+    if header is None:
+        header, header_size = read_header(nrrd_path)
+    if header['encoding'] != 'raw':
+        raise VoxcellError(
+            f"Memory mapping is only supported for 'raw' encoding (got: '{header['encoding']}')"
+        )
+    dtype = data_dtype(header)
+    shape = data_shape(header)
+    nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    with open_data(nrrd_path, header, header_size) as fh:
+        byte_skip = header.get('byte skip', header.get('byteskip', 0))
+        if byte_skip == -1:
+            offset = os.fstat(fh.fileno()).st_size - nbytes
+        else:
+            offset = fh.tell() + byte_skip
+        return np.memmap(fh, dtype=dtype, mode='r', offset=offset, shape=shape, order='F')
+
+
+class DataReader:
+    """Sequential reader of decoded NRRD data.
+
+    Decompression is done on the fly in bounded chunks; concatenated gzip / bzip2 members
+    are supported.
+    """
+    def __init__(self, fh, encoding, chunk_size=_READ_CHUNK_SIZE):
+        """Init DataReader.
+
+        Args:
+            fh: binary file object positioned at the start of the (encoded) data
+            encoding(str): NRRD encoding
+            chunk_size(int): number of bytes read from `fh` at once
+        """
+        if encoding == 'raw':
+            self._decompressor_factory = None
+        elif encoding in ('gzip', 'gz'):
+            self._decompressor_factory = lambda: zlib.decompressobj(zlib.MAX_WBITS | 16)
+        elif encoding in ('bzip2', 'bz2'):
+            self._decompressor_factory = bz2.BZ2Decompressor
+        else:
+            raise VoxcellError(f"Unsupported NRRD encoding: '{encoding}'")
+        self._fh = fh
+        self._chunk_size = chunk_size
+        self._decompressor = None
+        self._input = b''
+
+    def _decode(self, max_length):
+        """Return at most `max_length` decoded bytes; empty bytes at the end of data."""
+        if self._decompressor_factory is None:
+            return self._fh.read(max_length)
+        while True:
+            if self._decompressor is None or self._decompressor.eof:
+                if self._decompressor is not None:
+                    self._input = self._decompressor.unused_data
+                self._decompressor = self._decompressor_factory()
+            data = self._decompressor.decompress(self._input, max_length)
+            # zlib keeps the input not consumed due to `max_length` in `unconsumed_tail`,
+            # whereas bz2 buffers it internally
+            self._input = getattr(self._decompressor, 'unconsumed_tail', b'')
+            if data:
+                return data
+            if not self._input and not self._decompressor.eof:
+                self._input = self._fh.read(self._chunk_size)
+                if not self._input:
+                    return b''
+
+    def readinto(self, buffer):
+        """Fill `buffer` (any writable contiguous buffer) with decoded data."""
+        mv = memoryview(buffer).cast('B')
+        pos = 0
+        while pos < len(mv):
+            if self._decompressor_factory is None:
+                n = self._fh.readinto(mv[pos:])
+            else:
+                # bound the size of temporary decoded chunks
+                data = self._decode(min(len(mv) - pos, 16 * self._chunk_size))
+                n = len(data)
+                mv[pos:pos + n] = data
+            if not n:
+                raise VoxcellError("Unexpected end of NRRD data")
+            pos += n
+
+    def skip(self, nbytes):
+        """Skip `nbytes` of decoded data."""
+        if self._decompressor_factory is None:
+            self._fh.seek(nbytes, os.SEEK_CUR)
+            return
+        while nbytes > 0:
+            data = self._decode(min(nbytes, self._chunk_size))
+            if not data:
+                raise VoxcellError("Unexpected end of NRRD data")
+            nbytes -= len(data)
+
+
+def _skip_to_data(fh, reader, header, nbytes):
+    """Apply NRRD 'byte skip' before reading `nbytes` of data."""
+    byte_skip = header.get('byte skip', header.get('byteskip', 0))
+    if byte_skip == -1 and header['encoding'] == 'raw':
+        fh.seek(-nbytes, os.SEEK_END)
+    elif byte_skip >= 0:
+        reader.skip(byte_skip)
+    else:
+        raise VoxcellError(f"Unsupported 'byte skip' for NRRD data: {byte_skip}")
+
+
+def read_data(nrrd_path, header=None, header_size=None, slices=None):
+    """Read data of a NRRD file, optionally restricted to a sub-volume.
+
+    Raw and compressed (gzip, bzip2) data is decoded on the fly directly into the resulting
+    array, without holding the whole encoded or decoded byte stream in memory.
+
+    For sub-volume reads, raw-encoded data is memory-mapped and only the requested region
+    is copied; compressed data is decoded one hyperplane (along the last NRRD axis) at a time,
+    and only the requested hyperplanes are kept.
+
+    Args:
+        nrrd_path (str|pathlib.Path): path to the NRRD file (or detached header)
+        header (dict): parsed NRRD header; read from `nrrd_path` if not provided
+        header_size (int): size of the header in bytes; required if `header` is provided
+        slices (tuple of slices): index-space region to read (in NRRD axis order, step 1);
+            if not provided, the whole data is read.
+
+    Returns:
+        numpy.ndarray in NRRD axis order (same layout as returned by `nrrd.read`).
+    """
+    # pylint: disable=too-many-locals
+    if header is None:
+        header, header_size = read_header(nrrd_path)
+
+    if header['encoding'] not in STREAMED_ENCODINGS:
+        with open(nrrd_path, 'rb') as fh:
+            fh.seek(header_size)
+            data = nrrd.read_data(header, fh, str(nrrd_path))
+        return data if slices is None else data[slices].copy()
+
+    dtype = data_dtype(header)
+    shape = data_shape(header)
+
+    if slices is None:
+        # data is stored in Fortran order; C-ordered arrays with reversed axes match its layout
+        result = np.empty(shape[::-1], dtype=dtype)
+        with open_data(nrrd_path, header, header_size) as fh:
+            reader = DataReader(fh, header['encoding'])
+            _skip_to_data(fh, reader, header, result.nbytes)
+            reader.readinto(result)
+        return result.T
+
+    if len(slices) != len(shape) or any(s.step not in (None, 1) for s in slices):
+        raise VoxcellError(f"Invalid slices: {slices}")
+    slices = tuple(slice(*s.indices(n)) for s, n in zip(slices, shape))
+
+    if header['encoding'] == 'raw':
+        return np.array(memmap_data(nrrd_path, header, header_size)[slices])
+
+    first, last = slices[-1], slices[:-1]
+    plane = np.empty(shape[-2::-1], dtype=dtype)
+    result = np.empty(
+        (first.stop - first.start,) + tuple(s.stop - s.start for s in last[::-1]), dtype=dtype
+    )
+    with open_data(nrrd_path, header, header_size) as fh:
+        reader = DataReader(fh, header['encoding'])
+        _skip_to_data(fh, reader, header, plane.nbytes * shape[-1])
+        reader.skip(first.start * plane.nbytes)
+        for hyperplane in result:
+            reader.readinto(plane)
+            hyperplane[...] = plane[last[::-1]]
+    return result.T
+
+
+def data_header(dtype, shape):
+    """NRRD header fields describing data type and shape (in NRRD axis order).
+
+    Boolean data is described as 'uint8'.
+    """
+    dtype = np.dtype(dtype)
+    if dtype == bool:
+        dtype = np.dtype(np.uint8)
+    try:
+        type_ = _NRRD_TYPES[dtype.str[1:]][0]
+    except KeyError as e:
+        raise VoxcellError(f"Unsupported data type for NRRD: '{dtype}'") from e
+    result = {'type': type_, 'dimension': len(shape), 'sizes': list(shape)}
+    if dtype.itemsize > 1:
+        byteorder = dtype.byteorder
+        if byteorder in '=|':
+            byteorder = '<' if sys.byteorder == 'little' else '>'
+        result['endian'] = 'little' if byteorder == '<' else 'big'
+    return result
+
+
+def _iter_blocks(chunks, block_size):
+    """Regroup byte `chunks` in blocks of `block_size` bytes (the last one could be shorter)."""
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= block_size:
+            yield bytes(pending[:block_size])
+            del pending[:block_size]
+    if pending:
+        yield bytes(pending)
+
+
+def _deflate_block(block, compression_level, zdict, last):
+    """Compress `block` as a part of a raw deflate stream."""
+    kwargs = {} if zdict is None else {'zdict': zdict}
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS, **kwargs)
+    mode = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(block) + compressor.flush(mode)
+
+
+def _write_gzip_parallel(fh, chunks, compression_level, n_jobs):
+    """Write gzip-compressed `chunks` to `fh`, compressing data blocks on a thread pool.
+
+    Like pigz, each block is deflated independently (primed with the last 32KiB of the previous
+    block) and terminated with a sync flush, so that the output is a single gzip member
+    which could be read by any gzip decoder.
+    """
+    # http://www.zlib.org/rfc-gzip.html#header-trailer
+    fh.write(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff')
+    crc, size = 0, 0
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        pending = []
+        zdict = None
+        blocks = _iter_blocks(chunks, CHUNK_SIZE)
+        block = next(blocks, b'')
+        while True:
+            next_block = next(blocks, None)
+            pending.append(executor.submit(
+                _deflate_block, block, compression_level, zdict, next_block is None
+            ))
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            # bound the number of blocks held in memory
+            while len(pending) > 2 * n_jobs or (next_block is None and pending):
+                fh.write(pending.pop(0).result())
+            if next_block is None:
+                break
+            zdict = block[-32768:]
+            block = next_block
+    fh.write(struct.pack('<II', crc & 0xffffffff, size & 0xffffffff))
+
+
+def write_data(fh, chunks, encoding, compression_level=9, n_jobs=1):
+    """Write NRRD data given as a sequence of byte chunks.
+
+    Args:
+        fh: binary file object
+        chunks: iterable of bytes-like objects with data in NRRD order
+        encoding(str): one of ('raw', 'gzip', 'bzip2')
+        compression_level(int): compression level (1-9)
+        n_jobs(int): number of threads used for gzip compression
+    """
+    if encoding in ('gzip', 'gz') and n_jobs > 1:
+        _write_gzip_parallel(fh, chunks, compression_level, n_jobs)
+        return
+
+    if encoding == 'raw':
+        compressor = None
+    elif encoding in ('gzip', 'gz'):
+        compressor = zlib.compressobj(compression_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    elif encoding in ('bzip2', 'bz2'):
+        compressor = bz2.BZ2Compressor(compression_level)
+    else:
+        raise VoxcellError(f"Unsupported NRRD encoding: '{encoding}'")
+
+    for chunk in chunks:
+        fh.write(chunk if compressor is None else compressor.compress(chunk))
+    if compressor is not None:
+        fh.write(compressor.flush())
+
+
+def iter_chunks(data, chunk_size=CHUNK_SIZE):
+    """Iterate over `data` bytes in NRRD order, slab by slab along the last NRRD axis.
+
+    `data` is expected in NRRD axis order (as returned by `nrrd.read`), but could have any
+    memory layout: only one slab of about `chunk_size` bytes is copied at a time.
+    """
+    if data.dtype == bool:
+        data = data.view(np.uint8)
+    if data.ndim == 0:
+        yield data.tobytes()
+        return
+    plane_size = max(1, data.nbytes // max(1, data.shape[-1]))
+    step = max(1, chunk_size // plane_size)
+    for start in range(0, data.shape[-1], step):
+        yield data[..., start:start + step].tobytes(order='F')
+
+
+def write(nrrd_path, header, chunks, compression_level=9, n_jobs=1):
+    """Write a NRRD file streaming its data.
+
+    If `nrrd_path` ends with '.nhdr', data is written to a detached data file next to it.
+
+    Args:
+        nrrd_path(str|pathlib.Path): path to the NRRD file
+        header(dict): NRRD header fields, including 'type', 'dimension', 'sizes' and 'endian'
+            (see `data_header`); the default encoding is 'gzip'.
+            Only the fields from `voxcell.nrrd_utils` formatters are supported.
+        chunks: iterable of bytes-like objects with data in NRRD order (see `iter_chunks`)
+        compression_level(int): compression level (1-9)
+        n_jobs(int): number of threads used for gzip compression; -1 to use all CPUs
+    """
+    header = dict(header)
+    encoding = header.setdefault('encoding', 'gzip')
+    if n_jobs < 1:
+        n_jobs = os.cpu_count()
+
+    nrrd_path = str(nrrd_path)
+    data_path = None
+    if nrrd_path.endswith('.nhdr'):
+        data_path = os.path.splitext(nrrd_path)[0] + _DETACHED_EXTENSIONS[encoding]
+        header['data file'] = os.path.basename(data_path)
+
+    with open(nrrd_path, 'wb') as fh:
+        fh.write(b'NRRD0004\n')
+        for field, formatter in _HEADER_FORMATTERS.items():
+            if field in header:
+                fh.write(f"{field}: {formatter(header[field])}\n".encode('ascii'))
+        fh.write(b'\n')
+        if data_path is None:
+            write_data(fh, chunks, encoding, compression_level, n_jobs)
+
+    if data_path is not None:
+        with open(data_path, 'wb') as fh:
+            write_data(fh, chunks, encoding, compression_level, n_jobs)
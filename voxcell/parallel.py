@@ -0,0 +1,64 @@
+"""Opt-in thread-parallel execution of full-volume operations.
+
+Operations supporting it split the data into slabs along the first axis, which are processed
+on a pool of threads (NumPy releases the GIL for most array operations).
+Each slab is processed independently and results are combined in slab order,
+so that the results do not depend on the number of threads.
+
+The number of threads is 1 by default; it can be set globally with `set_n_jobs`,
+or per call with the `n_jobs` argument of these operations.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SLAB_SIZE = 2 ** 22
+
+_N_JOBS = 1
+
+
+def set_n_jobs(n_jobs):
+    """Set the default number of threads for full-volume operations.
+
+    Args:
+        n_jobs(int): number of threads; if < 1, use all available CPUs
+    """
+    global _N_JOBS  # pylint: disable=global-statement
+    _N_JOBS = int(n_jobs)
+
+
+def get_n_jobs(n_jobs=None):
+    """Effective number of threads for the given `n_jobs` (None for the global default)."""
+    if n_jobs is None:
+        n_jobs = _N_JOBS
+    if n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    return n_jobs
+
+
+def slab_slices(shape, max_size=None, align=1):
+    """Slices along the first axis of an array of given shape, with at most ~`max_size` elements.
+
+    Slabs are at least `align` rows thick, and their thickness is a multiple of `align`
+    (e.g. the chunk size of the underlying storage).
+    """
+    max_size = max_size or SLAB_SIZE
+    step = max_size // max(1, int(np.prod(shape[1:], dtype=np.int64)))
+    step = max(1, step // align) * align
+    return [slice(start, min(start + step, shape[0])) for start in range(0, shape[0], step)]
+
+
+def map_chunks(func, chunks, n_jobs=None):
+    """Apply `func` to each of `chunks`, on a pool of `n_jobs` threads.
+
+    Returns:
+        list with the results of `func`, in the order of `chunks`
+    """
+    chunks = list(chunks)
+    n_jobs = min(get_n_jobs(n_jobs), len(chunks))
+    if n_jobs < 2:
+        return [func(chunk) for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(func, chunks))
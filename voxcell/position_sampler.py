@@ -0,0 +1,125 @@
+"""Sampling of positions from density volumes."""
+
+import numpy as np
+
+from voxcell import parallel
+from voxcell.exceptions import VoxcellError
+
+# number of positions sampled at once
+_CHUNK_SIZE = 2 ** 20
+
+
+def alias_table(weights):
+    """Alias table for sampling indices proportionally to non-negative `weights`.
+
+    Index `k` drawn uniformly is kept with probability `prob[k]`, and replaced by `alias[k]`
+    otherwise. The table is built with Vose's algorithm, pairing all the current "small"
+    entries with "large" ones at once in each round.
+
+    Returns:
+        tuple (prob, alias) of arrays with the same length as `weights`
+    """
+    n = len(weights)
+    if n == 0:
+        return np.empty(0), np.empty(0, dtype=np.uint32)
+    prob = np.multiply(weights, n / np.sum(weights), dtype=np.float64)
+    alias = np.arange(n, dtype=np.uint32 if n < 2 ** 32 else np.intp)
+    small = np.flatnonzero(prob < 1)
+    large = np.flatnonzero(prob >= 1)
+    while len(small) > 0 and len(large) > 0:
+        # each small entry gets the large entry whose cumulative surplus covers the start
+        # of its deficit; a large entry whose surplus is exhausted becomes small
+        deficits = 1 - prob[small]
+        which = np.searchsorted(
+            np.cumsum(prob[large] - 1), np.cumsum(deficits) - deficits, side='right'
+        )
+        assigned = which < len(large)
+        alias[small[assigned]] = large[which[assigned]]
+        prob[large] -= np.bincount(
+            which[assigned], weights=deficits[assigned], minlength=len(large)
+        )
+        prob[small[~assigned]] = 1  # rounding leftovers
+        exhausted = prob[large] < 1
+        small = large[exhausted]
+        large = large[~exhausted]
+    # remaining entries (and rounding leftovers) are kept
+    prob[small] = 1
+    prob[large] = 1
+    return prob, alias
+
+
+class PositionSampler:
+    """Sample positions uniformly within voxels, picking voxels proportionally to their values.
+
+    Only voxels with positive values are kept, in an alias table (see `alias_table`)
+    picking each voxel in constant time; the table can be reused for any number of draws.
+    """
+
+    def __init__(self, voxel_data):
+        """Init PositionSampler.
+
+        Args:
+            voxel_data: VoxelData with scalar non-negative values (e.g. cell densities);
+                it is scanned slab by slab.
+        """
+        if voxel_data.payload_shape:
+            raise VoxcellError("Position sampling requires scalar voxel data")
+        self._voxel_data = voxel_data
+        row_size = int(np.prod(voxel_data.shape[1:], dtype=np.int64))
+        flat_indices, weights = [], []
+        for slab in parallel.slab_slices(voxel_data.shape):
+            block = np.ravel(voxel_data._read_region((slab,)))  # pylint: disable=protected-access
+            if not np.all(block >= 0):
+                raise VoxcellError("Position sampling requires non-negative values")
+            nonzero = np.flatnonzero(block)
+            flat_indices.append(nonzero + slab.start * row_size)
+            weights.append(block[nonzero])
+        self._flat_indices = np.concatenate([np.empty(0, dtype=np.intp)] + flat_indices)
+        if np.prod(voxel_data.shape, dtype=np.int64) < 2 ** 32:
+            self._flat_indices = self._flat_indices.astype(np.uint32)
+        weights = np.concatenate([np.empty(0)] + weights)
+        self._total_weight = float(np.sum(weights, dtype=np.float64))
+        self._prob, self._alias = alias_table(weights)
+
+    @property
+    def total(self):
+        """Sum of voxel values times voxel volume (e.g. expected number of cells for densities)."""
+        return self._total_weight * float(self._voxel_data.voxel_volume)
+
+    def iter_sample(self, n, rng=np.random, chunk_size=None):
+        """Iterate over chunks of sampled positions.
+
+        Args:
+            n(int): number of positions to sample
+            rng: random number generator (numpy.random module or Generator)
+            chunk_size(int): number of positions per chunk (default: 2 ** 20)
+
+        Yields:
+            chunk_size x ndim arrays of positions (the last one may be shorter)
+        """
+        if len(self._prob) == 0:
+            raise VoxcellError("No voxels with positive values")
+        chunk_size = chunk_size or _CHUNK_SIZE
+        ndim = self._voxel_data.ndim
+        for start in range(0, n, chunk_size):
+            m = min(chunk_size, n - start)
+            # integer part of the scaled draw picks an entry, fractional part accepts it
+            picks = rng.random(m)
+            picks *= len(self._prob)
+            which = picks.astype(np.intp)
+            np.minimum(which, len(self._prob) - 1, out=which)
+            picks -= which
+            which = np.where(picks < self._prob[which], which, self._alias[which])
+            indices = np.stack(
+                np.unravel_index(self._flat_indices[which], self._voxel_data.shape), axis=-1
+            )
+            yield self._voxel_data.indices_to_positions(indices + rng.random((m, ndim)))
+
+    def sample(self, n, rng=np.random, chunk_size=None):
+        """Sample `n` positions (n x ndim array); see `iter_sample`."""
+        result = np.empty((n, self._voxel_data.ndim))
+        start = 0
+        for chunk in self.iter_sample(n, rng=rng, chunk_size=chunk_size):
+            result[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        return result
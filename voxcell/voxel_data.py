@@ -1,11 +1,18 @@
 """Access to volumetric data."""
-from functools import reduce
-
+# pylint: disable=too-many-lines
+import itertools
+import operator
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import h5py
 import nrrd
 import numpy as np
+import pandas as pd
 from numpy.testing import assert_array_equal
 
-from voxcell import math_utils
+from voxcell import math_utils, nrrd_utils, parallel
 from voxcell.exceptions import VoxcellError
 from voxcell.quaternion import quaternions_to_matrices
 
@@ -20,18 +27,163 @@ def _pivot_axes(a, k):
     return np.moveaxis(a, np.arange(k), np.arange(n - k, n))
 
 
+def _parse_nrrd_header(header):
+    """Get voxel dimensions, offset and directions (None if axis-aligned) from NRRD header."""
+    # According to http://teem.sourceforge.net/nrrd/format.html#spacedirections,
+    # 'space directions' could use 'none' for "payload" axes.
+    # As we need space directions only for "space" axes, we rely on either
+    # 'space dimension' or 'space' header to slice them out.
+    # NB: only a subset of possible 'space' values is supported at the moment.
+    if 'space dimension' in header:
+        ndim = header['space dimension']
+    elif 'space' in header:
+        ndim = {
+            'right-anterior-superior': 3, 'RAS': 3,
+            'left-anterior-superior': 3, 'LAS': 3,
+            'left-posterior-superior': 3, 'LPS': 3,
+            'posterior-inferior-right': 3, 'PIR': 3,
+        }[header['space']]
+    else:
+        ndim = 0  # use all 'space directions'
+
+    directions = None
+    if 'space directions' in header:
+        directions = np.array(header['space directions'][-ndim:], dtype=np.float32)
+        if math_utils.is_diagonal(directions):
+            spacings = directions.diagonal()
+            directions = None
+        else:
+            spacings = np.linalg.norm(directions, axis=1).astype(np.float32)
+            directions = directions / spacings[:, np.newaxis]
+    elif 'spacings' in header:
+        spacings = np.array(header['spacings'][-ndim:], dtype=np.float32)
+    else:
+        raise VoxcellError("spacings not defined in nrrd")
+
+    offset = None
+    if 'space origin' in header:
+        offset = np.array(header['space origin'], dtype=np.float32)
+
+    return spacings, offset, directions
+
+
+def _box_corners(box):
+    """Corners of the box given by its lower and upper corners (2 x N array)."""
+    box = np.asarray(box)
+    ndim = box.shape[1]
+    return box[np.array(list(itertools.product((0, 1), repeat=ndim))), np.arange(ndim)]
+
+
+def _positions_to_index_coords(positions, voxel_dimensions, offset, directions=None):
+    """Fractional voxel indices of `positions` on the given grid.
+
+    Args:
+        positions: N x ndim array of positions
+        voxel_dimensions: size of voxels along each axis
+        offset: position of the grid origin
+        directions: ndim x ndim matrix with the direction of each voxel axis (one per row),
+            None for axis-aligned grids
+    """
+    result = np.subtract(positions, offset)
+    if directions is not None:
+        result = result @ np.linalg.inv(directions.astype(np.float64))
+    return result / voxel_dimensions
+
+
+def _bbox_to_aabb(bbox, voxel_dimensions, offset, shape, directions=None):
+    """Index-space range [start, stop) of voxels intersecting `bbox`.
+
+    For non axis-aligned grids, the range covers the voxels intersecting `bbox`,
+    and possibly other voxels.
+    """
+    bbox = np.array(bbox)
+    if bbox.shape != (2, len(shape)):
+        raise VoxcellError(f"Invalid bbox shape: {bbox.shape}")
+    if directions is not None:
+        bbox = _box_corners(bbox)
+    ijk = _positions_to_index_coords(bbox, voxel_dimensions, offset, directions)
+    snapped = np.round(ijk)
+    ijk = np.where(np.abs(ijk - snapped) < 1e-5, snapped, ijk)  # suppress rounding errors
+    start = np.clip(np.floor(ijk.min(axis=0)).astype(int), 0, shape)
+    stop = np.clip(np.ceil(ijk.max(axis=0)).astype(int), 0, shape)
+    if np.any(start >= stop):
+        raise VoxcellError("Empty slice")
+    return start, stop
+
+
+def _parse_nrrd_region(header, bbox):
+    """Get voxel dimensions, offset, directions and NRRD index-space slices for `bbox`.
+
+    Slices are None if `bbox` is None.
+    """
+    spacings, offset, directions = _parse_nrrd_header(header)
+    if bbox is None:
+        return spacings, offset, directions, None
+
+    shape = nrrd_utils.data_shape(header)
+    k = len(shape) - len(spacings)
+    if offset is None:
+        offset = np.zeros(len(spacings), dtype=np.float32)
+    aabb = _bbox_to_aabb(bbox, spacings, offset, shape[k:], directions)
+    slices = (slice(None),) * k + tuple(slice(a, b) for a, b in zip(*aabb))
+    shift = aabb[0] * spacings
+    if directions is not None:
+        shift = shift @ directions
+    return spacings, offset + shift, directions, slices
+
+
+# number of positions converted to voxel indices at once in `VoxelData.lookup`
+_LOOKUP_CHUNK_SIZE = 2 ** 16
+
+
+def _normalize_region(region, shape):
+    """Region as a tuple of unit-step slices with explicit bounds, one per axis of `shape`."""
+    region = tuple(region) + (slice(None),) * (len(shape) - len(region))
+    bounds = (s.indices(n)[:2] for s, n in zip(region, shape))
+    return tuple(slice(start, max(start, stop)) for start, stop in bounds)
+
+
+def _value_counts(blocks):
+    """Number of occurrences of each value in an iterable of arrays, as pandas Series.
+
+    Integer blocks with a compact value range within int64 are counted with `numpy.bincount`.
+    """
+    result = None
+    for block in blocks:
+        block = np.ravel(block, order='K')
+        if block.size == 0:
+            continue
+        if block.dtype == bool:
+            block = block.view(np.uint8)
+        lo, hi = (int(block.min()), int(block.max())) if block.dtype.kind in 'iu' else (0, -1)
+        if -2 ** 63 <= lo and hi < 2 ** 63 and 0 <= hi - lo <= max(block.size, 2 ** 16):
+            counts = np.bincount(np.subtract(block, lo, dtype=np.int64))
+            values = np.flatnonzero(counts)
+            counts = pd.Series(counts[values], index=(values + lo).astype(block.dtype))
+        else:
+            values, counts = np.unique(block, return_counts=True)
+            counts = pd.Series(counts, index=values)
+        result = counts if result is None else result.add(counts, fill_value=0)
+    if result is None:
+        return pd.Series([], dtype=np.int64)
+    return result.astype(np.int64).sort_index()
+
+
 class VoxelData:
     """Wrap volumetric data and some basic metadata."""
 
     OUT_OF_BOUNDS = -1
 
-    def __init__(self, raw, voxel_dimensions, offset=None):
+    def __init__(self, raw, voxel_dimensions, offset=None, *, directions=None):
         """Note that he units for the metadata will depend on the atlas being used.
 
         Args:
             raw(numpy.ndarray): actual voxel values
             voxel_dimensions(tuple of numbers): size of each voxel in space.
             offset(tuple of numbers): offset from an external atlas origin
+            directions(np.array of NxN): directions of the voxel axes in space (one per row),
+                for volumes not aligned with the space axes; None if aligned.
+                Voxel index `ijk` is at position `(ijk * voxel_dimensions) @ directions + offset`.
         """
         voxel_dimensions = np.array(voxel_dimensions, dtype=np.float32)
         if len(voxel_dimensions.shape) > 1:
@@ -48,6 +200,16 @@ class VoxelData:
                     f"'offset' shape should be: {(self.ndim,)} (got: {offset.shape})")
             self.offset = offset
 
+        if directions is not None:
+            directions = np.array(directions, dtype=np.float32)
+            if directions.shape != (self.ndim, self.ndim):
+                raise VoxcellError(
+                    f"'directions' shape should be: {(self.ndim, self.ndim)} "
+                    f"(got: {directions.shape})")
+            if abs(np.linalg.det(directions)) < 1e-6:
+                raise VoxcellError("Degenerate 'directions'")
+        self.directions = directions
+
         if len(raw.shape) < self.ndim:
             raise VoxcellError(
                 f"'raw' should have at least {self.ndim} dimensions (got: {len(raw.shape)})")
@@ -56,7 +218,10 @@ class VoxelData:
     @property
     def voxel_volume(self):
         """Voxel volume."""
-        return abs(np.prod(self.voxel_dimensions))
+        result = abs(np.prod(self.voxel_dimensions))
+        if self.directions is not None:
+            result *= abs(np.linalg.det(self.directions))
+        return result
 
     @property
     def ndim(self):
@@ -73,66 +238,79 @@ class VoxelData:
         """Shape of the data stored per voxel."""
         return self.raw.shape[self.ndim:]
 
+    @property
+    def dtype(self):
+        """Data type of the voxel values."""
+        return self.raw.dtype
+
     @property
     def bbox(self):
-        """Bounding box."""
+        """Bounding box.
+
+        For volumes not aligned with the space axes, this is the axis-aligned bounding box
+        of the volume corners.
+        """
+        if self.directions is not None:
+            corners = _box_corners([np.zeros(self.ndim), self.shape])
+            corners = self.indices_to_positions(corners)
+            return np.array([corners.min(axis=0), corners.max(axis=0)])
         return np.array([self.offset,
                          self.offset + self.voxel_dimensions * self.shape])
 
+    def _affine_matrix(self):
+        """Matrix mapping voxel indices to (offset-relative) positions, one row per voxel axis."""
+        if self.directions is None:
+            return np.diag(self.voxel_dimensions)
+        return self.voxel_dimensions[:, np.newaxis] * self.directions
+
+    def _inverse_directions(self, dtype=np.float64):
+        """Inverse of `directions` (None if axis-aligned)."""
+        if self.directions is None:
+            return None
+        return np.linalg.inv(self.directions.astype(np.float64)).astype(dtype)
+
     @classmethod
-    def load_nrrd(cls, nrrd_path):
+    def load_nrrd(cls, nrrd_path, mmap=False, bbox=None):
         """Read volumetric data from a nrrd file.
 
         Args:
             nrrd_path (str|pathlib.Path): path to the nrrd file.
+            mmap (bool): memory-map the data instead of reading it into memory.
+                Only 'raw' encoding is supported (with attached or detached data file).
+                The resulting `raw` is a read-only numpy.memmap, thus processes loading
+                the same file share the OS page cache, and only the touched pages are read.
+            bbox: if provided, load only the voxels intersecting this bounding box
+                (in real-world coordinates); `offset` is adjusted accordingly.
+                Raw-encoded data is read through memory mapping, compressed data is decoded
+                on the fly, keeping only the requested region in memory.
         """
-        data, header = nrrd.read(str(nrrd_path))
-
-        # According to http://teem.sourceforge.net/nrrd/format.html#spacedirections,
-        # 'space directions' could use 'none' for "payload" axes.
-        # As we need space directions only for "space" axes, we rely on either
-        # 'space dimension' or 'space' header to slice them out.
-        # NB: only a subset of possible 'space' values is supported at the moment.
-        if 'space dimension' in header:
-            ndim = header['space dimension']
-        elif 'space' in header:
-            ndim = {
-                'right-anterior-superior': 3, 'RAS': 3,
-                'left-anterior-superior': 3, 'LAS': 3,
-                'left-posterior-superior': 3, 'LPS': 3,
-                'posterior-inferior-right': 3, 'PIR': 3,
-            }[header['space']]
-        else:
-            ndim = 0  # use all 'space directions'
+        header, header_size = nrrd_utils.read_header(nrrd_path)
+        spacings, offset, directions, slices = _parse_nrrd_region(header, bbox)
 
-        if 'space directions' in header:
-            directions = np.array(header['space directions'][-ndim:], dtype=np.float32)
-            if not math_utils.is_diagonal(directions):
-                raise NotImplementedError("Only diagonal space directions supported at the moment")
-            spacings = directions.diagonal()
-        elif 'spacings' in header:
-            spacings = np.array(header['spacings'][-ndim:], dtype=np.float32)
+        if mmap:
+            data = nrrd_utils.memmap_data(nrrd_path, header, header_size)
+            if slices is not None:
+                data = data[slices]
         else:
-            raise VoxcellError("spacings not defined in nrrd")
-
-        offset = None
-        if 'space origin' in header:
-            offset = np.array(header['space origin'], dtype=np.float32)
+            data = nrrd_utils.read_data(nrrd_path, header, header_size, slices)
 
         # In NRRD 'payload' axes go first, move them to the end
         raw = _pivot_axes(data, len(data.shape) - len(spacings))
 
-        return cls(raw, spacings, offset)
+        return cls(raw, spacings, offset, directions=directions)
 
-    def save_nrrd(self, nrrd_path, encoding=None):
+    def save_nrrd(self, nrrd_path, encoding=None, compression_level=9, n_jobs=1):
         """Save a VoxelData to an nrrd file.
 
         Args:
             nrrd_path(string|pathlib.Path): full path to nrrd file
             encoding(string): encoding option to save as
+            compression_level(int): compression level (1-9) for compressed encodings
+            n_jobs(int): number of threads used for 'gzip' compression; -1 to use all CPUs.
+                Data blocks are compressed in parallel into a single standard gzip stream.
         """
         # from http://teem.sourceforge.net/nrrd/format.html#space
-        space_directions = np.diag(self.voxel_dimensions)
+        space_directions = self._affine_matrix()
         dim_defect = len(self.raw.shape) - self.ndim
         if dim_defect > 0:
             # The nrrd specifications require that
@@ -155,43 +333,297 @@ class VoxelData:
             # the volumetric data.
             header['kinds'] = ['vector', 'domain', 'domain', 'domain']
 
-        if encoding is not None:
-            header['encoding'] = encoding
+        header['encoding'] = 'gzip' if encoding is None else encoding
+
+        if header['encoding'] in nrrd_utils.STREAMED_ENCODINGS:
+            # In NRRD 'payload' axes should go first
+            header.update(nrrd_utils.data_header(self.dtype, self.payload_shape + self.shape))
+            nrrd_utils.write(
+                nrrd_path,
+                header,
+                self._iter_nrrd_chunks(),
+                compression_level=compression_level,
+                n_jobs=n_jobs,
+            )
+        else:
+            # In NRRD 'payload' axes should go first, move them to the beginning
+            nrrd.write(
+                str(nrrd_path),
+                _pivot_axes(self.raw, self.ndim),
+                header=header,
+                compression_level=compression_level,
+            )
+
+    def _iter_nrrd_chunks(self):
+        """Iterate over voxel values bytes in NRRD order, without copying the whole `raw`."""
+        return nrrd_utils.iter_chunks(_pivot_axes(self.raw, self.ndim))
+
+    @classmethod
+    def load_h5(cls, h5_path, dataset='raw', bbox=None, mmap=False):
+        """Read volumetric data from an HDF5 file written by `save_h5`.
 
-        # In NRRD 'payload' axes should go first, move them to the beginning
-        nrrd_data = _pivot_axes(self.raw, self.ndim)
-        nrrd.write(str(nrrd_path), nrrd_data, header=header)
+        Args:
+            h5_path (str|pathlib.Path): path to the HDF5 file.
+            dataset (str): name of the dataset with the voxel values.
+            bbox: if provided, load only the voxels intersecting this bounding box
+                (in real-world coordinates); `offset` is adjusted accordingly.
+                Only the HDF5 chunks intersecting the bounding box are read.
+            mmap (bool): memory-map the data instead of reading it into memory.
+                Only supported for contiguous uncompressed datasets (see `save_h5`).
+        """
+        with h5py.File(h5_path, 'r') as h5f:
+            ds = h5f[dataset]
+            voxel_dimensions = np.array(ds.attrs['voxel_dimensions'], dtype=np.float32)
+            offset = np.array(ds.attrs['offset'], dtype=np.float32)
+            directions = ds.attrs.get('directions')
+            slices = ()
+            if bbox is not None:
+                aabb = _bbox_to_aabb(
+                    bbox, voxel_dimensions, offset, ds.shape[:len(offset)], directions
+                )
+                slices = tuple(slice(a, b) for a, b in zip(*aabb))
+                shift = aabb[0] * voxel_dimensions
+                offset = offset + (shift if directions is None else shift @ directions)
+            if mmap:
+                file_offset = ds.id.get_offset()
+                if ds.chunks is not None or ds.compression is not None or file_offset is None:
+                    raise VoxcellError(
+                        "Memory mapping is only supported for contiguous uncompressed datasets"
+                    )
+                raw = np.memmap(
+                    h5_path, dtype=ds.dtype, mode='r', offset=file_offset, shape=ds.shape
+                )[slices]
+            else:
+                raw = ds[slices]
+        return cls(raw, voxel_dimensions, offset, directions=directions)
+
+    def save_h5(self, h5_path, *, dataset='raw', chunks=64, compression='gzip',
+                compression_level=4):
+        """Save a VoxelData to a dataset of an HDF5 file, with metadata as dataset attributes.
+
+        The file is created if needed; an existing dataset with the same name is replaced.
 
-    def lookup(self, positions, outer_value=None):
+        Args:
+            h5_path (str|pathlib.Path): path to the HDF5 file.
+            dataset (str): name of the dataset with the voxel values.
+            chunks (int|tuple): HDF5 chunk shape (or its size along each axis, payload axes
+                are not split); None for a contiguous dataset (required for memory mapping).
+            compression (str): HDF5 compression filter ('gzip', 'lzf' or None).
+            compression_level (int): compression level (0-9) for 'gzip'.
+        """
+        shape = self.shape + self.payload_shape
+        if chunks is not None:
+            chunks = np.broadcast_to(chunks, (self.ndim,))
+            chunks = tuple(int(min(c, n)) for c, n in zip(chunks, self.shape)) + self.payload_shape
+            chunks = tuple(max(c, 1) for c in chunks)
+        with h5py.File(h5_path, 'a') as h5f:
+            if dataset in h5f:
+                del h5f[dataset]
+            ds = h5f.create_dataset(
+                dataset,
+                shape=shape,
+                dtype=self.dtype,
+                chunks=chunks,
+                compression=compression,
+                compression_opts=compression_level if compression == 'gzip' else None,
+                shuffle=compression is not None and self.dtype.itemsize > 1,
+            )
+            ds.attrs['voxel_dimensions'] = self.voxel_dimensions
+            ds.attrs['offset'] = self.offset
+            if self.directions is not None:
+                ds.attrs['directions'] = self.directions
+            for slab in self._slab_slices():
+                ds[slab] = self._read_region((slab,))
+
+    def lookup(self, positions, outer_value=None, out=None, chunk_size=None, *,
+               interpolation='nearest'):
         """Find the values in raw corresponding to the given positions.
 
+        Positions are processed in chunks, with temporary arrays bounded by the chunk size;
+        array-like `positions` with `shape` and `dtype` (e.g. numpy.memmap, h5py.Dataset)
+        are read chunk by chunk as well. Together with a preallocated `out` array, this gives
+        predictable peak memory for any number of positions.
+
         Args:
             positions: list of positions (x, y, z).
             outer_value: value to be returned for positions outside the atlas space.
                 If `None`, a VoxcellError is raised in that case.
+            out(np.array): array to write the result to; its shape should be
+                `positions.shape[:-1] + payload_shape`.
+            chunk_size(int): number of positions processed at once (default: 65536).
+            interpolation(str): 'nearest' for the value of the voxel containing each position,
+                or 'linear' for a multilinear interpolation between voxel centers (with values
+                clamped to the nearest voxel center at the volume edges). Linear interpolation
+                returns floats, float32 for float32 or small integer data.
 
         Returns:
-            Numpy array with the values of the voxels corresponding to each position.
+            Numpy array with the values of the voxels corresponding to each position
+            (a numpy scalar for a single scalar-valued position, unless `out` is given).
         """
-        voxel_idx = self.positions_to_indices(positions, strict=outer_value is None)
-        outer_mask = np.any(voxel_idx == VoxelData.OUT_OF_BOUNDS, axis=-1)
-        if np.any(outer_mask):
-            result = np.full(
-                voxel_idx.shape[:-1] + self.payload_shape,
-                outer_value,
-                dtype=self.raw.dtype
-            )
-            inner_mask = np.logical_not(outer_mask)  # pylint: disable=assignment-from-no-return
-            result[inner_mask] = self._lookup_by_indices(voxel_idx[inner_mask])
+        # pylint: disable=too-many-locals
+        if interpolation not in ('nearest', 'linear'):
+            raise VoxcellError(f"Unsupported interpolation: '{interpolation}'")
+        positions, flat_positions = self._as_flat_positions(positions)
+        result_shape = positions.shape[:-1] + self.payload_shape
+        if interpolation == 'linear':
+            dtype = np.result_type(self.dtype, np.float32)
         else:
-            result = self._lookup_by_indices(voxel_idx)
+            dtype = self.dtype
+        if out is None:
+            result = np.empty(result_shape, dtype=dtype)
+        elif out.shape != result_shape:
+            raise VoxcellError(f"'out' shape should be: {result_shape} (got: {out.shape})")
+        else:
+            result = out
+        flat_result = result.view()
+        flat_result.shape = (-1,) + self.payload_shape  # raises if `out` can't be reshaped w/o copy
+
+        for chunk, voxel_idx, inner_mask in self._iter_voxel_indices(
+            flat_positions, strict=outer_value is None, chunk_size=chunk_size
+        ):
+            if interpolation == 'linear':
+                chunk_positions = np.asarray(flat_positions[chunk])
+                if inner_mask is not None:
+                    chunk_positions = chunk_positions[inner_mask]
+                values = self._interpolate_linear(chunk_positions, dtype)
+            else:
+                values = self._lookup_by_indices(voxel_idx)
+            if inner_mask is None:
+                flat_result[chunk] = values
+            else:
+                flat_result[chunk][~inner_mask] = outer_value
+                flat_result[chunk][inner_mask] = values
+        # a single position gives a scalar, as with plain numpy indexing
+        return result if out is not None else result[()]
+
+    def _as_flat_positions(self, positions):
+        """Validate `positions`, and view them as an N x ndim array-like.
+
+        Array-likes with `shape` and `dtype` (numpy.memmap, h5py.Dataset) are not read in memory.
+        """
+        if not (hasattr(positions, 'shape') and hasattr(positions, 'dtype')):
+            positions = np.asarray(positions)
+        if len(positions.shape) == 0 or positions.shape[-1] != self.ndim:
+            raise VoxcellError(f"Invalid positions shape: {positions.shape}")
+        if isinstance(positions, np.ndarray):
+            return positions, positions.reshape(-1, self.ndim)
+        if len(positions.shape) == 2:
+            return positions, positions
+        raise VoxcellError(f"Invalid positions shape: {positions.shape}")
+
+    def _interpolate_linear(self, positions, dtype):
+        """Multilinear interpolation of voxel values at positions inside the volume.
+
+        Voxel values are located at voxel centers; positions between the outermost voxel centers
+        and the volume boundary get the values of the nearest voxel centers.
+        """
+        shape = np.array(self.shape)
+        coords = np.subtract(positions, self.offset, dtype=dtype)
+        if self.directions is not None:
+            coords = coords @ self._inverse_directions(dtype)
+        coords /= self.voxel_dimensions.astype(dtype)
+        coords -= dtype.type(0.5)
+        np.clip(coords, 0, shape - 1, out=coords)
+        lower = np.minimum(np.floor(coords), np.maximum(shape - 2, 0)).astype(np.intp)
+        upper = np.minimum(lower + 1, shape - 1)
+        frac = coords
+        frac -= lower
+
+        result = np.zeros((len(positions),) + self.payload_shape, dtype=dtype)
+        weights = np.empty(len(positions), dtype=dtype)
+        weights_shape = (-1,) + (1,) * len(self.payload_shape)
+        for corner in itertools.product((False, True), repeat=self.ndim):
+            weights.fill(1)
+            for axis, is_upper in enumerate(corner):
+                weights *= frac[:, axis] if is_upper else 1 - frac[:, axis]
+            voxel_idx = np.where(corner, upper, lower)
+            result += weights.reshape(weights_shape) * self._lookup_by_indices(voxel_idx)
         return result
 
+    def _iter_voxel_indices(self, positions, strict, chunk_size=None):
+        """Convert positions to voxel indices chunk by chunk.
+
+        Same boundary semantics as `positions_to_indices`, but with fused operations on
+        preallocated buffers bounded by `chunk_size`. Positions are processed in their own
+        precision (float32 positions are not upcast).
+
+        Args:
+            positions: N x ndim array of positions
+            strict(bool): raise VoxcellError if any of the positions are out of bounds
+            chunk_size(int): number of positions processed at once (default: 65536)
+
+        Yields:
+            tuple (chunk, voxel_idx, inner_mask), where `chunk` is the slice of processed
+            positions, `voxel_idx` the indices of the voxels for positions inside the volume,
+            and `inner_mask` the mask of these positions in the chunk (None if all are inside).
+        """
+        # pylint: disable=too-many-locals
+        chunk_size = chunk_size or _LOOKUP_CHUNK_SIZE
+        n = min(chunk_size, len(positions))
+        dtype = np.result_type(positions.dtype, self.offset.dtype, self.voxel_dimensions.dtype)
+        shape = np.array(self.shape)
+        upper = self.bbox[1]
+        inverse_directions = self._inverse_directions(dtype)
+        buf = np.empty((n, self.ndim), dtype=dtype)
+        tmp = np.empty((n, self.ndim), dtype=dtype)
+        mask = np.empty((n, self.ndim), dtype=bool)
+        tmp_mask = np.empty((n, self.ndim), dtype=bool)
+        outer = np.empty(n, dtype=bool)
+        voxel_idx = np.empty((n, self.ndim), dtype=np.intp)
+
+        for start in range(0, len(positions), chunk_size):
+            pos = np.asarray(positions[start:start + chunk_size])
+            m = len(pos)
+            b, t, k, tk, o, idx = buf[:m], tmp[:m], mask[:m], tmp_mask[:m], outer[:m], voxel_idx[:m]
+
+            np.subtract(pos, self.offset, out=b)
+            if inverse_directions is not None:
+                np.matmul(b, inverse_directions, out=t)
+                b, t = t, b
+            np.divide(b, self.voxel_dimensions, out=b)
+            np.less(np.abs(b, out=t), 1e-7, out=k)
+            b[k] = 0.  # suppress rounding errors around 0
+            np.floor(b, out=b)
+
+            # negative (or NaN) indices, or positions past the upper boundary
+            np.greater_equal(b, 0, out=k)
+            np.logical_not(k, out=k)
+            np.greater_equal(b, shape, out=tk)
+            if inverse_directions is None:
+                tk &= np.greater_equal(pos, upper)
+            k |= tk
+            np.any(k, axis=1, out=o)
+
+            has_outer = o.any()
+            if has_outer:
+                if strict:
+                    raise VoxcellError("Out of bounds position")
+                b[o] = 0
+            np.minimum(b, shape - 1, out=b)
+            np.copyto(idx, b, casting='unsafe')
+
+            if has_outer:
+                inner_mask = ~o
+                yield slice(start, start + m), idx[inner_mask], inner_mask
+            else:
+                yield slice(start, start + m), idx, None
+
     def _lookup_by_indices(self, voxel_idx):
         """Values for the given voxels."""
         voxel_idx_tuple = tuple(voxel_idx.transpose())
         return self.raw[voxel_idx_tuple]
 
+    def _read_region(self, region):
+        """Voxel values in `region` (tuple of slices along the first spatial axes); may be a view.
+
+        Subclasses not storing `raw` as a dense array read only the requested region.
+        """
+        return self.raw[region]
+
+    def _slab_slices(self):
+        """Slices along the first axis splitting the data for full-volume operations."""
+        return parallel.slab_slices(self.shape + self.payload_shape)
+
     def positions_to_indices(self, positions, strict=True, keep_fraction=False):
         """Take positions, and the index of the voxel to which they belong.
 
@@ -204,14 +636,19 @@ class VoxelData:
             np.array(Nx3) with the voxels coordinates corresponding to each position.
 
         """
-        result = (positions - self.offset) / self.voxel_dimensions
+        result = _positions_to_index_coords(
+            positions, self.voxel_dimensions, self.offset, self.directions
+        )
         result[np.abs(result) < 1e-7] = 0.  # suppress rounding errors around 0
 
         if not keep_fraction:
             result = np.floor(result).astype(int)
 
         result[result < 0] = VoxelData.OUT_OF_BOUNDS
-        result[(result >= self.shape) & (positions >= self.bbox[1])] = VoxelData.OUT_OF_BOUNDS
+        outer = result >= self.shape
+        if self.directions is None:
+            outer &= positions >= self.bbox[1]
+        result[outer] = VoxelData.OUT_OF_BOUNDS
 
         if not keep_fraction:
             result = np.clip(result, a_min=None, a_max=np.array(self.shape) - 1)
@@ -229,36 +666,101 @@ class VoxelData:
         Use fractional indices to obtain positions within voxels
         (for example, index (0.5, 0.5) would give the center of voxel (0, 0)).
         """
-        return indices * self.voxel_dimensions + self.offset
+        if self.directions is None:
+            return indices * self.voxel_dimensions + self.offset
+        return (indices * self.voxel_dimensions) @ self.directions + self.offset
 
-    def count(self, values):
+    def count(self, values, n_jobs=None):
         """Number of voxels with value from the given list.
 
         `values` could be a single value or an iterable.
+        `n_jobs` is the number of threads (see `voxcell.parallel`).
         """
-        if isinstance(values, set):
-            # numpy.in1d expects an array-like object as second parameter
-            values = list(values)
-        return np.count_nonzero(np.in1d(self.raw, values))
-
-    def volume(self, values):
+        values = np.ravel(list(values) if isinstance(values, set) else values)
+        return sum(parallel.map_chunks(
+            lambda slab: np.count_nonzero(
+                math_utils.isin(self._read_region((slab,)), values, n_jobs=1)
+            ),
+            self._slab_slices(),
+            n_jobs=n_jobs,
+        ))
+
+    def volume(self, values, n_jobs=None):
         """Total volume of voxels with value from the given list.
 
         `values` could be a single value or an iterable.
+        `n_jobs` is the number of threads (see `voxcell.parallel`).
         """
-        return self.count(values) * self.voxel_volume
+        return self.count(values, n_jobs=n_jobs) * self.voxel_volume
+
+    def value_counts(self):
+        """Number of voxels with each value, as pandas Series indexed by (sorted) values.
+
+        Data is scanned once, slab by slab; for vector payloads each component is counted.
+        """
+        result = _value_counts(self._iter_value_blocks())
+        if self.dtype == bool:
+            result.index = result.index.astype(bool)
+        return result
+
+    def _iter_value_blocks(self):
+        """Iterate over blocks of voxel values covering the whole data, in any order."""
+        for slab in self._slab_slices():
+            yield self._read_region((slab,))
+
+    def volumes(self, value_sets):
+        """Total volume of voxels with value from each of the given lists.
+
+        Equivalent to `[self.volume(values) for values in value_sets]`, with a single scan
+        of the data (see `value_counts`).
+
+        Args:
+            value_sets: iterable of single values or iterables of values
 
-    def clip(self, bbox, na_value=0, inplace=False):
+        Returns:
+            numpy array with the volume for each entry of `value_sets`
+        """
+        counts = self.value_counts()
+        result = []
+        for values in value_sets:
+            values = np.unique(list(values) if isinstance(values, set) else values)
+            result.append(counts.reindex(values, fill_value=0).sum())
+        return np.array(result, dtype=np.int64) * self.voxel_volume
+
+    def clip(self, bbox, na_value=0, inplace=False, n_jobs=None):
         """Assign `na_value` to voxels outside of axis-aligned bounding box.
 
         Args:
             bbox: bounding box in real-world coordinates
             na_value: value to use for voxels outside of bbox
             inplace(bool): modify data inplace
+            n_jobs(int): number of threads (see `voxcell.parallel`)
 
         Returns:
             None if `inplace` is True, new VoxelData otherwise
         """
+        aa, bb = self._clip_aabb(bbox)
+        shape = self.shape + self.payload_shape
+        raw = self.raw if inplace else np.empty(shape, dtype=self.dtype)
+
+        def _clip_slab(slab):
+            start = min(max(aa[0], slab.start), slab.stop) - slab.start
+            stop = max(min(bb[0] + 1, slab.stop), slab.start) - slab.start
+            inner = (slice(start, stop),) + tuple(slice(a, b + 1) for a, b in zip(aa[1:], bb[1:]))
+            kept = np.array(self._read_region((slab,))[inner])
+            raw[slab] = na_value
+            raw[slab][inner] = kept
+
+        parallel.map_chunks(_clip_slab, self._slab_slices(), n_jobs=n_jobs)
+
+        if inplace:
+            return None
+        return VoxelData(raw, self.voxel_dimensions, self.offset, directions=self.directions)
+
+    def _clip_aabb(self, bbox):
+        """Indices of the first and last voxels inside `bbox` along each axis."""
+        if self.directions is not None:
+            raise VoxcellError("Clipping requires a volume aligned with the space axes")
         bbox = np.array(bbox)
         if bbox.shape != (2, self.ndim):
             raise VoxcellError(f"Invalid bbox shape: {bbox.shape}")
@@ -271,92 +773,312 @@ class VoxelData:
         bb -= 1
         if np.any(aa > bb):
             raise VoxcellError("Empty slice")
+        return aa, bb
 
-        indices = tuple(range(a, b + 1) for a, b in zip(aa, bb))
-
-        if inplace:
-            mask = np.full_like(self.raw, False, dtype=bool)
-            mask[indices] = True
-            self.raw[np.logical_not(mask)] = na_value
-            return None
-
-        raw = np.full_like(self.raw, na_value)
-        raw[indices] = self.raw[indices]
-        return VoxelData(raw, self.voxel_dimensions, self.offset)
-
-    def filter(self, predicate, inplace=False):
+    def filter(self, predicate, inplace=False, n_jobs=None):
         """Set values for voxel positions not satisfying `predicate` to zero.
 
+        The predicate is evaluated slab by slab along the first axis, so that the positions
+        of the whole volume are never materialized at once.
+
         Args:
             predicate: N x k [float] -> N x 1 [bool]
             inplace(bool): modify data inplace
+            n_jobs(int): number of threads evaluating slabs (see `voxcell.parallel`);
+                `predicate` should be thread-safe if more than one thread is used.
 
         Returns:
             None if `inplace` is True, new VoxelData otherwise
         """
-        ijk = np.stack(np.mgrid[[slice(0, d) for d in self.shape]], axis=-1)
-        xyz = self.indices_to_positions(0.5 + ijk)
-        mask = predicate(xyz.reshape(-1, self.ndim)).reshape(self.shape)
+        if inplace:
+            raw = self.raw
+        else:
+            raw = np.zeros(self.shape + self.payload_shape, dtype=self.dtype)
+
+        def _filter_slab(slab):
+            ijk = np.stack(
+                np.mgrid[[slab] + [slice(0, d) for d in self.shape[1:]]], axis=-1
+            )
+            xyz = self.indices_to_positions(0.5 + ijk)
+            mask = predicate(xyz.reshape(-1, self.ndim)).reshape(ijk.shape[:-1])
+            if inplace:
+                raw[slab][np.invert(mask)] = 0
+            else:
+                raw[slab][mask] = self._read_region((slab,))[mask]
+
+        parallel.map_chunks(_filter_slab, self._slab_slices(), n_jobs=n_jobs)
 
         if inplace:
-            self.raw[np.invert(mask)] = 0
             return None
+        return VoxelData(raw, self.voxel_dimensions, self.offset, directions=self.directions)
 
-        raw = np.zeros_like(self.raw)
-        raw[mask] = self.raw[mask]
-        return VoxelData(raw, self.voxel_dimensions, self.offset)
-
-    def compact(self, na_values=(0,), inplace=False):
+    def compact(self, na_values=(0,), inplace=False, n_jobs=None):
         """Reduce size of raw data by clipping N/A values.
 
+        The bounding box of the remaining values is found slab by slab, without a full mask.
+
         Args:
             na_values(tuple): values to clip
             inplace(bool): modify data inplace
+            n_jobs(int): number of threads (see `voxcell.parallel`)
 
         Returns:
             None if `inplace` is True, new VoxelData otherwise
         """
-        mask = np.logical_not(  # pylint: disable=assignment-from-no-return
-            math_utils.isin(self.raw, na_values)
-        )
-        aabb = math_utils.minimum_aabb(mask)
-
-        raw = math_utils.clip(self.raw, aabb)
-        offset = self.indices_to_positions(aabb[0])
+        aabb = self._compact_aabb(na_values, n_jobs)
+        idx = tuple(slice(s, e + 1) for s, e in zip(*aabb))
+        raw = np.array(self._read_region(idx[:self.ndim])[(Ellipsis,) + idx[self.ndim:]])
+        offset = self.indices_to_positions(aabb[0][:self.ndim])
 
         if inplace:
             self.raw = raw
             self.offset = offset
             return None
 
-        return VoxelData(raw, self.voxel_dimensions, offset)
+        return VoxelData(raw, self.voxel_dimensions, offset, directions=self.directions)
+
+    def _compact_aabb(self, na_values, n_jobs):
+        """Minimum AABB (of `raw` indices) of the values not in `na_values`."""
+        return math_utils.projections_minimum_aabb(parallel.map_chunks(
+            lambda slab: math_utils.mask_projections(
+                np.logical_not(math_utils.isin(self._read_region((slab,)), na_values, n_jobs=1))
+            ),
+            self._slab_slices(),
+            n_jobs=n_jobs,
+        ))
+
+    def sample_positions(self, n, rng=np.random, chunk_size=None):
+        """Sample `n` positions, picking voxels proportionally to their (non-negative) values.
+
+        Use `voxcell.PositionSampler` directly to reuse its table for several draws,
+        or to iterate over chunks of positions.
+        """
+        # pylint: disable=import-outside-toplevel
+        from voxcell.position_sampler import PositionSampler
+        return PositionSampler(self).sample(n, rng=rng, chunk_size=chunk_size)
+
+    def resample(self, factor, method='mean', n_jobs=None):
+        """Downsample to a coarser grid, reducing blocks of `factor` voxels to one voxel.
+
+        The blocks start at the volume origin; if the volume shape is not a multiple of `factor`,
+        the last blocks are partial (and the bounding box grows accordingly).
+        The volume is processed in slabs (see `voxcell.parallel`).
+
+        Args:
+            factor(int|tuple of ints): number of voxels per block along each axis
+            method(str): block reduction (see `math_utils.block_reduce`): 'mode' for labels,
+                'mean' or 'sum' for densities, 'normalized_mean' for direction vectors
+            n_jobs(int): number of threads (see `voxcell.parallel`)
+
+        Returns:
+            VoxelData with the same offset, and `voxel_dimensions` multiplied by `factor`
+        """
+        factor = np.broadcast_to(factor, (self.ndim,))
+        if not np.issubdtype(factor.dtype, np.integer) or np.any(factor < 1):
+            raise VoxcellError(f"Invalid resampling factor: {factor.tolist()}")
+        starts = [np.arange(0, n, f) for n, f in zip(self.shape, factor)]
+        row_size = int(np.prod(self.shape[1:] + self.payload_shape, dtype=np.int64))
+        step = max(1, parallel.SLAB_SIZE // max(1, factor[0] * row_size))
+        slabs = [slice(i, i + step) for i in range(0, len(starts[0]), step)]
+
+        def _resample_slab(slab):
+            origin = starts[0][slab][0]
+            values = self._read_region((slice(origin, origin + factor[0] * len(starts[0][slab])),))
+            return math_utils.block_reduce(values, [starts[0][slab] - origin] + starts[1:], method)
+
+        raw = np.concatenate(parallel.map_chunks(_resample_slab, slabs, n_jobs=n_jobs))
+        return VoxelData(
+            raw, self.voxel_dimensions * factor, self.offset, directions=self.directions
+        )
 
     def with_data(self, raw):
         """Return VoxelData of the same shape with different data."""
-        return VoxelData(raw, self.voxel_dimensions, self.offset)
+        return VoxelData(raw, self.voxel_dimensions, self.offset, directions=self.directions)
+
+    def _take_raw(self):
+        """Voxel values for a one-off use, and whether they are owned by the caller."""
+        return self.raw, False
 
     @staticmethod
-    def reduce(function, iterable):
+    def reduce(function, iterable, prefetch=False):
         """Return a VoxelData by reducing the raw contents of the VoxelData objects in iterable.
 
+        Elements are loaded one at a time, and accumulated in a single buffer: in place if
+        `function` is a NumPy ufunc or an arithmetic operator (e.g. `operator.add`, `np.maximum`)
+        whose output has the dtype of the buffer; a new buffer is used otherwise.
+        NRRD paths and LazyVoxelData elements are only loaded when they are reduced,
+        and are not kept in memory afterwards.
+
         Note: if iterable contains only one item, a copy is returned (but function
         is not applied)
 
         Args:
             function (Callable[[np.array, np.array], np.array]): the function to be
                 applied to numpy arrays
-            iterable (Sequence[VoxelData]): a sequence of VoxelData objects
+            iterable (Iterable[VoxelData|str|pathlib.Path]): VoxelData objects or NRRD paths
+            prefetch (bool): load the next element on a background thread while reducing
         """
-        iterable = list(iterable)
-        if not iterable:
-            raise TypeError('Attempting to reduce an empty sequence')
+        ufunc = function if isinstance(function, np.ufunc) else _INPLACE_OPERATORS.get(function)
+        elements = map(_reduce_element, iterable)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            if prefetch:
+                elements = _prefetch(elements, executor)
+            try:
+                first, result, owned = next(elements)
+            except StopIteration:
+                raise TypeError('Attempting to reduce an empty sequence') from None
+            if not (owned and result.flags.writeable):
+                result = result.copy()
+
+            for element, raw, _ in elements:
+                assert_array_equal(element.voxel_dimensions, first.voxel_dimensions)
+                assert_array_equal(element.offset, first.offset)
+                if ufunc is not None and _ufunc_result_dtype(ufunc, result, raw) == result.dtype:
+                    ufunc(result, raw, out=result)
+                else:
+                    # new buffer with the output dtype, reused in place by the next elements
+                    result = function(result, raw)
+
+        return first.with_data(result)
+
+
+_INPLACE_OPERATORS = {
+    operator.add: np.add,
+    operator.sub: np.subtract,
+    operator.mul: np.multiply,
+    operator.and_: np.bitwise_and,
+    operator.or_: np.bitwise_or,
+    operator.xor: np.bitwise_xor,
+}
+
+
+def _ufunc_result_dtype(ufunc, a, b):
+    """Output dtype of binary `ufunc` applied to `a` and `b`; None if it can't be resolved."""
+    if ufunc.nin != 2 or ufunc.nout != 1:
+        return None
+    try:
+        return ufunc(np.empty(0, dtype=a.dtype), np.empty(0, dtype=b.dtype)).dtype
+    except TypeError:
+        return None
+
+
+def _reduce_element(element):
+    """Get VoxelData for an element of `VoxelData.reduce`, with its voxel values."""
+    if isinstance(element, (str, os.PathLike)):
+        element = VoxelData.load_nrrd(element)
+        return element, element.raw, True
+    assert isinstance(element, VoxelData)
+    raw, owned = element._take_raw()  # pylint: disable=protected-access
+    return element, raw, owned
+
+
+def _prefetch(iterator, executor):
+    """Iterate over `iterator`, computing the next item on `executor` in the meantime."""
+    future = executor.submit(next, iterator, None)
+    while True:
+        item = future.result()
+        if item is None:
+            return
+        future = executor.submit(next, iterator, None)
+        yield item
+
+
+def _load_nrrd_raw(nrrd_path, mmap, bbox):
+    """Load `raw` from a nrrd file."""
+    return VoxelData.load_nrrd(nrrd_path, mmap=mmap, bbox=bbox).raw
+
+
+class LazyVoxelData(VoxelData):
+    """Volumetric data with `raw` loaded on first access.
+
+    Metadata (`shape`, `payload_shape`, `dtype`, `voxel_dimensions`, `offset`, `bbox`)
+    is available without loading the data.
+    """
+    def __init__(self, loader, raw_shape, dtype, voxel_dimensions, offset=None, *,
+                 directions=None):
+        """Init LazyVoxelData.
 
-        for element in iterable:
-            assert isinstance(element, VoxelData)
-            assert_array_equal(element.voxel_dimensions, iterable[0].voxel_dimensions)
-            assert_array_equal(element.offset, iterable[0].offset)
+        Args:
+            loader: callable returning the actual voxel values
+            raw_shape(tuple of ints): shape of the voxel values array
+            dtype: data type of the voxel values
+            voxel_dimensions(tuple of numbers): size of each voxel in space.
+            offset(tuple of numbers): offset from an external atlas origin
+            directions(np.array of NxN): directions of the voxel axes in space
+                (see `VoxelData`)
+        """
+        # zero-strided placeholder with the expected shape and dtype, occupying no memory
+        placeholder = np.broadcast_to(np.zeros((), dtype=dtype), tuple(raw_shape))
+        super().__init__(placeholder, voxel_dimensions, offset, directions=directions)
+        self._loader = loader
+
+    @property
+    def raw(self):
+        """Voxel values; loaded on first access."""
+        if self._loader is not None:
+            self._raw = self._loader()
+            self._loader = None
+        return self._raw
+
+    @raw.setter
+    def raw(self, value):
+        self._raw = value
+        self._loader = None
+
+    @property
+    def is_loaded(self):
+        """Whether voxel values have been loaded."""
+        return self._loader is None
+
+    def _take_raw(self):
+        """Voxel values for a one-off use (not kept if not loaded yet), and whether owned."""
+        if self._loader is not None:
+            return self._loader(), True
+        return self._raw, False
+
+    @property
+    def dtype(self):
+        """Data type of the voxel values."""
+        return self._raw.dtype
 
-        return iterable[0].with_data(reduce(function, (x.raw for x in iterable)))
+    @property
+    def shape(self):
+        """Number of voxels in each dimension."""
+        return self._raw.shape[:self.ndim]
+
+    @property
+    def payload_shape(self):
+        """Shape of the data stored per voxel."""
+        return self._raw.shape[self.ndim:]
+
+    @classmethod
+    def load_nrrd(cls, nrrd_path, mmap=False, bbox=None):
+        """Read NRRD header, deferring data loading until `raw` is accessed.
+
+        Args:
+            nrrd_path (str|pathlib.Path): path to the nrrd file.
+            mmap (bool): memory-map the data once it is accessed (see `VoxelData.load_nrrd`).
+            bbox: if provided, restrict to the voxels intersecting this bounding box
+                (see `VoxelData.load_nrrd`).
+        """
+        header, _ = nrrd_utils.read_header(nrrd_path)
+        spacings, offset, directions, slices = _parse_nrrd_region(header, bbox)
+        shape = nrrd_utils.data_shape(header)
+        if slices is not None:
+            shape = tuple(len(range(*s.indices(n))) for s, n in zip(slices, shape))
+
+        # In NRRD 'payload' axes go first, move them to the end
+        k = len(shape) - len(spacings)
+        raw_shape = shape[k:] + shape[:k]
+
+        return cls(
+            partial(_load_nrrd_raw, nrrd_path, mmap, bbox),
+            raw_shape,
+            nrrd_utils.data_dtype(header),
+            spacings,
+            offset,
+            directions=directions,
+        )
 
 
 class OrientationField(VoxelData):
@@ -409,7 +1131,71 @@ class ROIMask(VoxelData):
         self.raw = self.raw.astype(bool)
 
 
-def values_to_region_attribute(values, region_map, attr="acronym"):
+def _check_same_grid(voxel_data, other):
+    """Raise VoxcellError if `other` is not on the same voxel grid as `voxel_data`."""
+    def _directions(v):
+        return np.eye(v.ndim) if v.directions is None else v.directions
+
+    if (
+        other.shape != voxel_data.shape
+        or not np.array_equal(other.voxel_dimensions, voxel_data.voxel_dimensions)
+        or not np.array_equal(other.offset, voxel_data.offset)
+        or not np.array_equal(_directions(other), _directions(voxel_data))
+    ):
+        raise VoxcellError("VoxelData must share the same voxel grid")
+
+
+def lookup_layers(layers, positions, outer_value=None, chunk_size=None):
+    """Find the values corresponding to the given positions in several VoxelData.
+
+    Positions are converted to voxel indices once (chunk by chunk, see `VoxelData.lookup`),
+    and the values are gathered from each of the layers.
+
+    Args:
+        layers(dict): VoxelData sharing the same voxel grid, by name
+        positions: list of positions (x, y, z).
+        outer_value: value to be returned for positions outside the atlas space
+            (or dict with a value per layer name). If `None`, a VoxcellError is raised
+            in that case.
+        chunk_size(int): number of positions processed at once (default: 65536).
+
+    Returns:
+        dict with the values of the voxels corresponding to each position, by layer name.
+    """
+    # pylint: disable=protected-access
+    layers = dict(layers)
+    if not layers:
+        raise VoxcellError("No layers to look up")
+    first = next(iter(layers.values()))
+    for layer in layers.values():
+        _check_same_grid(first, layer)
+    if not isinstance(outer_value, dict):
+        outer_value = dict.fromkeys(layers, outer_value)
+
+    positions, flat_positions = first._as_flat_positions(positions)
+    results = {
+        name: np.empty(positions.shape[:-1] + layer.payload_shape, dtype=layer.dtype)
+        for name, layer in layers.items()
+    }
+    flat_results = {
+        name: result.reshape((-1,) + layer.payload_shape)
+        for (name, result), layer in zip(results.items(), layers.values())
+    }
+    strict = any(outer_value[name] is None for name in layers)
+    for chunk, voxel_idx, inner_mask in first._iter_voxel_indices(
+        flat_positions, strict=strict, chunk_size=chunk_size
+    ):
+        for name, layer in layers.items():
+            values = layer._lookup_by_indices(voxel_idx)
+            if inner_mask is None:
+                flat_results[name][chunk] = values
+            else:
+                flat_results[name][chunk][~inner_mask] = outer_value[name]
+                flat_results[name][chunk][inner_mask] = values
+    return {name: result[()] for name, result in results.items()}
+
+
+def values_to_region_attribute(values, region_map, attr="acronym", n_jobs=None):
     """Convert region ids to the corresponding region attribute.
 
     It can be used to convert the values retrieved with `VoxelData.lookup()`.
@@ -418,6 +1204,7 @@ def values_to_region_attribute(values, region_map, attr="acronym"):
         values (np.array): array containing the values to be converted.
         region_map (RegionMap): instance used to map values to region acronyms.
         attr (str): attribute name to lookup.
+        n_jobs (int): number of threads (see `voxcell.parallel`).
 
     Returns:
         Numpy array with the converted values.
@@ -428,9 +1215,20 @@ def values_to_region_attribute(values, region_map, attr="acronym"):
     See Also:
         Scalar Image File Format in the documentation
     """
-    ids, idx = np.unique(values, return_inverse=True)
+    values = np.asarray(values)
+    flat_values = values.reshape(-1)
+    chunks = parallel.slab_slices(flat_values.shape)
+    ids = np.unique(np.concatenate([flat_values[:0]] + parallel.map_chunks(
+        lambda chunk: np.unique(flat_values[chunk]), chunks, n_jobs=n_jobs
+    )))
     resolved = np.array([region_map.get(_id, attr=attr) for _id in ids])
-    return resolved[idx]
+    idx = np.empty(flat_values.shape, dtype=np.intp)
+
+    def _resolve_chunk(chunk):
+        idx[chunk] = np.searchsorted(ids, flat_values[chunk])
+
+    parallel.map_chunks(_resolve_chunk, chunks, n_jobs=n_jobs)
+    return resolved[idx].reshape(values.shape)
 
 
 def values_to_hemisphere(values):
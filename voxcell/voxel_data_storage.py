@@ -0,0 +1,926 @@
+"""Volumetric data not stored as a dense array in memory."""
+import functools
+import itertools
+import operator
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from voxcell import math_utils, nrrd_utils, parallel
+from voxcell.exceptions import VoxcellError
+from voxcell.voxel_data import (
+    _INPLACE_OPERATORS,
+    VoxelData,
+    _check_same_grid,
+    _normalize_region,
+    _parse_nrrd_region,
+    _pivot_axes,
+    _ufunc_result_dtype,
+    _value_counts,
+)
+
+_CONTIGUOUS_TILE_SIZE = 64
+
+
+def _iter_tile_groups(idx, tile_shape, grid_shape):
+    """Iterate over (tile index, positions in `idx`) for the tiles containing voxels `idx`."""
+    tile_idx = idx // tile_shape
+    tile_ids = np.ravel_multi_index(tuple(tile_idx.T), grid_shape)
+    order = np.argsort(tile_ids, kind='stable')
+    starts = np.flatnonzero(np.diff(tile_ids[order], prepend=-1))
+    for sel in np.split(order, starts[1:]):
+        if len(sel) > 0:
+            yield tile_idx[sel[0]], sel
+
+
+def _iter_nrrd_slabs(voxel_data, align=1):
+    """Iterate over voxel values bytes in NRRD order, reading slabs along the last axis."""
+    pivoted_shape = voxel_data.shape[::-1] + voxel_data.payload_shape
+    max_size = max(1, nrrd_utils.CHUNK_SIZE // voxel_data.dtype.itemsize)
+    for slab in parallel.slab_slices(pivoted_shape, max_size, align):
+        region = (slice(None),) * (voxel_data.ndim - 1) + (slab,)
+        block = voxel_data._read_region(region)  # pylint: disable=protected-access
+        yield from nrrd_utils.iter_chunks(_pivot_axes(block, voxel_data.ndim))
+
+
+class _PlaceholderVoxelData(VoxelData):
+    """Base class for volumetric data not stored as a dense `raw` array.
+
+    Subclasses keep a zero-strided `_placeholder` array with the shape and dtype of `raw`.
+    """
+    _placeholder = None
+
+    @property
+    def dtype(self):
+        """Data type of the voxel values."""
+        return self._placeholder.dtype
+
+    @property
+    def shape(self):
+        """Number of voxels in each dimension."""
+        return self._placeholder.shape[:self.ndim]
+
+    @property
+    def payload_shape(self):
+        """Shape of the data stored per voxel."""
+        return self._placeholder.shape[self.ndim:]
+
+
+class SparseVoxelData(_PlaceholderVoxelData):
+    """Volumetric data storing only voxels which differ from `fill_value` (coordinate list).
+
+    Suitable for mostly empty volumes (region masks, per-region densities, etc).
+    `raw` is materialized as a read-only dense array on each access; thus in-place operations
+    are not supported.
+    """
+    def __init__(self, indices, values, shape, voxel_dimensions, offset=None, *, fill_value=0,
+                 directions=None):
+        """Init SparseVoxelData.
+
+        Args:
+            indices(np.array of KxN): indices of the stored voxels
+            values(np.array of K x payload_shape): values of the stored voxels
+            shape(tuple of ints): number of voxels in each dimension
+            voxel_dimensions(tuple of numbers): size of each voxel in space.
+            offset(tuple of numbers): offset from an external atlas origin
+            fill_value: value of the voxels which are not stored
+            directions(np.array of NxN): directions of the voxel axes in space
+                (see `VoxelData`)
+        """
+        values = np.asarray(values)
+        indices = np.asarray(indices, dtype=np.intp).reshape(-1, len(shape))
+        if len(indices) != len(values):
+            raise VoxcellError(
+                f"'indices' and 'values' lengths differ ({len(indices)} != {len(values)})"
+            )
+        # zero-strided placeholder with the expected shape and dtype, occupying no memory
+        placeholder = np.broadcast_to(
+            np.full((), fill_value, dtype=values.dtype), tuple(shape) + values.shape[1:]
+        )
+        super().__init__(placeholder, voxel_dimensions, offset, directions=directions)
+        self.fill_value = placeholder.dtype.type(fill_value)
+
+        # voxels are stored in NRRD (Fortran) order, so that slabs along the last axis
+        # correspond to contiguous ranges
+        flat_indices = np.ravel_multi_index(tuple(indices.T), self.shape, order='F')
+        order = np.argsort(flat_indices, kind='stable')
+        self._flat_indices = flat_indices[order]
+        self._values = values[order]
+        if np.any(np.diff(self._flat_indices) == 0):
+            raise VoxcellError("Duplicate voxel indices")
+        # permutation sorting the stored voxels in C order, and their C-order flat indices;
+        # built on first use by `_stored_range`
+        self._c_order = None
+
+    @classmethod
+    def from_dense(cls, voxel_data, fill_value=0):
+        """Create SparseVoxelData storing voxels of `voxel_data` which differ from `fill_value`."""
+        raw = voxel_data.raw
+        mask = raw != fill_value
+        if voxel_data.payload_shape:
+            mask = np.any(mask, axis=tuple(range(voxel_data.ndim, raw.ndim)))
+        flat_indices = np.flatnonzero(mask.ravel(order='F'))
+        indices = np.unravel_index(flat_indices, voxel_data.shape, order='F')
+        return cls(
+            np.stack(indices, axis=-1),
+            raw[indices],
+            voxel_data.shape,
+            voxel_data.voxel_dimensions,
+            voxel_data.offset,
+            fill_value=fill_value,
+            directions=voxel_data.directions,
+        )
+
+    def to_dense(self):
+        """Convert to a dense VoxelData."""
+        return VoxelData(
+            np.array(self.raw), self.voxel_dimensions, self.offset, directions=self.directions
+        )
+
+    @property
+    def raw(self):
+        """Voxel values as a read-only dense array (materialized on each access)."""
+        result = np.full(self.shape + self.payload_shape, self.fill_value, dtype=self.dtype)
+        result[self._unravel(self._flat_indices)] = self._values
+        result.flags.writeable = False
+        return result
+
+    @raw.setter
+    def raw(self, value):
+        # only used by VoxelData.__init__ to pass the placeholder
+        self._placeholder = value
+
+    @property
+    def indices(self):
+        """Indices of the stored voxels (KxN array)."""
+        return np.stack(self._unravel(self._flat_indices), axis=-1)
+
+    @property
+    def values(self):
+        """Values of the stored voxels."""
+        return self._values
+
+    def _unravel(self, flat_indices):
+        return np.unravel_index(flat_indices, self.shape, order='F')
+
+    def _lookup_by_indices(self, voxel_idx):
+        """Values for the given voxels."""
+        voxel_idx = np.asarray(voxel_idx)
+        flat_indices = np.ravel_multi_index(
+            tuple(voxel_idx.reshape(-1, self.ndim).T), self.shape, order='F'
+        )
+        result = np.full(
+            (len(flat_indices),) + self.payload_shape, self.fill_value, dtype=self.dtype
+        )
+        if len(self._flat_indices):
+            pos = np.searchsorted(self._flat_indices, flat_indices)
+            pos[pos == len(self._flat_indices)] = 0
+            found = self._flat_indices[pos] == flat_indices
+            result[found] = self._values[pos[found]]
+        return result.reshape(voxel_idx.shape[:-1] + self.payload_shape)
+
+    def _read_region(self, region):
+        """Voxel values in `region`, filled from the stored voxels within it."""
+        region = _normalize_region(region, self.shape)
+        lo = np.array([s.start for s in region])
+        hi = np.array([s.stop for s in region])
+        result = np.full(tuple(hi - lo) + self.payload_shape, self.fill_value, dtype=self.dtype)
+        sel = self._stored_range(lo, hi)
+        indices = np.stack(self._unravel(self._flat_indices[sel]), axis=-1)
+        inside = np.all((indices >= lo) & (indices < hi), axis=1)
+        result[tuple((indices[inside] - lo).T)] = self._values[sel][inside]
+        return result
+
+    def _stored_range(self, lo, hi):
+        """Positions of the stored voxels within the range [lo, hi) along the first or last axis.
+
+        Voxels in a range along the last axis are contiguous in NRRD order; voxels in a range
+        along the first axis are contiguous in C order, sorted on first use.
+        The narrower of the two is returned, as a slice or an array of positions.
+        """
+        plane_size = int(np.prod(self.shape[:-1], dtype=np.int64))
+        start, stop = np.searchsorted(
+            self._flat_indices, [lo[-1] * plane_size, hi[-1] * plane_size]
+        )
+        if self.ndim > 1 and (lo[0] > 0 or hi[0] < self.shape[0]):
+            if self._c_order is None:
+                c_flat = np.ravel_multi_index(self._unravel(self._flat_indices), self.shape)
+                order = np.argsort(c_flat, kind='stable')
+                self._c_order = order, c_flat[order]
+            order, c_flat = self._c_order
+            row_size = int(np.prod(self.shape[1:], dtype=np.int64))
+            c_start, c_stop = np.searchsorted(c_flat, [lo[0] * row_size, hi[0] * row_size])
+            if c_stop - c_start < stop - start:
+                return order[c_start:c_stop]
+        return slice(start, stop)
+
+    def count(self, values, n_jobs=None):
+        """Number of voxels with value from the given list.
+
+        `values` could be a single value or an iterable.
+        Only stored voxels are scanned, `n_jobs` is ignored.
+        """
+        values = np.asarray(list(values) if isinstance(values, set) else values)
+        result = np.count_nonzero(np.isin(self._values, values))
+        if np.isin(self.fill_value, values):
+            n_fill = np.prod(self.shape, dtype=np.int64) - len(self._flat_indices)
+            result += n_fill * int(np.prod(self.payload_shape, dtype=np.int64))
+        return result
+
+    def value_counts(self):
+        """Number of voxels with each value, as pandas Series indexed by (sorted) values.
+
+        Only stored voxels are scanned.
+        """
+        result = _value_counts([self._values])
+        n_fill = np.prod(self.shape, dtype=np.int64) - len(self._flat_indices)
+        n_fill *= int(np.prod(self.payload_shape, dtype=np.int64))
+        if n_fill > 0:
+            fill = pd.Series([n_fill], index=np.array([self.fill_value], dtype=self.dtype))
+            result = result.add(fill, fill_value=0).astype(np.int64).sort_index()
+        if self.dtype == bool:
+            result.index = result.index.astype(bool)
+        return result
+
+    def compact(self, na_values=(0,), inplace=False, n_jobs=None):
+        """Reduce size of raw data by clipping N/A values.
+
+        Only stored voxels are scanned if `fill_value` is one of `na_values`.
+
+        Args:
+            na_values(tuple): values to clip
+            inplace(bool): modify data inplace
+            n_jobs(int): number of threads if the data has to be densified
+                (see `voxcell.parallel`)
+
+        Returns:
+            None if `inplace` is True, new SparseVoxelData otherwise
+        """
+        if not np.isin(self.fill_value, na_values):
+            result = SparseVoxelData.from_dense(
+                self.to_dense().compact(na_values, n_jobs=n_jobs), self.fill_value
+            )
+        else:
+            keep = np.logical_not(np.isin(self._values, na_values))
+            if self.payload_shape:
+                keep = np.any(keep, axis=tuple(range(1, self._values.ndim)))
+            indices = self.indices[keep]
+            if len(indices) == 0:
+                raise VoxcellError("No voxels to keep")
+            aabb = math_utils.positions_minimum_aabb(indices)
+            result = SparseVoxelData(
+                indices - aabb[0],
+                self._values[keep],
+                aabb[1] - aabb[0] + 1,
+                self.voxel_dimensions,
+                self.indices_to_positions(aabb[0]),
+                fill_value=self.fill_value,
+                directions=self.directions,
+            )
+
+        if inplace:
+            self.__dict__.update(result.__dict__)
+            return None
+        return result
+
+    def _iter_nrrd_chunks(self):
+        """Iterate over voxel values bytes in NRRD order, one dense slab at a time."""
+        plane_size = int(np.prod(self.shape[:-1], dtype=np.int64))
+        voxel_size = self.dtype.itemsize * int(np.prod(self.payload_shape, dtype=np.int64))
+        step = max(1, nrrd_utils.CHUNK_SIZE // max(1, plane_size * voxel_size))
+        # within a voxel, payload axes are stored in Fortran order as well
+        payload_axes = tuple(range(len(self.payload_shape), 0, -1))
+        for start in range(0, self.shape[-1], step):
+            stop = min(start + step, self.shape[-1])
+            slab = np.full(
+                ((stop - start) * plane_size,) + self.payload_shape, self.fill_value, self.dtype
+            )
+            lo, hi = np.searchsorted(self._flat_indices, [start * plane_size, stop * plane_size])
+            slab[self._flat_indices[lo:hi] - start * plane_size] = self._values[lo:hi]
+            if slab.dtype == bool:
+                slab = slab.view(np.uint8)
+            yield slab.transpose((0,) + payload_axes).tobytes()
+
+
+class CompressedVoxelData(_PlaceholderVoxelData):
+    """Volumetric data stored as independently compressed tiles.
+
+    Tiles are decompressed on demand (`lookup`, `count`, `save_nrrd`), keeping an LRU cache
+    of the most recently used ones; spatially coherent queries thus touch few tiles.
+    Full-volume operations (`compact`, `clip`, `save_h5`, etc.) process slabs aligned on tiles.
+    `raw` is materialized as a read-only dense array on each access; assigning `raw`
+    compresses the new values.
+    """
+    def __init__(
+        self, raw, voxel_dimensions, offset=None, *, tile_shape=64, compression_level=1,
+        cache_size=64, directions=None,
+    ):
+        """Init CompressedVoxelData.
+
+        Args:
+            raw(numpy.ndarray): actual voxel values (compressed tile by tile)
+            voxel_dimensions(tuple of numbers): size of each voxel in space.
+            offset(tuple of numbers): offset from an external atlas origin
+            tile_shape(int|tuple of ints): number of voxels in each dimension of a tile
+            compression_level(int): zlib compression level (1-9)
+            cache_size(int): maximal number of decompressed tiles kept in memory
+            directions(np.array of NxN): directions of the voxel axes in space
+                (see `VoxelData`)
+        """
+        self._tile_shape = tile_shape
+        self.compression_level = compression_level
+        self.cache_size = cache_size
+        self._tiles = None
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        super().__init__(raw, voxel_dimensions, offset, directions=directions)
+
+    @property
+    def raw(self):
+        """Voxel values as a read-only dense array (materialized on each access)."""
+        result = np.empty(self.shape + self.payload_shape, dtype=self.dtype)
+        for tile_index in np.ndindex(self._tiles.shape):
+            result[self._tile_slices(tile_index)] = self._get_tile(tile_index)
+        result.flags.writeable = False
+        return result
+
+    @raw.setter
+    def raw(self, value):
+        self._placeholder = np.broadcast_to(np.zeros((), dtype=value.dtype), value.shape)
+        self._tile_shape = tuple(
+            int(s) for s in np.broadcast_to(self._tile_shape, (self.ndim,))
+        )
+        grid_shape = tuple(-(-n // s) for n, s in zip(self.shape, self._tile_shape))
+        self._tiles = np.empty(grid_shape, dtype=object)
+        for tile_index in np.ndindex(grid_shape):
+            tile = np.ascontiguousarray(value[self._tile_slices(tile_index)])
+            self._tiles[tile_index] = zlib.compress(tile.tobytes(), self.compression_level)
+        self._cache.clear()
+
+    @property
+    def tile_shape(self):
+        """Number of voxels in each dimension of a tile."""
+        return self._tile_shape
+
+    @property
+    def compressed_nbytes(self):
+        """Total size of the compressed tiles in bytes."""
+        return sum(len(tile) for tile in self._tiles.flat)
+
+    def _slab_slices(self):
+        """Slices along the first axis, aligned on tiles."""
+        return parallel.slab_slices(self.shape + self.payload_shape, align=self._tile_shape[0])
+
+    def _tile_slices(self, tile_index):
+        return tuple(
+            slice(i * s, min((i + 1) * s, n))
+            for i, s, n in zip(tile_index, self._tile_shape, self.shape)
+        )
+
+    def _get_tile(self, tile_index):
+        """Decompressed tile (read-only); recently used tiles are cached."""
+        tile_index = tuple(int(i) for i in tile_index)
+        # the cache is shared by the threads of slab-wise operations (see `voxcell.parallel`)
+        with self._cache_lock:
+            result = self._cache.get(tile_index)
+            if result is not None:
+                self._cache.move_to_end(tile_index)
+                return result
+        result = self._decompress_tile(tile_index)
+        with self._cache_lock:
+            self._cache[tile_index] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _decompress_tile(self, tile_index):
+        """Decompressed tile (read-only)."""
+        tile_index = tuple(int(i) for i in tile_index)
+        shape = tuple(s.stop - s.start for s in self._tile_slices(tile_index))
+        return np.frombuffer(
+            zlib.decompress(self._tiles[tile_index]), dtype=self.dtype
+        ).reshape(shape + self.payload_shape)
+
+    def _lookup_by_indices(self, voxel_idx):
+        """Values for the given voxels."""
+        voxel_idx = np.asarray(voxel_idx)
+        idx = voxel_idx.reshape(-1, self.ndim)
+        result = np.empty((len(idx),) + self.payload_shape, dtype=self.dtype)
+        for tile_index, sel in _iter_tile_groups(idx, self._tile_shape, self._tiles.shape):
+            local_idx = idx[sel] - tile_index * self._tile_shape
+            result[sel] = self._get_tile(tile_index)[tuple(local_idx.T)]
+        return result.reshape(voxel_idx.shape[:-1] + self.payload_shape)
+
+    def _read_region(self, region):
+        """Voxel values in `region`, assembled from the tiles intersecting it."""
+        region = _normalize_region(region, self.shape)
+        result = np.empty(
+            tuple(s.stop - s.start for s in region) + self.payload_shape, dtype=self.dtype
+        )
+        tile_ranges = (
+            range(s.start // t, -(-s.stop // t)) for s, t in zip(region, self._tile_shape)
+        )
+        for tile_index in itertools.product(*tile_ranges):
+            tile_slices = self._tile_slices(tile_index)
+            lo = [max(s.start, r.start) for s, r in zip(tile_slices, region)]
+            hi = [min(s.stop, r.stop) for s, r in zip(tile_slices, region)]
+            result[tuple(slice(a - r.start, b - r.start) for a, b, r in zip(lo, hi, region))] = (
+                self._get_tile(tile_index)[
+                    tuple(slice(a - s.start, b - s.start) for a, b, s in zip(lo, hi, tile_slices))
+                ]
+            )
+        return result
+
+    def count(self, values, n_jobs=None):
+        """Number of voxels with value from the given list.
+
+        `values` could be a single value or an iterable.
+        Tiles are decompressed (bypassing the cache) on `n_jobs` threads (see `voxcell.parallel`).
+        """
+        values = np.ravel(list(values) if isinstance(values, set) else values)
+        return sum(parallel.map_chunks(
+            lambda tile_index: np.count_nonzero(
+                math_utils.isin(self._decompress_tile(tile_index), values, n_jobs=1)
+            ),
+            np.ndindex(self._tiles.shape),
+            n_jobs=n_jobs,
+        ))
+
+    def _iter_value_blocks(self):
+        """Iterate over blocks of voxel values covering the whole data, one tile at a time."""
+        for tile_index in np.ndindex(self._tiles.shape):
+            yield self._get_tile(tile_index)
+
+    def _iter_nrrd_chunks(self):
+        """Iterate over voxel values bytes in NRRD order, one row of tiles at a time."""
+        for k in range(self._tiles.shape[-1]):
+            slab_slice = self._tile_slices((0,) * (self.ndim - 1) + (k,))[-1]
+            slab = np.empty(
+                self.shape[:-1] + (slab_slice.stop - slab_slice.start,) + self.payload_shape,
+                dtype=self.dtype,
+            )
+            for tile_index in np.ndindex(self._tiles.shape[:-1]):
+                tile_index = tile_index + (k,)
+                slab[self._tile_slices(tile_index)[:-1]] = self._get_tile(tile_index)
+            yield from nrrd_utils.iter_chunks(_pivot_axes(slab, self.ndim))
+
+
+def _evaluate_operand(operand, region):
+    """Block of `operand` (DelayedVoxelData or constant) in `region`."""
+    if isinstance(operand, DelayedVoxelData):
+        return operand._evaluate(region)  # pylint: disable=protected-access
+    return operand
+
+
+def _operand_sample(operand):
+    """Empty block with the dtype and payload shape of `operand` (DelayedVoxelData or constant)."""
+    if isinstance(operand, DelayedVoxelData):
+        return operand._placeholder[:0]  # pylint: disable=protected-access
+    return operand
+
+
+def _binary_operator(op):
+    """Get DelayedVoxelData method applying binary operator `op` block by block."""
+    def _method(self, other):
+        return self.map_blocks(op, other)
+    return _method
+
+
+def _reflected_operator(op):
+    """Get DelayedVoxelData method applying binary operator `op` with swapped operands."""
+    def _method(self, other):
+        return self.map_blocks(lambda block, other_block: op(other_block, block), other)
+    return _method
+
+
+def _where(mask, values, other):
+    """Block of `values` where `mask` is True, `other` elsewhere."""
+    mask = np.asarray(mask)
+    return np.where(mask.reshape(mask.shape + (1,) * (values.ndim - mask.ndim)), values, other)
+
+
+class DelayedVoxelData(_PlaceholderVoxelData):
+    """Volumetric data defined by an expression over other volumetric data, evaluated lazily.
+
+    Arithmetic, comparison and bitwise operators, as well as `isin`, `where`, `astype`,
+    `map_blocks` and `reduce`, return a new DelayedVoxelData combining the per-block
+    expressions of their operands; no full-size intermediate is created.
+    The expression is evaluated block by block when the data is consumed: `compute`,
+    `save_nrrd`, `save_h5`, `count`, `value_counts`, `lookup`, etc.
+    `raw` is evaluated on each access.
+
+    Example:
+        >>> regions = DelayedVoxelData.from_voxel_data(brain_regions)
+        >>> density = DelayedVoxelData.from_voxel_data(density)
+        >>> (regions.isin(ids) & (density > 0)).where(density * 2).save_nrrd('out.nrrd')
+    """
+    __array_ufunc__ = None  # let NumPy arrays defer to the reflected operators
+
+    def __init__(self, evaluate, raw_shape, dtype, voxel_dimensions, offset=None, *,
+                 directions=None):
+        """Init DelayedVoxelData.
+
+        Args:
+            evaluate: callable returning the voxel values in a region, given as
+                a tuple of unit-step slices (one per spatial axis)
+            raw_shape(tuple of ints): shape of the voxel values array
+            dtype: data type of the voxel values
+            voxel_dimensions(tuple of numbers): size of each voxel in space.
+            offset(tuple of numbers): offset from an external atlas origin
+            directions(np.array of NxN): directions of the voxel axes in space
+                (see `VoxelData`)
+        """
+        # zero-strided placeholder with the expected shape and dtype, occupying no memory
+        placeholder = np.broadcast_to(np.zeros((), dtype=dtype), tuple(raw_shape))
+        super().__init__(placeholder, voxel_dimensions, offset, directions=directions)
+        self._evaluate = evaluate
+
+    @classmethod
+    def from_voxel_data(cls, voxel_data):
+        """Create DelayedVoxelData reading the voxel values of `voxel_data` block by block."""
+        if isinstance(voxel_data, DelayedVoxelData):
+            return voxel_data
+        return cls(
+            voxel_data._read_region,  # pylint: disable=protected-access
+            voxel_data.shape + voxel_data.payload_shape,
+            voxel_data.dtype,
+            voxel_data.voxel_dimensions,
+            voxel_data.offset,
+            directions=voxel_data.directions,
+        )
+
+    @property
+    def raw(self):
+        """Voxel values as a dense array (evaluated on each access)."""
+        return self.compute().raw
+
+    @raw.setter
+    def raw(self, value):
+        # only used by VoxelData.__init__ to pass the placeholder
+        self._placeholder = value
+
+    def _as_operand(self, other):
+        """Get DelayedVoxelData for VoxelData `other` on the same grid; constants are kept as is."""
+        if not isinstance(other, VoxelData):
+            return other
+        _check_same_grid(self, other)
+        return DelayedVoxelData.from_voxel_data(other)
+
+    __add__ = _binary_operator(operator.add)
+    __radd__ = _reflected_operator(operator.add)
+    __sub__ = _binary_operator(operator.sub)
+    __rsub__ = _reflected_operator(operator.sub)
+    __mul__ = _binary_operator(operator.mul)
+    __rmul__ = _reflected_operator(operator.mul)
+    __truediv__ = _binary_operator(operator.truediv)
+    __rtruediv__ = _reflected_operator(operator.truediv)
+    __floordiv__ = _binary_operator(operator.floordiv)
+    __rfloordiv__ = _reflected_operator(operator.floordiv)
+    __mod__ = _binary_operator(operator.mod)
+    __rmod__ = _reflected_operator(operator.mod)
+    __pow__ = _binary_operator(operator.pow)
+    __rpow__ = _reflected_operator(operator.pow)
+    __and__ = _binary_operator(operator.and_)
+    __rand__ = _reflected_operator(operator.and_)
+    __or__ = _binary_operator(operator.or_)
+    __ror__ = _reflected_operator(operator.or_)
+    __xor__ = _binary_operator(operator.xor)
+    __rxor__ = _reflected_operator(operator.xor)
+    __lt__ = _binary_operator(operator.lt)
+    __le__ = _binary_operator(operator.le)
+    __gt__ = _binary_operator(operator.gt)
+    __ge__ = _binary_operator(operator.ge)
+    __eq__ = _binary_operator(operator.eq)
+    __ne__ = _binary_operator(operator.ne)
+    __hash__ = None  # `==` builds an expression instead of comparing objects
+
+    def __neg__(self):
+        """Negate voxel values, block by block."""
+        return self.map_blocks(operator.neg)
+
+    def __invert__(self):
+        """Invert voxel values, block by block."""
+        return self.map_blocks(operator.invert)
+
+    def __abs__(self):
+        """Absolute value of voxel values, block by block."""
+        return self.map_blocks(operator.abs)
+
+    def map_blocks(self, func, *others):
+        """Apply `func` block by block.
+
+        Args:
+            func: callable taking the voxel values of a block of this data, followed by
+                the corresponding values of `others`, and returning the new values;
+                it must not modify its arguments in place
+            others: VoxelData on the same voxel grid, or constants passed as is
+
+        Returns:
+            DelayedVoxelData
+        """
+        operands = (self,) + tuple(self._as_operand(other) for other in others)
+        sample = np.asarray(func(*map(_operand_sample, operands)))
+
+        def _evaluate(region):
+            return func(*(_evaluate_operand(operand, region) for operand in operands))
+
+        return DelayedVoxelData(
+            _evaluate,
+            self.shape + sample.shape[self.ndim:],
+            sample.dtype,
+            self.voxel_dimensions,
+            self.offset,
+            directions=self.directions,
+        )
+
+    def isin(self, values):
+        """Boolean DelayedVoxelData: whether voxel values are in the given list."""
+        values = np.ravel(list(values) if isinstance(values, set) else values)
+        return self.map_blocks(lambda block: math_utils.isin(block, values, n_jobs=1))
+
+    def where(self, values, other=0):
+        """Get DelayedVoxelData with `values` where this (boolean) data is True, `other` elsewhere.
+
+        `values` and `other` could be VoxelData on the same voxel grid or constants.
+        """
+        return self.map_blocks(_where, values, other)
+
+    def astype(self, dtype):
+        """Get DelayedVoxelData with voxel values cast to `dtype`."""
+        return self.map_blocks(lambda block: block.astype(dtype, copy=False))
+
+    def compute(self, n_jobs=None):
+        """Evaluate the expression, one slab at a time.
+
+        Args:
+            n_jobs(int): number of threads (see `voxcell.parallel`)
+
+        Returns:
+            VoxelData with the voxel values
+        """
+        raw_shape = self.shape + self.payload_shape
+        raw = np.empty(raw_shape, dtype=self.dtype)
+
+        def _compute_slab(slab):
+            raw[slab] = self._read_region((slab,))
+
+        parallel.map_chunks(_compute_slab, parallel.slab_slices(raw_shape), n_jobs=n_jobs)
+        return VoxelData(raw, self.voxel_dimensions, self.offset, directions=self.directions)
+
+    def _read_region(self, region):
+        """Voxel values in `region`, evaluated."""
+        return np.asarray(self._evaluate(_normalize_region(region, self.shape)))
+
+    def _lookup_by_indices(self, voxel_idx):
+        """Values for the given voxels, evaluated tile by tile over the voxels of each tile."""
+        voxel_idx = np.asarray(voxel_idx)
+        idx = voxel_idx.reshape(-1, self.ndim)
+        tile_shape = (_CONTIGUOUS_TILE_SIZE,) * self.ndim
+        grid_shape = tuple(-(-n // s) for n, s in zip(self.shape, tile_shape))
+        result = np.empty((len(idx),) + self.payload_shape, dtype=self.dtype)
+        for _, sel in _iter_tile_groups(idx, tile_shape, grid_shape):
+            tile_idx = idx[sel]
+            lo, hi = tile_idx.min(axis=0), tile_idx.max(axis=0)
+            block = self._read_region(tuple(slice(a, b + 1) for a, b in zip(lo, hi)))
+            result[sel] = block[tuple((tile_idx - lo).T)]
+        return result.reshape(voxel_idx.shape[:-1] + self.payload_shape)
+
+    def _iter_nrrd_chunks(self):
+        """Iterate over voxel values bytes in NRRD order, evaluating one slab at a time."""
+        return _iter_nrrd_slabs(self)
+
+    @staticmethod
+    def reduce(function, iterable, prefetch=False):
+        """Return a DelayedVoxelData reducing the voxel values of VoxelData objects in iterable.
+
+        Elements are combined block by block when the result is evaluated.
+        NRRD paths must be raw-encoded: each block is read through memory mapping,
+        and no data is kept between blocks (use `VoxelData.reduce` for compressed files).
+
+        Args:
+            function (Callable[[np.array, np.array], np.array]): the function to be
+                applied to numpy arrays
+            iterable (Iterable[VoxelData|str|pathlib.Path]): VoxelData objects or NRRD paths
+            prefetch (bool): ignored, for compatibility with `VoxelData.reduce`
+        """
+        # pylint: disable=unused-argument
+        elements = [
+            _delayed_nrrd(element) if isinstance(element, (str, os.PathLike)) else element
+            for element in iterable
+        ]
+        if not elements:
+            raise TypeError('Attempting to reduce an empty sequence')
+        first = DelayedVoxelData.from_voxel_data(elements[0])
+        operands = [first] + [
+            first._as_operand(element)  # pylint: disable=protected-access
+            for element in elements[1:]
+        ]
+        sample = np.asarray(functools.reduce(function, map(_operand_sample, operands)))
+        ufunc = function if isinstance(function, np.ufunc) else _INPLACE_OPERATORS.get(function)
+
+        def _evaluate(region):
+            # blocks are read one at a time and folded into the accumulated block,
+            # in place once it is a new array (as in `VoxelData.reduce`)
+            blocks = (_evaluate_operand(operand, region) for operand in operands)
+            result, owned = next(blocks), False
+            for block in blocks:
+                if owned and ufunc is not None and (
+                    _ufunc_result_dtype(ufunc, result, block) == result.dtype
+                ):
+                    ufunc(result, block, out=result)
+                else:
+                    result, owned = function(result, block), True
+            return result
+
+        return DelayedVoxelData(
+            _evaluate,
+            first.shape + sample.shape[first.ndim:],
+            sample.dtype,
+            first.voxel_dimensions,
+            first.offset,
+            directions=first.directions,
+        )
+
+
+def _delayed_nrrd(nrrd_path):
+    """Get DelayedVoxelData reading a raw-encoded NRRD file through memory mapping, by blocks."""
+    header, header_size = nrrd_utils.read_header(nrrd_path)
+    if header['encoding'] != 'raw':
+        raise VoxcellError(
+            f"Only raw-encoded NRRD files are read block by block (got: '{header['encoding']}' "
+            f"for {nrrd_path}); use VoxelData.reduce instead"
+        )
+    spacings, offset, directions, _ = _parse_nrrd_region(header, None)
+    shape = nrrd_utils.data_shape(header)
+    k = len(shape) - len(spacings)
+
+    def _evaluate(region):
+        # a new memory map per block, released once the block is copied
+        data = nrrd_utils.memmap_data(nrrd_path, header, header_size)
+        return np.array(_pivot_axes(data, k)[region])
+
+    return DelayedVoxelData(
+        _evaluate,
+        shape[k:] + shape[:k],
+        nrrd_utils.data_dtype(header),
+        spacings,
+        offset,
+        directions=directions,
+    )
+
+
+class H5VoxelData(_PlaceholderVoxelData):
+    """Volumetric data read chunk by chunk from an HDF5 dataset, for volumes larger than memory.
+
+    The dataset is expected to be written by `VoxelData.save_h5`. Full-volume operations
+    (`count`, `value_counts`, `volumes`, `save_nrrd`, `save_h5`) stream slabs aligned on
+    the HDF5 chunks; `lookup` reads only the chunks containing the looked up voxels.
+    Decompressed chunks are kept in the HDF5 chunk cache, up to `cache_nbytes`.
+    `clip` and `compact` return DelayedVoxelData, evaluated chunk by chunk when consumed.
+    `raw` reads the whole dataset as a read-only array on each access.
+    """
+    def __init__(self, h5_path, dataset='raw', *, cache_nbytes=2 ** 26):
+        """Init H5VoxelData.
+
+        Args:
+            h5_path (str|pathlib.Path): path to the HDF5 file.
+            dataset (str): name of the dataset with the voxel values.
+            cache_nbytes (int): size of the HDF5 chunk cache in bytes.
+        """
+        self._h5f = h5py.File(h5_path, 'r', rdcc_nbytes=cache_nbytes)
+        self._dataset = self._h5f[dataset]
+        voxel_dimensions = self._dataset.attrs['voxel_dimensions']
+        ndim = len(voxel_dimensions)
+        self._chunk_shape = (self._dataset.chunks or (_CONTIGUOUS_TILE_SIZE,) * ndim)[:ndim]
+        # zero-strided placeholder with the expected shape and dtype, occupying no memory
+        placeholder = np.broadcast_to(
+            np.zeros((), dtype=self._dataset.dtype), self._dataset.shape
+        )
+        super().__init__(
+            placeholder,
+            voxel_dimensions,
+            self._dataset.attrs['offset'],
+            directions=self._dataset.attrs.get('directions'),
+        )
+
+    def close(self):
+        """Close the underlying HDF5 file."""
+        self._h5f.close()
+
+    def __enter__(self):
+        """Use as a context manager closing the file on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the underlying HDF5 file."""
+        self.close()
+
+    @property
+    def raw(self):
+        """Voxel values as a read-only dense array (read from the file on each access)."""
+        result = self._dataset[()]
+        result.flags.writeable = False
+        return result
+
+    @raw.setter
+    def raw(self, value):
+        # only used by VoxelData.__init__ to pass the placeholder
+        self._placeholder = value
+
+    @property
+    def chunk_shape(self):
+        """Number of voxels in each dimension of an HDF5 chunk."""
+        return self._chunk_shape
+
+    def _read_region(self, region):
+        """Voxel values in `region`, read from the file."""
+        return self._dataset[_normalize_region(region, self.shape)]
+
+    def _slab_slices(self):
+        """Slices along the first axis, aligned on HDF5 chunks."""
+        return parallel.slab_slices(self.shape + self.payload_shape, align=self._chunk_shape[0])
+
+    def _lookup_by_indices(self, voxel_idx):
+        """Values for the given voxels, reading the chunks containing them."""
+        voxel_idx = np.asarray(voxel_idx)
+        idx = voxel_idx.reshape(-1, self.ndim)
+        grid_shape = tuple(-(-n // c) for n, c in zip(self.shape, self._chunk_shape))
+        result = np.empty((len(idx),) + self.payload_shape, dtype=self.dtype)
+        for chunk_index, sel in _iter_tile_groups(idx, self._chunk_shape, grid_shape):
+            start = chunk_index * self._chunk_shape
+            region = tuple(slice(a, a + c) for a, c in zip(start, self._chunk_shape))
+            result[sel] = self._read_region(region)[tuple((idx[sel] - start).T)]
+        return result.reshape(voxel_idx.shape[:-1] + self.payload_shape)
+
+    def _iter_nrrd_chunks(self):
+        """Iterate over voxel values bytes in NRRD order, one slab of chunks at a time."""
+        return _iter_nrrd_slabs(self, align=self._chunk_shape[-1])
+
+    def clip(self, bbox, na_value=0, inplace=False, n_jobs=None):
+        """Assign `na_value` to voxels outside of axis-aligned bounding box.
+
+        Args:
+            bbox: bounding box in real-world coordinates
+            na_value: value to use for voxels outside of bbox
+            inplace(bool): not supported
+            n_jobs(int): ignored, the result is evaluated when consumed
+
+        Returns:
+            DelayedVoxelData
+        """
+        # pylint: disable=unused-argument
+        if inplace:
+            raise VoxcellError("In-place operations are not supported by H5VoxelData")
+        aa, bb = self._clip_aabb(bbox)
+
+        def _evaluate(region):
+            block = self._read_region(region)
+            for axis, (s, a, b) in enumerate(zip(region, aa, bb)):
+                index = np.arange(s.start, s.stop)
+                block[(slice(None),) * axis + ((index < a) | (index > b),)] = na_value
+            return block
+
+        return DelayedVoxelData(
+            _evaluate,
+            self.shape + self.payload_shape,
+            self.dtype,
+            self.voxel_dimensions,
+            self.offset,
+        )
+
+    def compact(self, na_values=(0,), inplace=False, n_jobs=None):
+        """Reduce size of raw data by clipping N/A values.
+
+        The bounding box of the remaining values is found reading the data slab by slab.
+
+        Args:
+            na_values(tuple): values to clip
+            inplace(bool): not supported
+            n_jobs(int): number of threads (see `voxcell.parallel`)
+
+        Returns:
+            DelayedVoxelData with the voxel values within the bounding box
+        """
+        if inplace:
+            raise VoxcellError("In-place operations are not supported by H5VoxelData")
+        aabb = self._compact_aabb(na_values, n_jobs)
+        start = aabb[0][:self.ndim]
+        payload_idx = (Ellipsis,) + tuple(slice(a, b + 1) for a, b in zip(*aabb))[self.ndim:]
+
+        def _evaluate(region):
+            region = tuple(slice(s.start + a, s.stop + a) for s, a in zip(region, start))
+            return self._read_region(region)[payload_idx]
+
+        return DelayedVoxelData(
+            _evaluate,
+            tuple(aabb[1] - aabb[0] + 1),
+            self.dtype,
+            self.voxel_dimensions,
+            self.indices_to_positions(start),
+            directions=self.directions,
+        )